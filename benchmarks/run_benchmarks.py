@@ -0,0 +1,259 @@
+"""
+Benchmark the runscripts on synthetic data, on any Linux box.
+
+Every stage runs in a subprocess on freshly generated inputs, its wall time
+and peak RSS are measured, and the results are stored as JSON. A run can be
+compared with a previous one to spot regressions:
+
+    python benchmarks/run_benchmarks.py run --members 10 --resolution 1
+    python benchmarks/run_benchmarks.py compare baseline.json current.json
+
+AIUQst_lib (from the AIUQ-engine submodule) must be importable, e.g. by
+adding its directory to PYTHONPATH. Extra environment variables for the
+runscripts (TILED, COUNTER_FORMAT, ...) are passed with --env KEY=VALUE.
+A stage still running after --timeout seconds is killed and reported as
+failed.
+"""
+
+# Built-in/Generics
+import argparse
+import json
+import os
+import platform
+import shutil
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import asdict, replace
+from datetime import date, datetime, timedelta, timezone
+
+# Local
+from synthetic import (
+    SyntheticConfig,
+    write_config,
+    write_eerie_files,
+    write_era5_temp,
+    write_model_outputs,
+    write_truth_store,
+)
+
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RUNSCRIPTS = os.path.join(REPO, "runscripts")
+RESULTS_DIR = os.path.join(REPO, "benchmarks", "results")
+
+
+def _run_script(script, config, env, timeout=None):
+    """Run one runscript, returning (wall seconds, peak RSS in MiB, return code, stderr tail)"""
+    start = time.perf_counter()
+    with tempfile.TemporaryFile() as stderr:
+        proc = subprocess.Popen(
+            [sys.executable, os.path.join(RUNSCRIPTS, script), "-c", config],
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=stderr,
+            start_new_session=True,
+        )
+        # The workers of the stage are killed with it
+        timer = threading.Timer(timeout, os.killpg, (proc.pid, signal.SIGKILL)) if timeout else None
+        if timer:
+            timer.start()
+        try:
+            _, status, usage = os.wait4(proc.pid, 0)
+        finally:
+            if timer:
+                timer.cancel()
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        wall = time.perf_counter() - start
+        stderr.seek(0)
+        tail = stderr.read().decode(errors="replace").strip().splitlines()[-5:]
+        if timeout and wall >= timeout:
+            tail.append(f"Killed after {timeout} s")
+    # ru_maxrss is in KiB on Linux
+    return wall, usage.ru_maxrss / 1024, proc.returncode, tail
+
+
+def _setup_metric_inputs(cfg, root):
+    write_model_outputs(cfg, os.path.join(root, "outputs"))
+    write_truth_store(cfg, root)
+
+
+def _setup_merger(cfg, root, env):
+    """Produce the increments of one date by running the metric jobs of every member"""
+    _setup_metric_inputs(cfg, root)
+    _run_script("probabilistic.py", write_config(cfg, root), env)
+    for member in cfg.member_names:
+        _run_script("deterministic.py", write_config(cfg, root, rng_key=member), env)
+
+
+def _setup_reduce(cfg, root, env):
+    """Shard two dates with MERGER in sharded mode, so that every counter kind is reduced in one process"""
+    env = {**env, "MERGE_MODE": "sharded"}
+    next_start = (date.fromisoformat(cfg.end) + timedelta(days=1)).isoformat()
+    for date_cfg in (cfg, replace(cfg, start=next_start, seed=cfg.seed + 1)):
+        _setup_merger(date_cfg, root, env)
+        _run_script("merger.py", write_config(date_cfg, root), env)
+
+
+# name: (runscript, input setup)
+STAGES = {
+    "resample_ground": ("resample_ground.py", lambda cfg, root, env: write_era5_temp(cfg, root)),
+    "restore_eerie": ("restore_eerie.py", lambda cfg, root, env: write_eerie_files(cfg, root)),
+    "prepare_truth": ("prepare_truth.py", lambda cfg, root, env: _setup_metric_inputs(cfg, root)),
+    "probabilistic": ("probabilistic.py", lambda cfg, root, env: _setup_metric_inputs(cfg, root)),
+    "deterministic": ("deterministic.py", lambda cfg, root, env: _setup_metric_inputs(cfg, root)),
+    "diagnostics": ("diagnostics.py", lambda cfg, root, env: _setup_metric_inputs(cfg, root)),
+    "merger": ("merger.py", _setup_merger),
+    "reduce_counters": ("reduce_counters.py", _setup_reduce),
+}
+
+
+def run(args):
+    cfg = SyntheticConfig(
+        resolution=args.resolution,
+        truth_resolution=args.truth_resolution,
+        members=args.members,
+        truth_members=args.truth_members,
+        levels=args.levels,
+        lead_times=args.lead_times,
+        variables=args.variables,
+    )
+
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [RUNSCRIPTS, env.get("PYTHONPATH", "")]))
+    env["EERIE_MEMBERS"] = " ".join(cfg.truth_member_names or ["1"])
+    for item in args.env:
+        key, _, value = item.partition("=")
+        env[key] = value
+
+    results = {}
+    for stage in args.stages:
+        script, setup = STAGES[stage]
+        walls, rss, failure = [], [], None
+
+        for _ in range(args.repeat):
+            root = tempfile.mkdtemp(prefix=f"aiuq-bench-{stage}-", dir=args.workdir)
+            try:
+                setup(cfg, root, env)
+                wall, peak, code, tail = _run_script(script, write_config(cfg, root), env, args.timeout)
+            finally:
+                shutil.rmtree(root, ignore_errors=True)
+
+            if code != 0:
+                failure = {"returncode": code, "stderr": tail}
+                break
+            walls.append(wall)
+            rss.append(peak)
+
+        if failure:
+            results[stage] = failure
+            print(f"{stage:>16}: FAILED ({failure['returncode']}) {' | '.join(failure['stderr'][-1:])}")
+            continue
+
+        results[stage] = {
+            "wall_s": walls,
+            "median_wall_s": statistics.median(walls),
+            "peak_rss_mib": max(rss),
+        }
+        print(f"{stage:>16}: {statistics.median(walls):8.2f} s  {max(rss):8.1f} MiB")
+
+    record = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "host": {"node": platform.node(), "cpus": len(os.sched_getaffinity(0)), "python": platform.python_version()},
+        "params": asdict(cfg),
+        "env": args.env,
+        "stages": results,
+    }
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{record['timestamp'].replace(':', '')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(record, f, indent=2)
+    print(f"Results written to {output}")
+
+    if args.baseline:
+        return compare_files(args.baseline, output, args.threshold)
+    return 1 if any("returncode" in result for result in results.values()) else 0
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "-C", REPO, "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_files(baseline_path, current_path, threshold):
+    """Print the relative change of every stage and return 1 if any regressed beyond threshold"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    with open(current_path) as f:
+        current = json.load(f)
+
+    if baseline["params"] != current["params"]:
+        print("[WARNING] The two runs used different synthetic parameters")
+
+    regressed = False
+    for stage, result in current["stages"].items():
+        reference = baseline["stages"].get(stage)
+        if reference is None or "returncode" in reference:
+            print(f"{stage:>16}: no baseline")
+            continue
+        if "returncode" in result:
+            print(f"{stage:>16}: FAILED")
+            regressed = True
+            continue
+
+        flags = []
+        for key, label in (("median_wall_s", "time"), ("peak_rss_mib", "rss")):
+            change = result[key] / reference[key] - 1 if reference[key] else 0.0
+            flags.append(f"{label} {change:+7.1%}")
+            if change > threshold:
+                flags[-1] += " REGRESSION"
+                regressed = True
+        print(f"{stage:>16}: " + "  ".join(flags))
+
+    return 1 if regressed else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_run = sub.add_parser("run", help="benchmark the stages on synthetic data")
+    p_run.add_argument("--stages", nargs="+", choices=list(STAGES), default=list(STAGES))
+    p_run.add_argument("--resolution", type=float, default=SyntheticConfig.resolution)
+    p_run.add_argument("--truth-resolution", type=float, default=SyntheticConfig.truth_resolution)
+    p_run.add_argument("--members", type=int, default=SyntheticConfig.members)
+    p_run.add_argument("--truth-members", type=int, default=SyntheticConfig.truth_members)
+    p_run.add_argument("--levels", type=int, default=SyntheticConfig.levels)
+    p_run.add_argument("--lead-times", type=int, default=SyntheticConfig.lead_times)
+    p_run.add_argument("--variables", nargs="+", default=["t"])
+    p_run.add_argument("--repeat", type=int, default=3)
+    p_run.add_argument("--env", action="append", default=[], metavar="KEY=VALUE")
+    p_run.add_argument("--timeout", type=float, default=3600, help="seconds after which a stage is killed")
+    p_run.add_argument("--workdir", default=None, help="where inputs are generated (default: system temp)")
+    p_run.add_argument("--output", default=None, help=f"results file (default: {RESULTS_DIR}/<timestamp>.json)")
+    p_run.add_argument("--baseline", default=None, help="results file to compare with")
+    p_run.add_argument("--threshold", type=float, default=0.2, help="relative slowdown flagged as regression")
+
+    p_cmp = sub.add_parser("compare", help="compare two results files")
+    p_cmp.add_argument("baseline")
+    p_cmp.add_argument("current")
+    p_cmp.add_argument("--threshold", type=float, default=0.2)
+
+    args = parser.parse_args()
+    if args.command == "run":
+        sys.exit(run(args))
+    sys.exit(compare_files(args.baseline, args.current, args.threshold))
+
+
+if __name__ == "__main__":
+    main()
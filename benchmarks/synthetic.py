@@ -0,0 +1,202 @@
+"""
+Synthetic inputs for the runscripts, with the layout they read on
+MareNostrum5:
+- model outputs  {OUTPUT_PATH}/{var}/{member}/out-{start}-{end}-{member}-{var}.nc
+- truth store    {HPCROOTDIR}/truth/{start}/truth_store.zarr
+- ERA5 temp      {HPCROOTDIR}/truth/{start}/truth_store_temp.zarr (6-hourly)
+- EERIE files    {HPCROOTDIR}/truth/temp/{start}/{var}/{member}/{var}_{YYYYMMDD}.nc
+- config         {HPCROOTDIR}/config.yml
+
+Usable as a module by run_benchmarks.py or from the command line.
+"""
+
+# Built-in/Generics
+import argparse
+import os
+from dataclasses import asdict, dataclass, field
+
+# Third party
+import numpy as np
+import pandas as pd
+import xarray as xr
+import yaml
+
+
+LONG_NAMES = {
+    "t": "temperature",
+    "u": "u_component_of_wind",
+    "v": "v_component_of_wind",
+    "z": "geopotential",
+}
+ALL_LEVELS = [1000, 925, 850, 700, 600, 500, 400, 300, 250, 200, 150, 100, 70, 50, 30, 20, 10]
+
+
+@dataclass
+class SyntheticConfig:
+    resolution: float = 2.0          # model grid spacing, degrees
+    truth_resolution: float = 1.0    # truth grid spacing, degrees
+    members: int = 4                 # forecast members
+    truth_members: int = 3           # truth members (EERIE-like), 0 for a single truth
+    levels: int = 4                  # pressure levels
+    lead_times: int = 5              # daily lead times
+    variables: list = field(default_factory=lambda: ["t"])
+    start: str = "2000-01-01"
+    seed: int = 0
+
+    @property
+    def end(self):
+        return str((pd.Timestamp(self.start) + pd.Timedelta(days=self.lead_times - 1)).date())
+
+    @property
+    def member_names(self):
+        return [str(m) for m in range(1, self.members + 1)]
+
+    @property
+    def truth_member_names(self):
+        return [str(m) for m in range(1, self.truth_members + 1)]
+
+    @property
+    def level_values(self):
+        return ALL_LEVELS[: self.levels]
+
+
+def _grid(resolution, descending_latitude, longitude_start):
+    latitude = np.arange(-90, 90 + resolution / 2, resolution)
+    if descending_latitude:
+        latitude = latitude[::-1]
+    longitude = np.arange(longitude_start, longitude_start + 360, resolution)
+    return latitude, longitude
+
+
+def _field(rng, shape, base=280.0, scale=5.0):
+    return (base + scale * rng.standard_normal(shape)).astype("float32")
+
+
+def write_model_outputs(cfg, output_path, members=None):
+    """One netCDF per member and variable, on a 0-360 grid with descending latitudes"""
+    rng = np.random.default_rng(cfg.seed)
+    latitude, longitude = _grid(cfg.resolution, True, 0.0)
+    valid_time = pd.date_range(cfg.start, periods=cfg.lead_times, freq="1D")
+
+    for var in cfg.variables:
+        for member in members or cfg.member_names:
+            directory = f"{output_path}/{var}/{member}"
+            os.makedirs(directory, exist_ok=True)
+            shape = (len(valid_time), cfg.levels, len(latitude), len(longitude))
+            ds = xr.Dataset(
+                {LONG_NAMES.get(var, var): (("valid_time", "level", "latitude", "longitude"), _field(rng, shape))},
+                coords={"valid_time": valid_time, "level": cfg.level_values, "latitude": latitude, "longitude": longitude},
+            )
+            ds.to_netcdf(f"{directory}/out-{cfg.start}-{cfg.end}-{member}-{var}.nc")
+
+
+def write_truth_store(cfg, hpcrootdir):
+    """Daily truth on (member, time, level, latitude, longitude), one day beyond the last lead time"""
+    rng = np.random.default_rng(cfg.seed + 1)
+    latitude, longitude = _grid(cfg.truth_resolution, False, -180.0)
+    time = pd.date_range(cfg.start, periods=cfg.lead_times + 1, freq="1D")
+
+    data_vars = {}
+    for var in cfg.variables:
+        dims = ("time", "level", "latitude", "longitude")
+        shape = (len(time), cfg.levels, len(latitude), len(longitude))
+        if cfg.truth_members:
+            dims = ("member",) + dims
+            shape = (cfg.truth_members,) + shape
+        data_vars[var] = (dims, _field(rng, shape))
+
+    coords = {"time": time, "level": cfg.level_values, "latitude": latitude, "longitude": longitude}
+    if cfg.truth_members:
+        coords["member"] = cfg.truth_member_names
+    path = os.path.join(hpcrootdir, "truth", cfg.start, "truth_store.zarr")
+    xr.Dataset(data_vars, coords=coords).chunk({"time": 1}).to_zarr(path, mode="w", zarr_format=2)
+
+
+def write_era5_temp(cfg, hpcrootdir):
+    """6-hourly ERA5-like store, as left by GET_GROUND_TRUTH"""
+    rng = np.random.default_rng(cfg.seed + 2)
+    latitude, longitude = _grid(cfg.truth_resolution, True, 0.0)
+    time = pd.date_range(cfg.start, periods=4 * cfg.lead_times, freq="6h")
+
+    shape = (len(time), cfg.levels, len(latitude), len(longitude))
+    ds = xr.Dataset(
+        {LONG_NAMES.get(var, var): (("time", "level", "latitude", "longitude"), _field(rng, shape)) for var in cfg.variables},
+        coords={"time": time, "level": cfg.level_values, "latitude": latitude, "longitude": longitude},
+    )
+    path = os.path.join(hpcrootdir, "truth", cfg.start, "truth_store_temp.zarr")
+    ds.chunk({"time": 4}).to_zarr(path, mode="w", zarr_format=2)
+
+
+def write_eerie_files(cfg, hpcrootdir):
+    """Daily EERIE-like netCDF files, as left by copy_eerie_ground.sh"""
+    rng = np.random.default_rng(cfg.seed + 3)
+    latitude, longitude = _grid(cfg.truth_resolution, False, -180.0)
+
+    for var in cfg.variables:
+        for member in cfg.truth_member_names or ["1"]:
+            directory = os.path.join(hpcrootdir, "truth", "temp", cfg.start, var, member)
+            os.makedirs(directory, exist_ok=True)
+            for day in pd.date_range(cfg.start, periods=cfg.lead_times, freq="1D"):
+                shape = (1, cfg.levels, len(latitude), len(longitude))
+                ds = xr.Dataset(
+                    {
+                        var: (("time", "isobaricInhPa", "latitude", "longitude"), _field(rng, shape)),
+                        "time_bnds": (("time", "bnds"), np.zeros((1, 2))),
+                    },
+                    coords={"time": [day], "isobaricInhPa": cfg.level_values, "latitude": latitude, "longitude": longitude},
+                )
+                ds.to_netcdf(os.path.join(directory, f"{var}_{day:%Y%m%d}.nc"))
+
+
+def write_config(cfg, hpcrootdir, rng_key=None):
+    """Flat job configuration, as read by read_config"""
+    config = {
+        "START_TIME": cfg.start,
+        "END_TIME": cfg.end,
+        "HPCROOTDIR": hpcrootdir,
+        "OUTPUT_PATH": os.path.join(hpcrootdir, "outputs"),
+        "OUT_VARS": list(cfg.variables),
+        "OUT_LEVS": "[" + ", ".join(str(level) for level in cfg.level_values) + "]",
+        "MEMBERS": " ".join(cfg.member_names),
+        "RNG_KEY": rng_key or cfg.member_names[0],
+        "IC_NAME": "era5",
+        "STD_VERSION": "v1",
+    }
+    path = os.path.join(hpcrootdir, f"config-{config['RNG_KEY']}.yml")
+    with open(path, "w") as f:
+        yaml.safe_dump(config, f)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("root", help="HPCROOTDIR to populate")
+    parser.add_argument("--resolution", type=float, default=SyntheticConfig.resolution)
+    parser.add_argument("--truth-resolution", type=float, default=SyntheticConfig.truth_resolution)
+    parser.add_argument("--members", type=int, default=SyntheticConfig.members)
+    parser.add_argument("--truth-members", type=int, default=SyntheticConfig.truth_members)
+    parser.add_argument("--levels", type=int, default=SyntheticConfig.levels)
+    parser.add_argument("--lead-times", type=int, default=SyntheticConfig.lead_times)
+    parser.add_argument("--variables", nargs="+", default=["t"])
+    args = parser.parse_args()
+
+    cfg = SyntheticConfig(
+        resolution=args.resolution,
+        truth_resolution=args.truth_resolution,
+        members=args.members,
+        truth_members=args.truth_members,
+        levels=args.levels,
+        lead_times=args.lead_times,
+        variables=args.variables,
+    )
+    root = os.path.abspath(args.root)
+    write_model_outputs(cfg, os.path.join(root, "outputs"))
+    write_truth_store(cfg, root)
+    write_era5_temp(cfg, root)
+    write_eerie_files(cfg, root)
+    print(write_config(cfg, root))
+    print(asdict(cfg))
+
+
+if __name__ == "__main__":
+    main()
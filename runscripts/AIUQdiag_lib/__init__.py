@@ -0,0 +1,6 @@
+"""
+Shared helpers for the AIUQ-diagnostic runscripts.
+
+The runscripts are executed as ``python3 runscripts/<script>.py``, so this
+package is importable from every one of them without installation.
+"""
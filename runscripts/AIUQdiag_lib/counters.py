@@ -0,0 +1,345 @@
+"""
+Storage of the accumulated metric counters.
+
+Two formats are supported:
+- netcdf: the whole counter is read, summed with the increment and atomically
+  rewritten at every merge.
+- zarr: the counter is a chunked store with a fixed (member, lead_time, level,
+  latitude, longitude) schema. A merge only reads and rewrites the chunks of
+  the members and lead times it contributes to, so its cost does not depend
+  on how many dates are already accumulated.
+
+Sums are either added plainly or with Kahan compensation. A compensated
+counter holds, next to every sum, a <name>_compensation variable with the
+rounding error lost by the additions: the accurate total is
+sum - compensation. This keeps float32 counters accurate over thousands
+of start dates.
+
+Both formats are written with the storage policy of the counters (see
+AIUQdiag_lib.storage).
+
+The global attributes of a counter (e.g. its ledger, see AIUQdiag_lib.ledger)
+are written together with its sums: netCDF counters are replaced atomically,
+and the regions updated in place in a Zarr counter are first written with
+its new attributes to a journal next to the store, <path>.journal, then
+applied. A journal left by an interrupted update is applied again before
+the next one, so every update is counted exactly once.
+"""
+
+# Built-in/Generics
+import glob
+import json
+import os
+import shutil
+import uuid
+from dataclasses import replace
+
+# Third party
+import numpy as np
+import xarray as xr
+import zarr
+
+# Local
+from AIUQdiag_lib.storage import StoragePolicy, write_netcdf
+
+
+COUNTER_EXTENSIONS = {"netcdf": "nc", "zarr": "zarr"}
+COUNTER_CHUNKS = {"member": 1, "lead_time": 1, "level": 1}
+ACCUMULATIONS = ("plain", "kahan")
+COMPENSATION_SUFFIX = "_compensation"
+JOURNAL_SUFFIX = ".journal"
+
+
+def counter_path(base, kind, fmt="netcdf"):
+    """Path of the counter of one kind (deterministic/probabilistic) under base"""
+    if fmt not in COUNTER_EXTENSIONS:
+        raise ValueError(f"Unknown COUNTER_FORMAT: {fmt!r}, expected one of {list(COUNTER_EXTENSIONS)}")
+    return f"{base}/metrics-counter-{kind}.{COUNTER_EXTENSIONS[fmt]}"
+
+
+def compensation_name(name: str) -> str:
+    return f"{name}{COMPENSATION_SUFFIX}"
+
+
+def _sums(ds):
+    return [
+        name for name, da in ds.data_vars.items()
+        if not name.endswith(COMPENSATION_SUFFIX) and np.issubdtype(da.dtype, np.floating)
+    ]
+
+
+def _counter_policy(policy, ds):
+    """policy, storing every compensation of ds in the dtype of its sum"""
+    policy = policy or StoragePolicy()
+    dtypes = {compensation_name(name): policy.dtype(name, ds[name].dtype) for name in _sums(ds)}
+    return replace(policy, dtypes={**dtypes, **policy.dtypes})
+
+
+def safe_write_netcdf(ds: xr.Dataset, path: str, policy=None) -> None:
+    # scritto su tmp e rimpiazzato atomicamente da write_netcdf
+    write_netcdf(ds, path, _counter_policy(policy, ds))
+
+
+def with_compensation(ds: xr.Dataset) -> xr.Dataset:
+    """ds with a zero compensation for every sum that has none"""
+    missing = {
+        compensation_name(name): xr.zeros_like(ds[name])
+        for name in _sums(ds) if compensation_name(name) not in ds
+    }
+    return ds.assign(missing) if missing else ds
+
+
+def _kahan_add(ds_counter, ds_incr):
+    """Compensated sum of two compensated counters, in the dtype of their sums"""
+    ds_counter, ds_incr = with_compensation(ds_counter), with_compensation(ds_incr)
+    total = {}
+    for name in _sums(ds_counter):
+        if name not in ds_incr:
+            continue
+        comp = compensation_name(name)
+        y = (ds_incr[name] - ds_incr[comp]) - ds_counter[comp]
+        t = ds_counter[name] + y
+        total[comp] = (t - ds_counter[name]) - y
+        total[name] = t
+    return xr.Dataset(total)
+
+
+def add_counters(ds_counter: xr.Dataset, ds_incr: xr.Dataset, compensated: bool = False) -> xr.Dataset:
+    """
+    Sum two counters on the union of their coordinates, missing values
+    counting as 0. Variables of ds_counter missing from ds_incr are kept as
+    they are, e.g. the compensations of a counter summed plainly, which
+    still correct the sums, or the unmembered sums of a resumed merge.
+    """
+    ds_counter, ds_incr = xr.align(ds_counter, ds_incr, join="outer")
+    ds_counter, ds_incr = ds_counter.fillna(0), ds_incr.fillna(0)
+    total = _kahan_add(ds_counter, ds_incr) if compensated else ds_counter + ds_incr
+    kept = [name for name in ds_counter.data_vars if name not in total]
+    return total.assign({name: ds_counter[name] for name in kept}) if kept else total
+
+
+def _prepare_increment(ds_incr, policy, compensated):
+    """Increment in the stored dtypes, so that compensated sums are exact in them"""
+    ds_incr = policy.cast(ds_incr)
+    return with_compensation(ds_incr) if compensated else ds_incr
+
+
+def update_netcdf_counter(ds_incr: xr.Dataset, path: str, attrs=None, policy=None, compensated=False) -> None:
+    """Add ds_incr to the netCDF counter at path, creating it if missing"""
+    policy = policy or StoragePolicy()
+    ds_incr = _prepare_increment(ds_incr, policy, compensated)
+
+    if not os.path.exists(path):
+        ds_new = ds_incr.copy()
+        ds_new.attrs = {**ds_incr.attrs, **(attrs or {})}
+        safe_write_netcdf(ds_new, path, policy)
+        return
+
+    ds_counter = xr.open_dataset(path)
+    ds_new = add_counters(ds_counter, ds_incr, compensated)
+    ds_new.attrs = {**ds_counter.attrs, **(attrs or {})}
+    safe_write_netcdf(ds_new, path, policy)
+    ds_counter.close()
+
+
+def read_counter_attrs(path: str, fmt: str = "netcdf") -> dict:
+    """Global attributes of the counter at path, empty if it does not exist"""
+    if not os.path.exists(path):
+        return {}
+    if fmt == "zarr":
+        return dict(zarr.open_group(path, mode="r").attrs)
+    with xr.open_dataset(path) as ds:
+        return dict(ds.attrs)
+
+
+def _for_zarr(ds):
+    """Drop the source encodings and use variable-length strings for the members"""
+    ds = ds.copy()
+    for variable in ds.variables.values():
+        variable.encoding = {}
+    if "member" in ds.coords:
+        ds = ds.assign_coords(member=ds["member"].values.astype(object))
+    return ds
+
+
+def _write_zarr(ds, path, policy):
+    """Write a new counter store with the chunks and compression of policy"""
+    chunks = {dim: size for dim, size in {**COUNTER_CHUNKS, **policy.chunks}.items() if dim in ds.dims}
+    policy = _counter_policy(policy, ds)
+    ds = policy.cast(ds)
+    ds.chunk(chunks).to_zarr(path, mode="w", zarr_format=2, encoding=policy.zarr_encoding(ds))
+
+
+def _create_zarr_counter(ds, path, policy):
+    """Write a new counter store aside and move it in place"""
+    tmp = f"{path}.tmp-{uuid.uuid4().hex}"
+    _write_zarr(ds, tmp, policy)
+    os.replace(tmp, path)
+
+
+def _update_zarr_attrs(path, attrs):
+    if attrs:
+        zarr.open_group(path, mode="r+").attrs.update(attrs)
+
+
+def _rewrite_zarr_counter(ds_incr, path, policy, compensated, attrs=None):
+    """Full read-add-write, used only when the increment changes the schema"""
+    tmp = f"{path}.tmp-{uuid.uuid4().hex}"
+    with xr.open_zarr(path) as ds_counter:
+        ds_new = add_counters(ds_counter, ds_incr, compensated)
+        ds_new.attrs = {**ds_counter.attrs, **(attrs or {})}
+        _write_zarr(_for_zarr(ds_new), tmp, policy)
+    shutil.rmtree(path)
+    os.replace(tmp, path)
+
+
+def _region_slice(index, labels):
+    """Positions of labels in index as a contiguous slice, or None"""
+    pos = np.sort(index.get_indexer(labels))
+    if pos[0] < 0 or pos[-1] - pos[0] + 1 != len(pos):
+        return None
+    return slice(int(pos[0]), int(pos[-1]) + 1)
+
+
+def _updated_region(ds_counter, ds_incr, region, compensated):
+    """Region of the counter store with ds_incr added, in the dtypes of the store"""
+    current = ds_counter[list(ds_incr.data_vars)].isel(region)
+    updated = add_counters(current, ds_incr.reindex_like(current, fill_value=0), compensated)
+    updated = updated.assign({name: updated[name].astype(current[name].dtype) for name in updated.data_vars})
+    return updated.drop_vars([name for name in updated.variables if not set(updated[name].dims) & set(region)])
+
+
+def _write_journal(path, updates, attrs):
+    """Write the updated regions of the Zarr counter at path and its new attributes aside, atomically"""
+    journal = f"{path}{JOURNAL_SUFFIX}"
+    tmp = f"{journal}.tmp-{uuid.uuid4().hex}"
+    os.makedirs(tmp)
+    regions = []
+    for i, (updated, region) in enumerate(updates):
+        write_netcdf(updated, f"{tmp}/{i}.nc")
+        regions.append({dim: [bounds.start, bounds.stop] for dim, bounds in region.items()})
+    with open(f"{tmp}/journal.json", "w") as f:
+        json.dump({"regions": regions, "attrs": attrs or {}}, f)
+    os.replace(tmp, journal)
+
+
+def replay_journal(path):
+    """
+    Apply the journal of the Zarr counter at path, if any, and remove it.
+    Journals only partially written are removed, the store was not touched.
+    """
+    journal = f"{path}{JOURNAL_SUFFIX}"
+    for tmp in glob.glob(f"{journal}.tmp-*"):
+        shutil.rmtree(tmp)
+    if not os.path.exists(journal):
+        return
+
+    with open(f"{journal}/journal.json") as f:
+        manifest = json.load(f)
+    for i, region in enumerate(manifest["regions"]):
+        with xr.open_dataset(f"{journal}/{i}.nc") as updated:
+            updated = _for_zarr(updated.load())
+        updated.to_zarr(path, region={dim: slice(*bounds) for dim, bounds in region.items()})
+    _update_zarr_attrs(path, manifest["attrs"])
+    shutil.rmtree(journal)
+
+
+def recover_counter(path, fmt="netcdf"):
+    """Complete an update of the counter at path interrupted by a failure, before it is read"""
+    if fmt == "zarr":
+        replay_journal(path)
+
+
+def update_zarr_counter(ds_incr: xr.Dataset, path: str, attrs=None, policy=None, compensated=False) -> None:
+    """
+    Add ds_incr to the Zarr counter at path, creating it if missing.
+
+    Only the chunks of the members and lead times present in ds_incr are read
+    and rewritten, through the journal. New members are first appended as
+    zeros. Increments on a different grid, with new lead times or with new
+    variables fall back to a full rewrite, as does a first compensated
+    update of a plain counter.
+    """
+    policy = policy or StoragePolicy()
+    ds_incr = _for_zarr(_prepare_increment(ds_incr.fillna(0), policy, compensated))
+    ds_incr.attrs = {}
+
+    if not os.path.exists(path):
+        ds_incr.attrs = dict(attrs or {})
+        _create_zarr_counter(ds_incr, path, policy)
+        return
+
+    replay_journal(path)
+    ds_counter = xr.open_zarr(path)
+
+    same_schema = set(ds_incr.data_vars) <= set(ds_counter.data_vars)
+    for dim in ds_incr.dims:
+        if dim == "member":
+            continue
+        if dim not in ds_counter.dims:
+            same_schema = False
+        elif dim == "lead_time":
+            same_schema &= bool(ds_incr.indexes[dim].isin(ds_counter.indexes[dim]).all())
+        else:
+            same_schema &= ds_incr.indexes[dim].equals(ds_counter.indexes[dim])
+
+    if not same_schema:
+        ds_counter.close()
+        _rewrite_zarr_counter(ds_incr, path, policy, compensated, attrs)
+        return
+
+    member_vars = [name for name in ds_incr.data_vars if "member" in ds_incr[name].dims]
+    other_vars = [name for name in ds_incr.data_vars if "member" not in ds_incr[name].dims]
+
+    # Append unseen members as zeros, so that every update below is in place. Every
+    # member variable of the counter grows, also those the increment does not hold
+    if member_vars:
+        new_members = ds_incr.indexes["member"].difference(ds_counter.indexes["member"], sort=False)
+        if len(new_members):
+            counter_member_vars = [name for name in ds_counter.data_vars if "member" in ds_counter[name].dims]
+            zeros = xr.zeros_like(ds_counter[counter_member_vars].isel(member=[0]))
+            zeros = xr.concat([zeros.assign_coords(member=[m]) for m in new_members], dim="member")
+            # Already in the chunks of the store
+            _for_zarr(zeros).to_zarr(path, zarr_format=2, append_dim="member")
+            ds_counter.close()
+            ds_counter = xr.open_zarr(path)
+
+    # Increment lead times missing in a covering region are added as zeros
+    region = {}
+    if "lead_time" in ds_incr.dims:
+        pos = ds_counter.indexes["lead_time"].get_indexer(ds_incr.indexes["lead_time"])
+        region["lead_time"] = slice(int(pos.min()), int(pos.max()) + 1)
+
+    regions = []
+    if other_vars:
+        regions.append((ds_incr[other_vars], region))
+
+    if member_vars:
+        incr = ds_incr[member_vars]
+        member_region = _region_slice(ds_counter.indexes["member"], incr.indexes["member"])
+        if member_region is not None:
+            regions.append((incr, {**region, "member": member_region}))
+        else:
+            for member in incr.indexes["member"]:
+                member_region = _region_slice(ds_counter.indexes["member"], [member])
+                regions.append((incr.sel(member=[member]), {**region, "member": member_region}))
+
+    updates = [(_updated_region(ds_counter, incr, region, compensated), region) for incr, region in regions]
+    _write_journal(path, updates, attrs)
+    ds_counter.close()
+    replay_journal(path)
+
+
+def update_counter(
+    ds_incr: xr.Dataset, path: str, fmt: str = "netcdf", attrs=None, policy=None, compensated=False
+) -> None:
+    """
+    Add ds_incr to the counter at path, in the given COUNTER_FORMAT and
+    storage policy, and set the given global attributes on it.
+    """
+    if fmt == "zarr":
+        update_zarr_counter(ds_incr, path, attrs, policy, compensated)
+    elif fmt == "netcdf":
+        update_netcdf_counter(ds_incr, path, attrs, policy, compensated)
+    else:
+        raise ValueError(f"Unknown COUNTER_FORMAT: {fmt!r}, expected one of {list(COUNTER_EXTENSIONS)}")
@@ -0,0 +1,220 @@
+"""
+Continuous Ranked Probability Score kernels.
+
+The ensemble CRPS is computed with the sorted-ensemble formulation
+
+    CRPS = E|X - y| - 0.5 E|X - X'|
+    0.5 E|X - X'| = sum_i (2i - M - 1) x_(i) / M^2
+
+where x_(1) <= ... <= x_(M) are the sorted members. This keeps memory linear
+in the number of members M and costs O(M log M) per grid point, instead of
+materialising the M x M pairwise differences.
+"""
+
+# Built-in/Generics
+import warnings
+
+# Third party
+import numpy as np
+import xarray as xr
+
+
+def _spread_weights(n_members, dtype):
+    """Weights of the sorted members giving 0.5 E|X - X'| for a full ensemble"""
+    rank = np.arange(1, n_members + 1)
+    return ((2 * rank - n_members - 1) / n_members**2).astype(dtype)
+
+
+def ensemble_spread_term(sorted_forecast):
+    """
+    Compute 0.5 E|X - X'| from an ensemble sorted along the last axis.
+
+    Missing members (NaN, sorted last by numpy) are skipped, which matches the
+    skipna mean over the member pairs of the pairwise formulation.
+    """
+    n_members = sorted_forecast.shape[-1]
+    dtype = np.result_type(sorted_forecast.dtype, np.float32)
+    valid = ~np.isnan(sorted_forecast)
+
+    if valid.all():
+        return sorted_forecast @ _spread_weights(n_members, dtype)
+
+    n_valid = valid.sum(axis=-1, keepdims=True)
+    rank = np.arange(1, n_members + 1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        weights = (2 * rank - n_valid - 1) / n_valid.astype(dtype) ** 2
+        weights = np.where(rank <= n_valid, weights, 0)
+        spread = (np.where(valid, sorted_forecast, 0) * weights).sum(axis=-1)
+
+    spread = spread.astype(dtype)
+    spread[n_valid[..., 0] == 0] = np.nan
+    return spread
+
+
+def crps_ensemble(forecast, obs):
+    """
+    Compute the CRPS of an ensemble forecast against an observation.
+
+    forecast has the ensemble members on the last axis, obs broadcasts
+    against forecast without that axis.
+    """
+    forecast = np.asarray(forecast)
+    obs = np.asarray(obs)[..., None]
+    dtype = np.result_type(forecast, obs, np.float32)
+
+    ensemble = np.sort(forecast, axis=-1)
+    term2 = ensemble_spread_term(ensemble)
+
+    # term1 = E|X - y|
+    valid = ~np.isnan(ensemble)
+    abs_err = np.subtract(ensemble, obs)
+    del ensemble
+    np.abs(abs_err, out=abs_err)
+
+    if valid.all():
+        term1 = abs_err.mean(axis=-1)
+    else:
+        abs_err[~np.broadcast_to(valid, abs_err.shape)] = 0
+        with np.errstate(invalid="ignore", divide="ignore"):
+            term1 = abs_err.sum(axis=-1) / valid.sum(axis=-1)
+
+    return (term1 - term2).astype(dtype, copy=False)
+
+
+def crps_ensemble_xarray(da, truth, dim="member"):
+    """
+    Compute the CRPS for an ensemble forecast in xarray using:
+    CRPS = E|X - y| - 0.5 E|X - X'|
+    """
+    if da.chunks is not None:
+        da = da.chunk({dim: -1})
+
+    return xr.apply_ufunc(
+        crps_ensemble,
+        da,
+        truth,
+        input_core_dims=[[dim], []],
+        join="inner",
+        dask="parallelized",
+        output_dtypes=[np.result_type(da.dtype, truth.dtype, np.float32)],
+    )
+
+
+def _nan_mean_std(ensemble):
+    """Mean and population std over the last axis, skipping missing members"""
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        mean = np.nanmean(ensemble, axis=-1)
+        std = np.nanstd(ensemble, axis=-1)
+    return mean, std
+
+
+def crps_variants(forecast, truth, eps=1e-6):
+    """
+    Compute in one traversal the CRPS of the raw, centred, rescaled and
+    normalized forecast ensembles, and of the truth ensemble itself, against
+    every truth member.
+
+    forecast has the model members on the last axis, truth the truth members.
+    The transformed ensembles are affine maps of the forecast with a positive
+    scale, so they share the sort order of the forecast and their spread term
+    is the forecast spread term times that scale; they are never materialised.
+
+    Returns (model_std, truth_std, crps_truth, crps, crps_centered,
+    crps_rescaled, crps_normalized), the CRPS arrays having the truth members
+    on the last axis.
+    """
+    forecast = np.asarray(forecast)
+    truth = np.asarray(truth)
+    dtype = np.result_type(forecast, truth, np.float32)
+
+    model_mean, model_std = _nan_mean_std(forecast)
+    truth_mean, truth_std = _nan_mean_std(truth)
+    model_std_safe = np.where(model_std < eps, eps, model_std)
+    truth_std_safe = np.where(truth_std < eps, eps, truth_std)
+
+    # Spread terms, computed once and shared by every truth member
+    spread_model = ensemble_spread_term(np.sort(forecast, axis=-1))
+    spread_truth = ensemble_spread_term(np.sort(truth, axis=-1))
+    spread_scaled = spread_model * (truth_std_safe / model_std_safe)
+
+    n_truth = truth.shape[-1]
+    grid = np.broadcast_shapes(forecast.shape[:-1], truth.shape[:-1])
+    sums = {key: np.zeros(grid + (n_truth,), dtype=dtype) for key in ("truth", "raw", "centered", "rescaled", "normalized")}
+    n_model_valid = np.zeros(grid, dtype=np.int64)
+    n_truth_valid = np.zeros(grid, dtype=np.int64)
+
+    # term1 = E|X - y| for every variant and truth member, one model member at a time
+    for i in range(forecast.shape[-1]):
+        member = forecast[..., i]
+        valid = np.broadcast_to(~np.isnan(member), grid)
+        n_model_valid += valid
+
+        standardized = (member - model_mean) / model_std_safe
+        variants = {
+            "raw": member,
+            "centered": (member - model_mean) + truth_mean,
+            "rescaled": standardized * truth_std_safe + model_mean,
+            "normalized": standardized * truth_std_safe + truth_mean,
+        }
+        for t in range(n_truth):
+            obs = truth[..., t]
+            for key, values in variants.items():
+                sums[key][..., t] += np.where(valid, np.abs(values - obs), 0)
+
+    for j in range(n_truth):
+        member = truth[..., j]
+        valid = np.broadcast_to(~np.isnan(member), grid)
+        n_truth_valid += valid
+        for t in range(n_truth):
+            sums["truth"][..., t] += np.where(valid, np.abs(member - truth[..., t]), 0)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        n_model_valid = n_model_valid[..., None]
+        crps_truth = sums["truth"] / n_truth_valid[..., None] - spread_truth[..., None]
+        crps = sums["raw"] / n_model_valid - spread_model[..., None]
+        crps_centered = sums["centered"] / n_model_valid - spread_model[..., None]
+        crps_rescaled = sums["rescaled"] / n_model_valid - spread_scaled[..., None]
+        crps_normalized = sums["normalized"] / n_model_valid - spread_scaled[..., None]
+
+    return tuple(
+        np.asarray(out, dtype=dtype)
+        for out in (model_std, truth_std, crps_truth, crps, crps_centered, crps_rescaled, crps_normalized)
+    )
+
+
+CRPS_VARIANTS = ("std", "std_truth", "crps_truth", "crps", "crps_centered", "crps_rescaled", "crps_normalized")
+
+
+def crps_variants_xarray(model, truth, dim="member"):
+    """
+    Fused xarray wrapper around crps_variants.
+
+    Returns a dict keyed by CRPS_VARIANTS. The CRPS fields carry the truth
+    members on a leading ``dim`` dimension, labelled as strings.
+    """
+    truth = truth.rename({dim: "truth_member"})
+    if model.chunks is not None:
+        model = model.chunk({dim: -1})
+    if truth.chunks is not None:
+        truth = truth.chunk({"truth_member": -1})
+
+    dtype = np.result_type(model.dtype, truth.dtype, np.float32)
+    outputs = xr.apply_ufunc(
+        crps_variants,
+        model,
+        truth,
+        input_core_dims=[[dim], ["truth_member"]],
+        output_core_dims=[[], []] + [["truth_member"]] * 5,
+        join="inner",
+        dask="parallelized",
+        output_dtypes=[dtype] * 7,
+    )
+
+    results = {}
+    for key, out in zip(CRPS_VARIANTS, outputs):
+        if "truth_member" in out.dims:
+            out = out.rename(truth_member=dim).transpose(dim, ...)
+            out = out.assign_coords({dim: [str(m) for m in out[dim].values]})
+        results[key] = out
+    return results
@@ -0,0 +1,220 @@
+"""
+Validation and ingestion of the EERIE daily files copied by GET_GROUND_TRUTH.
+
+Three validation modes are available:
+- full: every file is fully read, as done historically.
+- header: only the header is read, the expected dimensions are checked and
+  the last element of each variable is probed, which catches truncated
+  files. Dimension sizes other than time must agree across the files.
+- checksum: as header, plus the sha256 of each file is compared with the
+  MANIFEST.sha256 written at copy time, when present.
+
+Files are checked in parallel in a process pool.
+
+With the region ingestion, the schema of the truth store is created first,
+then every file is written by a pool worker directly into its own
+(member, time) chunks of the store.
+"""
+
+# Built-in/Generics
+import hashlib
+import os
+from collections import Counter
+
+# Third party
+import dask.array as dsa
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+# Local
+from AIUQdiag_lib.execution import allocated_cores, process_pool
+from AIUQdiag_lib.grid import canonicalize_longitude
+
+
+MANIFEST = "MANIFEST.sha256"
+VALIDATION_MODES = ("full", "header", "checksum")
+INGESTION_MODES = ("merge", "region")
+EXPECTED_DIMS = ("time", "isobaricInhPa", "latitude", "longitude")
+
+
+def read_manifest(directory):
+    """{file name: sha256} from the manifest of directory, empty if missing"""
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.exists(path):
+        return {}
+    manifest = {}
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                digest, name = line.split(maxsplit=1)
+                manifest[os.path.basename(name.strip().lstrip("*"))] = digest
+    return manifest
+
+
+def sha256(path, block_size=1 << 24):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _check_header(path):
+    """Dimension sizes of path, raising if the file is unreadable or truncated"""
+    import netCDF4
+
+    with netCDF4.Dataset(path) as nc:
+        missing = [dim for dim in EXPECTED_DIMS if dim not in nc.dimensions]
+        if missing:
+            raise ValueError(f"missing dimensions {missing}")
+        for variable in nc.variables.values():
+            if variable.ndim and all(variable.shape):
+                variable[(-1,) * variable.ndim]
+        return {dim: len(nc.dimensions[dim]) for dim in EXPECTED_DIMS}
+
+
+def validate_file(path, mode="header", expected_digest=None):
+    """
+    Check one file, returning (path, dimension sizes, error). The sizes are
+    None in full mode, the error None for a valid file.
+    """
+    try:
+        if mode == "full":
+            with xr.open_dataset(path) as ds:
+                ds.load()
+            return path, None, None
+
+        sizes = _check_header(path)
+        if mode == "checksum" and expected_digest is not None and sha256(path) != expected_digest:
+            raise ValueError("checksum does not match the manifest")
+        return path, sizes, None
+    except Exception as err:
+        return path, None, str(err) or type(err).__name__
+
+
+def validate_files(files, mode="header", workers=None):
+    """
+    Validate files in parallel and return the valid ones, in the input order.
+    In header and checksum modes, files whose dimension sizes differ from the
+    most common ones are rejected as well.
+    """
+    if mode not in VALIDATION_MODES:
+        raise ValueError(f"Unknown EERIE_VALIDATION: {mode!r}, expected one of {list(VALIDATION_MODES)}")
+    if not files:
+        return []
+
+    manifests = {}
+    digests = []
+    for f in files:
+        directory = os.path.dirname(f)
+        if mode == "checksum" and directory not in manifests:
+            manifests[directory] = read_manifest(directory)
+        digests.append(manifests.get(directory, {}).get(os.path.basename(f)))
+
+    with process_pool(min(workers or allocated_cores(), len(files))) as pool:
+        results = list(pool.map(validate_file, files, [mode] * len(files), digests))
+
+    for path, _, error in results:
+        if error is not None:
+            print(f"[WARNING] File corrotto saltato: {path} ({error})")
+
+    checked = [(path, sizes) for path, sizes, error in results if error is None]
+    if mode == "full" or not checked:
+        return [path for path, _ in checked]
+
+    # Daily files may hold a different number of time steps, the other sizes must agree
+    def _key(sizes):
+        return tuple(sizes[dim] for dim in EXPECTED_DIMS if dim != "time")
+
+    reference, _ = Counter(_key(sizes) for _, sizes in checked).most_common(1)[0]
+
+    valid = []
+    for path, sizes in checked:
+        if _key(sizes) != reference:
+            print(f"[WARNING] File corrotto saltato: {path} (dimensions {sizes}, expected {dict(zip(EXPECTED_DIMS[1:], reference))})")
+            continue
+        valid.append(path)
+    return valid
+
+
+def open_eerie_file(path, levels):
+    """Open one daily file on the requested levels, with longitudes in [-180, 180)"""
+    ds = xr.open_dataset(path)
+    ds = ds.sel(isobaricInhPa=levels)
+    ds = ds.rename({'isobaricInhPa': 'level'})
+    ds = ds.drop_vars('time_bnds', errors="ignore")
+    return canonicalize_longitude(ds)
+
+
+def _file_times(path):
+    with xr.open_dataset(path) as ds:
+        return ds["time"].values
+
+
+def create_truth_store(path, files, levels, times):
+    """
+    Create the truth store at path for files {(var, member): [paths]}, with
+    every variable on (member, time, level, latitude, longitude), one chunk
+    per member and time, and no data written (read back as NaN).
+    """
+    members = list(dict.fromkeys(member for _, member in files))
+    first = {}
+    for (var, _), var_files in files.items():
+        first.setdefault(var, var_files[0])
+
+    data_vars = {}
+    coords = {"member": members, "time": times}
+    attrs = {}
+    for var, sample in first.items():
+        with open_eerie_file(sample, levels) as ds:
+            attrs = attrs or dict(ds.attrs)
+            for name, da in ds.data_vars.items():
+                dims = ("member",) + da.dims
+                shape = (len(members), len(times)) + da.shape[1:]
+                chunks = (1, 1) + da.shape[1:]
+                data_vars[name] = (dims, dsa.full(shape, np.nan, dtype=da.dtype, chunks=chunks), da.attrs)
+                for dim in da.dims[1:]:
+                    coords.setdefault(dim, ds[dim].variable.to_base_variable())
+
+    template = xr.Dataset(data_vars, coords=coords, attrs=attrs)
+    template.to_zarr(path, mode="w", compute=False, zarr_format=2)
+    return members
+
+
+def _write_file(store, path, member, member_pos, times, levels):
+    """Write one daily file of one member into its region of the truth store"""
+    with open_eerie_file(path, levels) as ds:
+        ds = ds.expand_dims("member")
+        pos = pd.Index(times).get_indexer(ds["time"].values)
+        if pos.min() < 0 or pos.max() - pos.min() + 1 != len(pos) or not np.all(np.diff(pos) > 0):
+            raise ValueError(f"Times of {path} do not map to a contiguous region of the truth store")
+
+        ds = ds.reset_coords(drop=True).drop_vars(list(ds.indexes))
+        for variable in ds.variables.values():
+            variable.encoding = {}
+        region = {"member": slice(member_pos, member_pos + 1), "time": slice(int(pos[0]), int(pos[-1]) + 1)}
+        ds.to_zarr(store, region=region)
+
+
+def ingest_region(store, files, levels, workers=None):
+    """
+    Write the files {(var, member): [paths]} into the truth store at store,
+    each file by a process pool worker writing its own region.
+    """
+    all_files = [f for var_files in files.values() for f in var_files]
+    if not all_files:
+        raise ValueError("No valid EERIE file to ingest, check the warnings of the validation")
+
+    with process_pool(min(workers or allocated_cores(), len(all_files))) as pool:
+        times = np.unique(np.concatenate(list(pool.map(_file_times, all_files))))
+
+        members = create_truth_store(store, files, levels, times)
+
+        futures = [
+            pool.submit(_write_file, store, f, member, members.index(member), times, levels)
+            for (_, member), var_files in files.items()
+            for f in var_files
+        ]
+        for future in futures:
+            future.result()
@@ -0,0 +1,70 @@
+"""
+Streaming reductions over the members of an ensemble.
+
+Members are read one at a time and folded into running accumulators, so
+that memory does not grow with the ensemble size. The next member can be
+read in a background thread while the current one is accumulated.
+"""
+
+# Built-in/Generics
+from concurrent.futures import ThreadPoolExecutor
+
+# Third party
+import numpy as np
+import xarray as xr
+
+
+def prefetched(load, items, prefetch=True):
+    """Yield load(item) for each item, reading the next item in a background thread"""
+    items = list(items)
+    if not prefetch or len(items) < 2:
+        for item in items:
+            yield load(item)
+        return
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        future = pool.submit(load, items[0])
+        for item in items[1:]:
+            current = future.result()
+            future = pool.submit(load, item)
+            yield current
+            del current
+        yield future.result()
+
+
+def running_mean(arrays):
+    """
+    Mean of an iterable of DataArrays on the same coordinates, skipping NaN
+    as xarray's mean does, holding one array at a time. The sum is kept in
+    float64, the result is float32 or the wider dtype of the first array.
+    """
+    template = total = count = None
+    n = 0
+    for da in arrays:
+        if template is None:
+            # Only the coordinates of the first member are kept, around the running sum
+            dtype = np.result_type(da.dtype, np.float32)
+            total = np.zeros(da.shape, dtype=np.float64)
+            template = da.copy(data=total)
+        else:
+            xr.align(template, da, join="exact")
+            da = da.transpose(*template.dims)
+
+        values = np.asarray(da.values)
+        valid = ~np.isnan(values)
+        if count is None and valid.all():
+            total += values
+        else:
+            # Per-point counts are only needed once a member has missing values
+            if count is None:
+                count = np.full(total.shape, n, dtype=np.int32)
+            total += np.where(valid, values, 0)
+            count += valid
+        n += 1
+
+    if template is None:
+        raise ValueError("running_mean needs at least one array")
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = total / (n if count is None else count)
+    return template.copy(data=mean.astype(dtype, copy=False))
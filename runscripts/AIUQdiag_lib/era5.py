@@ -0,0 +1,131 @@
+"""
+Retrieval of the ERA5 ground truth.
+
+Only the requested variables and pressure levels are read from the source
+store, one day at a time. Every (variable, levels, day) retrieved is kept in
+a local cache under a name derived from its content, so that the start dates
+whose windows overlap read each day from the source only once. Days are read
+in parallel and a failed read is retried. The cache is shared by the jobs of
+every start date: a cached day is never replaced, a day fetched by two jobs
+at once is kept as the first one stored it.
+
+The source is the ARCO ERA5 store on GCS, or any Zarr store with the same
+layout given as a local path.
+"""
+
+# Built-in/Generics
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# Third party
+import pandas as pd
+import xarray as xr
+
+
+ERA5_SOURCE = "gs://gcp-public-data-arco-era5/ar/1959-2022-full_37-6h-0p25deg_derived.zarr"
+
+# Short names used in OUT_VARS and their ERA5 names
+ERA5_NAMES = {
+    "t": "temperature",
+    "u": "u_component_of_wind",
+    "v": "v_component_of_wind",
+    "z": "geopotential",
+}
+
+RETRIES = 3
+
+
+def open_source(source=ERA5_SOURCE):
+    """Open the ERA5 store lazily, without dask, so that reads only touch the selected chunks"""
+    if source.startswith("gs://"):
+        import gcsfs
+
+        gcs = gcsfs.GCSFileSystem(token="anon")
+        return xr.open_zarr(gcs.get_mapper(source), chunks=None)
+    return xr.open_zarr(source, chunks=None)
+
+
+def day_key(source, variable, levels, day):
+    """Content address of one variable on the given levels for one day of the source"""
+    content = {"source": source, "variable": variable, "levels": levels, "day": str(day.date())}
+    return hashlib.sha1(json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+
+def _fetch_day(era5, variable, levels, day, path, retries=RETRIES):
+    """Read one day of one variable from the source and store it at path, unless another job did"""
+    if os.path.exists(path):
+        return
+
+    for attempt in range(1, retries + 1):
+        try:
+            da = era5[variable].sel(time=str(day.date()))
+            if levels is not None:
+                da = da.sel(level=levels)
+            ds = da.to_dataset().load()
+            break
+        except Exception as err:
+            if attempt == retries:
+                raise
+            print(f"[WARN] Reading {variable} on {day.date()} failed ({err}), retry {attempt}/{retries - 1}")
+            time.sleep(2**attempt)
+
+    for item in ds.variables.values():
+        item.encoding = {}
+
+    tmp = f"{path}.tmp-{uuid.uuid4().hex}"
+    ds.to_zarr(tmp, mode="w", zarr_format=2)
+    # Other jobs may be reading the cached day, it is never replaced
+    if os.path.exists(path):
+        shutil.rmtree(tmp)
+        return
+    try:
+        os.rename(tmp, path)
+    except OSError:
+        # Another job stored the day in the meantime
+        shutil.rmtree(tmp)
+        if not os.path.exists(path):
+            raise
+
+
+def fetch_era5(variables, levels, start, end, cache_dir, source=ERA5_SOURCE, workers=None):
+    """
+    ERA5 variables on levels (None for all) between start and end, read
+    through the day cache in cache_dir. Returns a lazy Dataset backed by the
+    cached days.
+    """
+    days = pd.date_range(pd.Timestamp(start).normalize(), pd.Timestamp(end).normalize(), freq="1D")
+    levels = sorted(int(level) for level in levels) if levels is not None else None
+    os.makedirs(cache_dir, exist_ok=True)
+
+    paths = {
+        (variable, day): os.path.join(cache_dir, f"{day_key(source, variable, levels, day)}.zarr")
+        for variable in variables
+        for day in days
+    }
+    missing = [key for key, path in paths.items() if not os.path.exists(path)]
+    print(f"[INFO] ERA5: {len(paths) - len(missing)} variable-day(s) cached, {len(missing)} to retrieve")
+
+    if missing:
+        era5 = open_source(source)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_fetch_day, era5, variable, levels, day, paths[variable, day]) for variable, day in missing]
+            for future in futures:
+                future.result()
+        era5.close()
+
+    ds = xr.merge(
+        [
+            xr.concat([xr.open_zarr(paths[variable, day]) for day in days], dim="time")
+            for variable in variables
+        ]
+    ).sel(time=slice(start, end))
+
+    # The chunking of the cached days is not meant to be carried over
+    for item in ds.variables.values():
+        item.encoding = {}
+    return ds
@@ -0,0 +1,136 @@
+"""
+Execution of the work of a job on its allocated cores.
+
+Every runscript starts an ExecutionContext, read from the environment, that
+makes a local dask scheduler the default of the process:
+
+- SCHEDULER: threads (default), processes or synchronous.
+- WORKERS: threads or processes of the scheduler, and of the process pools
+  of the jobs, 0 (default) for one per allocated core.
+
+The process pools of the jobs fork their workers from a forkserver, a clean
+process that imports the runscript once, rather than from the job itself: a
+worker forked from the job inherits the locks held at that time by its
+threads (dask workers, HDF5, netCDF writes) and can block on them forever.
+
+The allocated cores are those the process may run on, capped by
+SLURM_CPUS_ON_NODE, and the allocated memory is MEMORY_BUDGET, or the SLURM
+allocation (SLURM_MEM_PER_NODE, SLURM_MEM_PER_CPU). The memory bounds the
+size of the chunks dask creates itself, so that a chunk per worker fits in
+it. Model and truth inputs are chunked alike, by INPUT_CHUNKS, so that the
+kernels run as one task per time and level on every worker, or by the
+chunks of a plan (see AIUQdiag_lib.planner) splitting the latitudes too.
+
+The variables of OUT_VARS are independent: with more than one VAR_WORKERS
+they are processed concurrently in a thread pool, sharing the truth stores
+and interpolation weights opened by the process (see AIUQdiag_lib.truth)
+and the dask scheduler, so that the wall time of a job is bounded by its
+slowest variable. Memory grows with the number of variables processed at
+once.
+"""
+
+# Built-in/Generics
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+# Third party
+import dask
+
+# Local
+from AIUQdiag_lib.tiling import parse_memory
+
+
+SCHEDULERS = ("threads", "processes", "synchronous")
+
+# One chunk per time and level, the chunks of the regridded truth store
+INPUT_CHUNKS = {"time": 1, "level": 1}
+
+# Share of the memory a worker may hold in the chunks dask creates itself
+_CHUNK_SHARE = 4
+_MIN_CHUNK_BYTES = 16 * 1024**2
+
+
+def allocated_cores():
+    """Cores this process may run on, capped by the SLURM allocation of the node"""
+    cores = len(os.sched_getaffinity(0))
+    slurm = os.environ.get("SLURM_CPUS_ON_NODE", "")
+    return max(1, min(cores, int(slurm))) if slurm else cores
+
+
+def allocated_memory():
+    """Memory of the SLURM allocation of the node in bytes, None outside SLURM"""
+    per_node = os.environ.get("SLURM_MEM_PER_NODE", "")
+    if per_node:
+        return int(per_node) * 1024**2
+    per_cpu = os.environ.get("SLURM_MEM_PER_CPU", "")
+    if per_cpu:
+        return int(per_cpu) * 1024**2 * allocated_cores()
+    return None
+
+
+@dataclass
+class ExecutionContext:
+    scheduler: str = "threads"
+    workers: int = 1
+    memory: int = None                           # bytes available to the job, None when unknown
+    chunks: dict = field(default_factory=lambda: dict(INPUT_CHUNKS))
+
+    def __post_init__(self):
+        if self.scheduler not in SCHEDULERS:
+            raise ValueError(f"Unknown SCHEDULER: {self.scheduler!r}, expected one of {list(SCHEDULERS)}")
+        if self.workers < 1:
+            raise ValueError(f"WORKERS must be at least 1, got {self.workers}")
+
+    @classmethod
+    def from_env(cls):
+        """Context of the job, sized from its allocation unless WORKERS and MEMORY_BUDGET are set"""
+        return cls(
+            scheduler=os.environ.get("SCHEDULER", "") or "threads",
+            workers=int(os.environ.get("WORKERS", "") or 0) or allocated_cores(),
+            memory=parse_memory(os.environ.get("MEMORY_BUDGET", "")) or allocated_memory(),
+        )
+
+    def start(self, telemetry=None):
+        """Make the scheduler the default of dask in this process, and record it"""
+        options = {"scheduler": self.scheduler}
+        if self.scheduler != "synchronous":
+            options["num_workers"] = self.workers
+        if self.memory:
+            options["array.chunk-size"] = max(self.memory // (_CHUNK_SHARE * self.workers), _MIN_CHUNK_BYTES)
+        dask.config.set(options)
+
+        print(f"[INFO] Dask {self.scheduler} scheduler with {self.workers} worker(s)")
+        if telemetry is not None:
+            telemetry.record["execution"] = {"scheduler": self.scheduler, "workers": self.workers, "memory": self.memory}
+        return self
+
+    def chunk(self, obj, chunks=None):
+        """obj chunked as the model and truth inputs of the kernels, or by the chunks of a plan"""
+        chunks = chunks or self.chunks
+        return obj.chunk({dim: size for dim, size in chunks.items() if dim in obj.dims})
+
+
+def process_pool(workers):
+    """Process pool of up to workers processes, forked from a clean server process"""
+    context = multiprocessing.get_context("forkserver")
+    # The server imports the runscript once, by its module name (its directory leads
+    # sys.path), so that the workers find its imports done when they run it again
+    script = getattr(sys.modules["__main__"], "__file__", None)
+    if script:
+        context.set_forkserver_preload([os.path.splitext(os.path.basename(script))[0]])
+    return ProcessPoolExecutor(max_workers=max(1, workers), mp_context=context)
+
+
+def map_variables(function, variables, workers=1):
+    """Call function(var) for every variable, with up to workers at once, and return the results"""
+    variables = list(variables)
+    if workers <= 1 or len(variables) < 2:
+        return [function(var) for var in variables]
+
+    with ThreadPoolExecutor(max_workers=min(workers, len(variables))) as pool:
+        futures = [pool.submit(function, var) for var in variables]
+        # The first failure is raised once every variable has finished
+        return [future.result() for future in futures]
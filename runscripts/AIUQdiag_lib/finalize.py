@@ -0,0 +1,204 @@
+"""
+Final metrics derived from the accumulated counters.
+
+The counters are opened lazily and subset (member, lead time, level,
+latitude-longitude box) before anything is read: netCDF counters are
+indexed on disk and only then chunked by lead time, Zarr counters are read
+chunk by chunk, so only the chunks of the selection are ever read. The
+metrics are returned as lazy Datasets:
+
+- deterministic: <var>_me, <var>_mae, <var>_rmse, <var>_skewness and
+  <var>_kurtosis (Pearson, 3 for a normal distribution) of the error, from
+  its power sums and <var>_n, and <var>_error_quantile from the error
+  histogram when it was accumulated.
+- probabilistic: the mean ensemble spread <var>_spread (and
+  <var>_spread_truth), the mean CRPS of every variant and the rank
+  frequencies <var>_rank_frequency when the rank histogram was accumulated.
+
+Regional counters (see AIUQdiag_lib.regions) are finalized the same way,
+and subset by region name. Compensated counters are read as
+sum - compensation.
+"""
+
+# Built-in/Generics
+import os
+
+# Third party
+import numpy as np
+import xarray as xr
+
+# Local
+from AIUQdiag_lib.counters import COMPENSATION_SUFFIX, COUNTER_EXTENSIONS, compensation_name, counter_path, recover_counter
+from AIUQdiag_lib.regions import REGIONAL_SUFFIX
+
+
+KINDS = ("deterministic", "probabilistic")
+CRPS_KEYS = ("crps_truth", "crps", "crps_centered", "crps_rescaled", "crps_normalized")
+
+
+def open_counter(base, kind):
+    """Open the counter of one kind under base lazily, in whichever format it was written"""
+    for fmt in COUNTER_EXTENSIONS:
+        path = counter_path(base, kind, fmt)
+        if os.path.exists(path):
+            recover_counter(path, fmt)
+            return xr.open_zarr(path) if fmt == "zarr" else xr.open_dataset(path)
+    raise FileNotFoundError(f"No {kind} counter under {base}")
+
+
+def _positions(index, lower, upper):
+    values = np.asarray(index)
+    if lower <= upper:
+        return np.flatnonzero((values >= lower) & (values <= upper))
+    # Longitude boxes crossing the antimeridian
+    return np.concatenate([np.flatnonzero(values >= lower), np.flatnonzero(values <= upper)])
+
+
+def subset(ds, levels=None, lead_times=None, members=None, region=None, regions=None):
+    """
+    Select levels, lead times, members and a (lat_min, lat_max, lon_min,
+    lon_max) region of a gridded counter, or named regions of a regional
+    one. Members missing from the counter are ignored, e.g. deterministic
+    labels in a probabilistic counter.
+    """
+    if levels is not None and "level" in ds.dims:
+        ds = ds.sel(level=list(levels))
+    if lead_times is not None and "lead_time" in ds.dims:
+        ds = ds.sel(lead_time=list(lead_times))
+    if members is not None and "member" in ds.dims:
+        labels = [m for m in ds["member"].values if str(m) in {str(x) for x in members}]
+        if not labels:
+            raise KeyError(f"None of the members {list(members)} is in the counter")
+        ds = ds.sel(member=labels)
+    if regions is not None and "region" in ds.dims:
+        ds = ds.sel(region=list(regions))
+    if region is not None and "latitude" in ds.dims:
+        lat_min, lat_max, lon_min, lon_max = region
+        ds = ds.isel(
+            latitude=_positions(ds["latitude"].values, lat_min, lat_max),
+            longitude=_positions(ds["longitude"].values, lon_min, lon_max),
+        )
+    return ds
+
+
+def totals(ds):
+    """Sums of a counter, corrected by their compensation when present"""
+    out = {}
+    for name, da in ds.data_vars.items():
+        if name.endswith(COMPENSATION_SUFFIX):
+            continue
+        comp = compensation_name(name)
+        out[name] = da - ds[comp] if comp in ds else da
+    return xr.Dataset(out, attrs=ds.attrs)
+
+
+def _mean(total, n):
+    return total / n.where(n > 0)
+
+
+def histogram_quantiles(counts, lower_edges, quantiles, dim):
+    """
+    Quantiles of the distributions counted in counts along dim, interpolated
+    linearly within the bin that holds them. Quantiles in the underflow or
+    overflow bin are the finite edge of that bin.
+    """
+    lower = np.asarray(lower_edges, dtype=np.float64)
+    upper = np.append(lower[1:], np.inf)
+    quantiles = np.asarray(quantiles, dtype=np.float64)
+
+    def _quantiles(values):
+        cdf = np.cumsum(values, axis=-1)
+        total = cdf[..., -1:]
+        out = np.empty(values.shape[:-1] + quantiles.shape)
+        for i, q in enumerate(quantiles):
+            target = q * total
+            index = np.minimum((cdf < target).sum(axis=-1, keepdims=True), len(lower) - 1)
+            below = np.take_along_axis(cdf, index, axis=-1) - np.take_along_axis(values, index, axis=-1)
+            inside = np.take_along_axis(values, index, axis=-1)
+            lo, hi = lower[index], upper[index]
+            with np.errstate(invalid="ignore", divide="ignore"):
+                fraction = np.where(inside > 0, (target - below) / inside, 0.0)
+                value = np.where(np.isfinite(lo) & np.isfinite(hi), lo + fraction * (hi - lo), np.where(np.isfinite(lo), lo, hi))
+            out[..., i] = np.where(total > 0, value, np.nan)[..., 0]
+        return out
+
+    out = xr.apply_ufunc(
+        _quantiles,
+        counts,
+        input_core_dims=[[dim]],
+        output_core_dims=[["quantile"]],
+        dask="parallelized",
+        output_dtypes=[np.float64],
+        dask_gufunc_kwargs={"output_sizes": {"quantile": len(quantiles)}},
+    )
+    return out.assign_coords(quantile=quantiles)
+
+
+def finalize_deterministic(ds, var, quantiles=(0.5,)):
+    """ME, MAE, RMSE, skewness, kurtosis and error quantiles of var from a deterministic counter"""
+    ds = totals(ds)
+    n = ds[f"{var}_n"]
+    mean = _mean(ds[f"{var}_err"], n)
+    m2 = _mean(ds[f"{var}_squared_error"], n)
+    m3 = _mean(ds[f"{var}_cubed_error"], n)
+    m4 = _mean(ds[f"{var}_quartic_error"], n)
+
+    # Central moments of the error from its raw moments
+    variance = m2 - mean**2
+    third = m3 - 3 * mean * m2 + 2 * mean**3
+    fourth = m4 - 4 * mean * m3 + 6 * mean**2 * m2 - 3 * mean**4
+    variance = variance.where(variance > 0)
+
+    out = {
+        f"{var}_me": mean,
+        f"{var}_mae": _mean(ds[f"{var}_absolute_error"], n),
+        f"{var}_rmse": np.sqrt(m2),
+        f"{var}_skewness": third / variance**1.5,
+        f"{var}_kurtosis": fourth / variance**2,
+    }
+    histogram = f"{var}_error_histogram"
+    if histogram in ds and quantiles:
+        out[f"{var}_error_quantile"] = histogram_quantiles(
+            ds[histogram], ds["error_bin"].values, quantiles, "error_bin"
+        )
+    return xr.Dataset(out, attrs=ds.attrs)
+
+
+def finalize_probabilistic(ds, var):
+    """Mean spread, mean CRPS variants and rank frequencies of var from a probabilistic counter"""
+    ds = totals(ds)
+    n = ds[f"{var}_n"]
+
+    out = {f"{var}_spread": _mean(ds[f"{var}_std"], n)}
+    if f"{var}_std_truth" in ds:
+        out[f"{var}_spread_truth"] = _mean(ds[f"{var}_std_truth"], n)
+    for key in CRPS_KEYS:
+        out[f"{var}_{key}"] = _mean(ds[f"{var}_{key}"], n)
+
+    histogram = f"{var}_rank_histogram"
+    if histogram in ds:
+        counts = ds[histogram]
+        out[f"{var}_rank_frequency"] = counts / counts.sum("rank_bin").where(lambda total: total > 0)
+    return xr.Dataset(out, attrs=ds.attrs)
+
+
+def finalize(
+    base, var, kind, levels=None, lead_times=None, members=None, region=None, quantiles=(0.5,),
+    regional=False, regions=None,
+):
+    """
+    Lazy final metrics of var from its counter of one kind under base, or its
+    regional counter, on the selection
+    """
+    if kind not in KINDS:
+        raise ValueError(f"Unknown counter kind: {kind!r}, expected one of {list(KINDS)}")
+
+    counter = open_counter(base, f"{kind}{REGIONAL_SUFFIX}" if regional else kind)
+    ds = subset(counter, levels, lead_times, members, region, regions)
+    # netCDF counters are read lazily on disk until here, then per lead time
+    if not ds.chunks:
+        ds = ds.chunk({"lead_time": 1} if "lead_time" in ds.dims else {})
+
+    if kind == "deterministic":
+        return finalize_deterministic(ds, var, quantiles)
+    return finalize_probabilistic(ds, var)
@@ -0,0 +1,67 @@
+"""
+Canonical longitude convention shared by the truth and the model outputs.
+
+Longitudes are stored in [-180, 180), in increasing order. The permutation
+bringing a grid to that convention is computed once per distinct longitude
+axis and cached, then applied as an index, which stays lazy on lazily loaded
+or dask-backed data. A grid already in the convention is left untouched.
+"""
+
+# Built-in/Generics
+import hashlib
+import threading
+
+# Third party
+import numpy as np
+
+
+# Orders already computed by this process, by longitude axis
+_ORDERS = {}
+_ORDERS_LOCK = threading.Lock()
+
+
+def longitude_order(longitude):
+    """
+    (order, canonical) for a longitude axis: the positions taking it to
+    increasing [-180, 180) longitudes, None if it already is, and the
+    resulting longitudes.
+    """
+    values = np.asarray(longitude)
+    key = (values.dtype.str, hashlib.sha1(np.ascontiguousarray(values).tobytes()).hexdigest())
+
+    with _ORDERS_LOCK:
+        if key not in _ORDERS:
+            canonical = (values + 180) % 360 - 180
+            order = np.argsort(canonical, kind="stable")
+            if np.array_equal(order, np.arange(values.size)):
+                order = None
+            _ORDERS[key] = (order, canonical if order is None else canonical[order])
+        return _ORDERS[key]
+
+
+def canonicalize_longitude(obj):
+    """Put a Dataset or DataArray in the canonical longitude convention"""
+    order, canonical = longitude_order(obj["longitude"].values)
+    if order is not None:
+        obj = obj.isel(longitude=order)
+    if not np.array_equal(obj["longitude"].values, canonical):
+        obj = obj.assign_coords(longitude=canonical)
+    return obj
+
+
+def fill_missing_longitude(obj):
+    """
+    Fill missing values with the nearest valid value along longitude. On
+    in-memory data the interpolation only runs where values are missing.
+    """
+    if hasattr(obj, "data_vars"):
+        return obj.assign({name: fill_missing_longitude(da) for name, da in obj.data_vars.items()})
+
+    if "longitude" not in obj.dims:
+        return obj
+    if obj.chunks is None:
+        # Loaded once here, the values are needed by the caller anyway
+        obj = obj.load()
+        if not bool(obj.isnull().any()):
+            return obj
+    return obj.interpolate_na("longitude", method="nearest", fill_value="extrapolate")
@@ -0,0 +1,113 @@
+"""
+Fixed-bin histograms of the error distribution and of the ensemble rank.
+
+Both are stored as counts per grid point and lead time, one-hot for a single
+start date, so that they are accumulated by MERGER like any other counter
+and their size does not grow with the number of dates:
+
+- <var>_error_histogram, on an error_bin dimension: counts of model - truth
+  in BINS equal bins between LOW and HIGH, plus an underflow and an overflow
+  bin. The error_bin coordinate holds the lower edge of each bin, -inf for
+  the underflow one. Medians and percentiles of the error are read from the
+  accumulated counts.
+- <var>_rank_histogram, on a rank_bin dimension: for every truth member,
+  counts of the number of model members below the truth (0..M). A flat
+  histogram means a reliable ensemble.
+
+Points with a missing value are not counted.
+"""
+
+# Third party
+import numpy as np
+import xarray as xr
+
+
+def parse_error_bins(value):
+    """
+    Bin edges by variable from space separated VAR=LOW:HIGH:BINS rules,
+    e.g. "t=-10:10:40 z=-500:500:50".
+    """
+    edges = {}
+    for item in value.split():
+        var, sep, spec = item.partition("=")
+        parts = spec.split(":")
+        if not sep or not var or len(parts) != 3:
+            raise ValueError(f"Expected VAR=LOW:HIGH:BINS, got {item!r}")
+        low, high, bins = float(parts[0]), float(parts[1]), int(parts[2])
+        if not high > low or bins < 1:
+            raise ValueError(f"Invalid error bins {item!r}, expected LOW < HIGH and BINS >= 1")
+        edges[var] = np.linspace(low, high, bins + 1)
+    return edges
+
+
+def _one_hot(index, valid, n_bins):
+    """float32 counts with a 1 in bin index along a new last axis, 0 where not valid"""
+    counts = index[..., None] == np.arange(n_bins)
+    counts &= valid[..., None]
+    return counts.astype(np.float32)
+
+
+def error_histogram(model, truth, edges):
+    """One-hot counts of model - truth in the bins of edges, with underflow and overflow bins"""
+    err = np.subtract(model, truth)
+    index = np.searchsorted(edges, err, side="right")
+    return _one_hot(index, ~np.isnan(err), len(edges) + 1)
+
+
+def error_histogram_xarray(model, truth, edges, dim="error_bin"):
+    """xarray wrapper around error_histogram, with the bins on dim"""
+    out = xr.apply_ufunc(
+        error_histogram,
+        model,
+        truth,
+        kwargs={"edges": edges},
+        output_core_dims=[[dim]],
+        join="inner",
+        dask="parallelized",
+        output_dtypes=[np.float32],
+        dask_gufunc_kwargs={"output_sizes": {dim: len(edges) + 1}},
+    )
+    return out.assign_coords({dim: np.concatenate([[-np.inf], edges])})
+
+
+def rank_histogram(forecast, truth):
+    """
+    One-hot counts of the rank of every truth member in the forecast
+    ensemble. forecast has the model members on the last axis, truth the
+    truth members; the counts are on (..., truth member, rank).
+    """
+    forecast = np.asarray(forecast)
+    truth = np.asarray(truth)
+    n_members = forecast.shape[-1]
+
+    rank = (forecast[..., None, :] < truth[..., :, None]).sum(axis=-1)
+    valid = ~np.isnan(truth) & ~np.isnan(forecast).any(axis=-1)[..., None]
+    return _one_hot(rank, valid, n_members + 1)
+
+
+def rank_histogram_xarray(model, truth, dim="member"):
+    """
+    xarray wrapper around rank_histogram, returning the counts with the truth
+    members on a leading dim dimension, labelled as strings, and the ranks on
+    a trailing rank_bin dimension.
+    """
+    truth = truth.rename({dim: "truth_member"})
+    if model.chunks is not None:
+        model = model.chunk({dim: -1})
+    if truth.chunks is not None:
+        truth = truth.chunk({"truth_member": -1})
+
+    n_ranks = model.sizes[dim] + 1
+    out = xr.apply_ufunc(
+        rank_histogram,
+        model,
+        truth,
+        input_core_dims=[[dim], ["truth_member"]],
+        output_core_dims=[["truth_member", "rank_bin"]],
+        join="inner",
+        dask="parallelized",
+        output_dtypes=[np.float32],
+        dask_gufunc_kwargs={"output_sizes": {"rank_bin": n_ranks}},
+    )
+    out = out.rename(truth_member=dim).transpose(dim, ..., "rank_bin")
+    return out.assign_coords({dim: [str(m) for m in out[dim].values], "rank_bin": np.arange(n_ranks)})
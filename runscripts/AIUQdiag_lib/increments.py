@@ -0,0 +1,90 @@
+"""
+Incremental datasets of one start date, as written by the metric jobs and
+accumulated into the counters by MERGER.
+"""
+
+# Third party
+import xarray as xr
+
+# Local
+from AIUQdiag_lib.crps import crps_variants_xarray
+from AIUQdiag_lib.histograms import error_histogram_xarray, rank_histogram_xarray
+from AIUQdiag_lib.moments import POWER_SUMS, power_sums_xarray, sample_count
+
+
+def deterministic_metrics(model, truth_sel, var, member_name, error_edges=None):
+    """
+    Error power sums and sample count of one model realization against one
+    truth, and the error histogram when bin edges are given.
+    """
+    sums = power_sums_xarray(model, truth_sel)
+    metrics = [sums[key].rename(f"{var}_{key}").expand_dims(member=[member_name]) for key in POWER_SUMS]
+    n = sample_count(metrics[0]).rename(f"{var}_n")
+    if error_edges is not None:
+        histogram = error_histogram_xarray(model, truth_sel, error_edges)
+        metrics.append(histogram.rename(f"{var}_error_histogram").expand_dims(member=[member_name]))
+    return xr.merge(metrics + [n])
+
+
+def deterministic_increments(model, truth, var, rng_key, reduce=False, error_edges=None):
+    """
+    Deterministic increments of one model realization against every truth
+    member, or against the first truth member and the truth ensemble mean
+    for the ensemble mean of REDUCE mode.
+    """
+    results = []
+
+    if reduce and "member" in truth.dims:
+        truth_members = list(truth["member"].values)
+        truth_init_member = "1" if "1" in [str(x) for x in truth_members] else truth_members[0]
+
+        truth_init = truth.sel(member=truth_init_member)
+        if "member" in truth_init.dims:
+            truth_init = truth_init.squeeze("member", drop=True)
+
+        truth_ensemble = truth.mean(dim="member")
+
+        results.append(deterministic_metrics(model, truth_init, var, "vs_init", error_edges))
+        results.append(deterministic_metrics(model, truth_ensemble, var, "vs_ensemble", error_edges))
+    else:
+        members_iter = truth["member"].values if "member" in truth.dims else [None]
+        for m in members_iter:
+            if m is None:
+                new_name = f"deterministic_{rng_key}"
+                truth_sel = truth
+            else:
+                new_name = f"{m}_{rng_key}"
+                truth_sel = truth.sel(member=m)
+                if "member" in truth_sel.dims:
+                    truth_sel = truth_sel.squeeze("member", drop=True)
+
+            results.append(deterministic_metrics(model, truth_sel, var, new_name, error_edges))
+
+    return xr.concat(results, dim="member")
+
+
+def probabilistic_scores(model, truth, var, rank=False):
+    """
+    Compute ensemble spread and the raw, centred, rescaled and normalized CRPS
+    against every truth member in a single fused pass, and the rank histogram
+    of the truth members if rank is set.
+    """
+    has_truth_members = "member" in truth.dims
+    if not has_truth_members:
+        truth = truth.expand_dims(member=["truth"])
+
+    scores = crps_variants_xarray(model, truth)
+
+    ens_std = scores["std"].rename(f"{var}_std")
+    n = xr.ones_like(ens_std).rename(f"{var}_n")
+
+    results = [ens_std]
+    if has_truth_members:
+        results.append(scores["std_truth"].rename(f"{var}_std_truth"))
+    results.append(n)
+    for key in ("crps_truth", "crps", "crps_centered", "crps_rescaled", "crps_normalized"):
+        results.append(scores[key].rename(f"{var}_{key}"))
+    if rank:
+        results.append(rank_histogram_xarray(model, truth).rename(f"{var}_rank_histogram"))
+
+    return xr.merge(results)
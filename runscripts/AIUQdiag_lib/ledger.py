@@ -0,0 +1,92 @@
+"""
+Ledger of the contributions accumulated in a counter.
+
+Every counter (and shard) records in its "ledger" global attribute the start
+dates it holds and, for each, the member labels they contributed: the truth
+members in the probabilistic counters, <truth member>_<member> pairs (or
+vs_init and vs_ensemble in REDUCE mode) in the deterministic ones. The
+ledger is written with the sums it describes, atomically for netCDF counters
+and through the journal of the Zarr ones (see AIUQdiag_lib.counters), so a
+MERGER that is retried after a failure skips what it already merged and
+resumes the rest.
+
+The ledger is stored as JSON groups of the dates sharing the same labels,
+a few bytes per date when every date has the same members.
+"""
+
+# Built-in/Generics
+import json
+
+# Local
+from AIUQdiag_lib.counters import read_counter_attrs
+
+
+LEDGER_ATTR = "ledger"
+
+# Label of the increments without a member dimension
+WHOLE = "*"
+
+
+def encode(ledger):
+    """JSON of a ledger {date: labels}, grouping the dates with the same labels"""
+    groups = {}
+    for date, labels in sorted(ledger.items()):
+        groups.setdefault(tuple(sorted(labels)), []).append(date)
+    return json.dumps([[list(labels), dates] for labels, dates in groups.items()], separators=(",", ":"))
+
+
+def decode(value):
+    """Ledger {date: labels} of its JSON, empty for None"""
+    ledger = {}
+    for labels, dates in json.loads(value or "[]"):
+        for date in dates:
+            ledger.setdefault(date, set()).update(labels)
+    return ledger
+
+
+def read_ledger(path, fmt="netcdf"):
+    """Ledger of the counter or shard at path, empty if it does not exist or has none"""
+    return decode(read_counter_attrs(path, fmt).get(LEDGER_ATTR))
+
+
+def ledger_attrs(ledger):
+    return {LEDGER_ATTR: encode(ledger)}
+
+
+def labels(ds):
+    """Member labels an increment contributes"""
+    if "member" not in ds.dims:
+        return {WHOLE}
+    return {str(member) for member in ds["member"].values}
+
+
+def merge_ledgers(*ledgers):
+    """Union of ledgers"""
+    merged = {}
+    for ledger in ledgers:
+        for date, date_labels in ledger.items():
+            merged.setdefault(date, set()).update(date_labels)
+    return merged
+
+
+def contains(ledger, other):
+    """Whether every contribution of other is in ledger"""
+    return all(date_labels <= ledger.get(date, set()) for date, date_labels in other.items())
+
+
+def unmerged(ds, ledger, date):
+    """
+    Part of the increment ds of date not in ledger yet, None when it is all
+    there. Variables without members were counted with the first
+    contribution of the date.
+    """
+    done = ledger.get(date, set())
+    if not done:
+        return ds
+    if "member" not in ds.dims:
+        return None
+
+    todo = [member for member in ds["member"].values if str(member) not in done]
+    if not todo:
+        return None
+    return ds[[name for name in ds.data_vars if "member" in ds[name].dims]].sel(member=todo)
@@ -0,0 +1,73 @@
+"""
+Reading of the model output files written by the inference jobs.
+
+Each member file holds one variable under its long name, e.g. temperature,
+on (valid_time, level, lat, lon). It is returned under the OUT_VARS short
+name on (time, level, latitude, longitude), with the longitudes in
+[-180, 180) as used by the truth stores.
+"""
+
+# Third party
+import xarray as xr
+
+# Local
+from AIUQdiag_lib.grid import canonicalize_longitude, fill_missing_longitude
+
+
+SHORT_NAMES = {
+    "temperature": "t",
+    "u_component_of_wind": "u",
+    "v_component_of_wind": "v",
+    "geopotential": "z",
+}
+
+
+def model_file(output_path, var, member, start_time, end_time):
+    """Path of the output of one member"""
+    return f"{output_path}/{var}/{str(member)}/out-{start_time}-{end_time}-{member}-{var}.nc"
+
+
+def _preprocess_one_file(ds):
+    """Helper function to correctly set time dimension when ingesting"""
+    vt0 = ds["valid_time"].isel(valid_time=0)
+    ds = ds.expand_dims(time=[vt0.values])
+    return ds
+
+
+def open_model_var(path, var, member=None, fill_missing=True):
+    """
+    Open one member file and return (ds, da), with da on (time, level,
+    latitude, longitude), or (member, time, ...) when member is given. With
+    fill_missing=False nothing is read from disk.
+    """
+    ds = xr.open_dataset(path)
+
+    if "lon" in ds.coords:
+        ds = ds.rename({"lon": "longitude"})
+    if "lat" in ds.coords:
+        ds = ds.rename({"lat": "latitude"})
+
+    ds = _preprocess_one_file(ds)
+    ds = canonicalize_longitude(ds)
+    ds = ds.rename({name: short for name, short in SHORT_NAMES.items() if name in ds.data_vars})
+
+    # Keep valid_time as the forecast time axis, and drop init-time (length=1) to avoid "dummy"
+    da = ds[var]
+    if "time" in da.dims and da.sizes["time"] == 1:
+        da = da.isel(time=0, drop=True)
+    if "valid_time" in da.dims:
+        da = da.rename({"valid_time": "time"})
+    if member is not None:
+        da = da.expand_dims(member=[member])
+    if fill_missing:
+        da = fill_missing_longitude(da)
+
+    return ds, da
+
+
+def read_model_var(path, var, member=None):
+    """Read the variable of one member file in memory and close the file"""
+    ds, da = open_model_var(path, var, member)
+    da = da.load()
+    ds.close()
+    return da
@@ -0,0 +1,46 @@
+"""
+Fused kernels for the deterministic error power sums.
+"""
+
+# Third party
+import numpy as np
+import xarray as xr
+
+
+POWER_SUMS = ("err", "absolute_error", "squared_error", "cubed_error", "quartic_error")
+
+
+def power_sums(model, truth):
+    """
+    Compute err, |err|, err^2, err^3 and err^4 with err = model - truth.
+
+    The error is read once and every power is built from the previous ones, so
+    the only allocations are the five returned arrays.
+    """
+    err = np.subtract(model, truth)
+    abs_err = np.abs(err)
+    squared = np.multiply(err, err)
+    cubed = np.multiply(squared, err)
+    quartic = np.multiply(squared, squared)
+    return err, abs_err, squared, cubed, quartic
+
+
+def power_sums_xarray(model, truth):
+    """xarray wrapper around power_sums, returning a dict keyed by POWER_SUMS"""
+    dtype = np.result_type(model.dtype, truth.dtype)
+    outputs = xr.apply_ufunc(
+        power_sums,
+        model,
+        truth,
+        output_core_dims=[[]] * len(POWER_SUMS),
+        join="inner",
+        dask="parallelized",
+        output_dtypes=[dtype] * len(POWER_SUMS),
+    )
+    return dict(zip(POWER_SUMS, outputs))
+
+
+def sample_count(da, keep_dims=("member", "time")):
+    """Count of one sample per keep_dims entry, without the spatial dimensions"""
+    spatial = {dim: 0 for dim in da.dims if dim not in keep_dims}
+    return xr.ones_like(da.isel(spatial, drop=True))
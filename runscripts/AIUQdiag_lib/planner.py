@@ -0,0 +1,163 @@
+"""
+Memory planning of the metric kernels from the metadata of their inputs.
+
+input_shapes reads the sizes of the model ensemble and of the truth from the
+headers of the member files and truth stores, before any data is read. The
+working set of each kernel is estimated per point of the model grid, as a
+number of float64 arrays:
+
+- moments (deterministic power sums): the model and truth members, the
+  error and its four powers per truth member, and the error histogram.
+- crps (probabilistic scores): the model members and their sorted copy, the
+  truth members, the per-variant accumulators and temporaries, and the rank
+  histogram. Tiled jobs also hold the truth of a whole level block.
+- interp (truth on the model grid): the truth members on the truth grid, two
+  neighbours along time or level and the interpolated result.
+
+plan() then picks the latitudes of a tile or chunk, and the number of them
+in flight, so that the working set fits a memory budget. Without a budget
+the whole latitude range is kept.
+"""
+
+# Built-in/Generics
+import os
+from dataclasses import asdict, dataclass, field
+
+# Local
+from AIUQdiag_lib.truth import REGRIDDED_STORE, TRUTH_STORE, model_grid, open_truth
+
+
+KERNELS = ("moments", "crps", "interp")
+
+# Kernels that need the whole latitude-longitude grid of every chunk
+_WHOLE_GRID = ("interp",)
+
+_VALUE_BYTES = 8
+
+
+@dataclass
+class InputShapes:
+    members: int
+    truth_members: int
+    time: int
+    level: int
+    latitude: int
+    longitude: int
+    truth_latitude: int = 0                      # truth grid, 0 when only the regridded truth exists
+    truth_longitude: int = 0
+
+    @property
+    def points(self):
+        return self.time * self.level * self.latitude * self.longitude
+
+    def input_bytes(self):
+        """Size of the float32 model ensemble and float64 truth on the model grid"""
+        return self.points * (4 * self.members + _VALUE_BYTES * self.truth_members)
+
+
+def input_shapes(model_files, truth_directory, var):
+    """Shapes of the model ensemble of model_files and of the truth of var, from metadata"""
+    grid = model_grid(model_files[0])
+    shapes = {dim: grid.sizes[dim] for dim in ("time", "level", "latitude", "longitude")}
+
+    truth_path = os.path.join(truth_directory, TRUTH_STORE)
+    if os.path.exists(truth_path):
+        truth = open_truth(truth_path, var)
+        shapes.update(truth_latitude=truth.sizes["latitude"], truth_longitude=truth.sizes["longitude"])
+    else:
+        truth = open_truth(os.path.join(truth_directory, REGRIDDED_STORE), var)
+
+    return InputShapes(members=len(model_files), truth_members=truth.sizes.get("member", 1), **shapes)
+
+
+def point_bytes(kernel, shapes, error_bins=0, rank=False):
+    """Estimated working set of kernel per point of the model grid, in bytes"""
+    n_model, n_truth = shapes.members, shapes.truth_members
+    if kernel == "moments":
+        arrays = 1 + 7 * n_truth + (n_truth * (error_bins + 2) if error_bins else 0)
+    elif kernel == "crps":
+        arrays = 2 * n_model + 9 * n_truth + 12 + (n_truth * (n_model + 1) if rank else 0)
+    elif kernel == "interp":
+        source = shapes.truth_latitude * shapes.truth_longitude or shapes.latitude * shapes.longitude
+        arrays = n_truth * (3 * source / (shapes.latitude * shapes.longitude) + 2)
+    else:
+        raise ValueError(f"Unknown kernel: {kernel!r}, expected one of {list(KERNELS)}")
+    return int(arrays * _VALUE_BYTES)
+
+
+def _format_bytes(size):
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if size < 1024 or unit == "GiB":
+            return f"{size:.1f} {unit}"
+        size /= 1024
+
+
+@dataclass
+class Plan:
+    kernel: str
+    chunks: dict = field(default_factory=dict)   # time, level and latitude of a tile or chunk
+    workers: int = 1                             # tiles or chunks in flight
+    working_set: int = 0                         # bytes of one tile or chunk
+    budget: int = None
+    fits: bool = True
+
+    def log(self, name, telemetry=None):
+        """Print the plan, and record it in the telemetry of the job"""
+        sizes = " x ".join(f"{size} {dim}" for dim, size in self.chunks.items())
+        budget = _format_bytes(self.budget) if self.budget else "no budget"
+        print(f"[INFO] Plan of {name} ({self.kernel}): {sizes} per chunk, "
+              f"{_format_bytes(self.working_set)} each, {self.workers} at once, {budget}")
+        if not self.fits:
+            print(f"[WARN] The {self.kernel} working set of {name} exceeds the memory budget even with the smallest chunks")
+        if telemetry is not None:
+            telemetry.add("plans", f"{name} {self.kernel}", asdict(self))
+        return self
+
+
+def plan(kernel, shapes, budget=None, workers=1, levels=1, time=1, latitudes=None, resident=0,
+         tiled=False, error_bins=0, rank=False):
+    """
+    Plan of the chunks of kernel on the model grid of shapes: time steps
+    (all when time is None) and levels per chunk are given, the latitudes,
+    unless given too, are the most that let workers chunks at once, and
+    resident bytes held by the job, fit in budget. Kernels that need the
+    whole grid are run on fewer workers instead. Tiled plans also hold the
+    truth of a level block, and raise MemoryError when a single latitude
+    does not fit.
+    """
+    time = min(time or shapes.time, shapes.time)
+    levels = min(levels or 1, shapes.level)
+    row = point_bytes(kernel, shapes, error_bins, rank) * time * levels * shapes.longitude
+    # Truth of a level block, interpolated before its tiles are computed
+    fixed = 2 * shapes.truth_members * shapes.latitude * time * levels * shapes.longitude * _VALUE_BYTES if tiled else 0
+
+    fits = True
+    if latitudes:
+        latitudes = min(latitudes, shapes.latitude)
+        fits = not budget or workers * (fixed + row * latitudes) <= budget - resident
+    elif not budget:
+        latitudes = shapes.latitude
+    else:
+        available = budget - resident
+        if kernel in _WHOLE_GRID:
+            latitudes = shapes.latitude
+            workers = int(max(1, min(workers, available // (fixed + row * latitudes))))
+            fits = fixed + row * latitudes <= available
+        else:
+            latitudes = (available // workers - fixed) // row
+            if latitudes < 1 and tiled:
+                raise MemoryError(
+                    f"MEMORY_BUDGET={budget} bytes cannot hold a single tile of {levels} level(s); "
+                    "reduce TILE_LEVELS or increase MEMORY_BUDGET"
+                )
+            fits = latitudes >= 1
+            latitudes = int(min(max(latitudes, 1), shapes.latitude))
+
+    return Plan(
+        kernel=kernel,
+        chunks={"time": time, "level": levels, "latitude": latitudes},
+        workers=workers,
+        working_set=fixed + row * latitudes,
+        budget=budget,
+        fits=fits,
+    )
@@ -0,0 +1,169 @@
+"""
+Area-weighted regional aggregation of the metric increments.
+
+The regions of REGIONS are turned once per grid into a sparse (regions x
+grid points) matrix of cos-latitude weights, normalised so that each row
+gives the area-weighted mean over its region. Every field with latitude and
+longitude dimensions is then reduced to a region dimension by one sparse
+matmul. Sums, counts and histograms are linear, so regional increments are
+accumulated in their own counters (metrics-counter-<kind>-regional) exactly
+as the gridded ones, and finalized the same way.
+
+REGIONS holds space separated names of predefined regions (global, nh, sh,
+tropics) or custom NAME=LAT_MIN:LAT_MAX:LON_MIN:LON_MAX boxes, with
+LON_MIN > LON_MAX for boxes crossing the antimeridian. Missing values are
+left out: the weights of a region are renormalised over its valid points,
+and a region without any is missing too.
+
+With AGGREGATION=regional no gridded counter is accumulated, and the metric
+jobs write their increments already reduced to the regions (see
+job_increments). Tiled probabilistic increments are written per tile, on
+the grid, and reduced by MERGER like those of AGGREGATION=both.
+"""
+
+# Built-in/Generics
+import hashlib
+import threading
+
+# Third party
+import numpy as np
+import scipy.sparse
+import xarray as xr
+
+
+AGGREGATIONS = ("gridded", "regional", "both")
+REGIONAL_SUFFIX = "-regional"
+
+PREDEFINED_REGIONS = {
+    "global": (-90.0, 90.0, -180.0, 180.0),
+    "nh": (20.0, 90.0, -180.0, 180.0),
+    "sh": (-90.0, -20.0, -180.0, 180.0),
+    "tropics": (-20.0, 20.0, -180.0, 180.0),
+}
+
+# Matrices already built by this process, by grid and regions
+_MATRICES = {}
+_MATRICES_LOCK = threading.Lock()
+
+
+def validate_aggregation(aggregation):
+    if aggregation not in AGGREGATIONS:
+        raise ValueError(f"Unknown AGGREGATION: {aggregation!r}, expected one of {list(AGGREGATIONS)}")
+
+
+def counter_kinds(kind, aggregation):
+    """Counter kinds an increment of kind is accumulated into"""
+    validate_aggregation(aggregation)
+    kinds = []
+    if aggregation in ("gridded", "both"):
+        kinds.append(kind)
+    if aggregation in ("regional", "both"):
+        kinds.append(f"{kind}{REGIONAL_SUFFIX}")
+    return kinds
+
+
+def parse_regions(value):
+    """Boxes (lat_min, lat_max, lon_min, lon_max) by region name"""
+    regions = {}
+    for item in value.split():
+        name, sep, spec = item.partition("=")
+        if not sep:
+            if name not in PREDEFINED_REGIONS:
+                raise ValueError(f"Unknown region {name!r}, expected one of {list(PREDEFINED_REGIONS)} or NAME=BOX")
+            regions[name] = PREDEFINED_REGIONS[name]
+            continue
+        bounds = spec.split(":")
+        if not name or len(bounds) != 4:
+            raise ValueError(f"Expected NAME=LAT_MIN:LAT_MAX:LON_MIN:LON_MAX, got {item!r}")
+        regions[name] = tuple(float(bound) for bound in bounds)
+    if not regions:
+        raise ValueError("REGIONS is empty")
+    return regions
+
+
+def _in_box(latitude, longitude, box):
+    lat_min, lat_max, lon_min, lon_max = box
+    inside = (latitude >= lat_min) & (latitude <= lat_max)
+    if lon_min <= lon_max:
+        return inside & (longitude >= lon_min) & (longitude <= lon_max)
+    return inside & ((longitude >= lon_min) | (longitude <= lon_max))
+
+
+def build_region_matrix(latitude, longitude, regions):
+    """Sparse (regions x latitude*longitude) matrix of normalised cos-latitude weights"""
+    lat2d, lon2d = np.meshgrid(np.asarray(latitude, dtype=np.float64), np.asarray(longitude, dtype=np.float64), indexing="ij")
+    lat2d, lon2d = lat2d.ravel(), lon2d.ravel()
+    area = np.clip(np.cos(np.deg2rad(lat2d)), 0, None)
+
+    rows, cols, weights = [], [], []
+    for row, (name, box) in enumerate(regions.items()):
+        points = np.flatnonzero(_in_box(lat2d, lon2d, box) & (area > 0))
+        if not points.size:
+            raise ValueError(f"Region {name!r} holds no point of the grid")
+        rows.append(np.full(points.size, row))
+        cols.append(points)
+        weights.append(area[points] / area[points].sum())
+
+    return scipy.sparse.csr_matrix(
+        (np.concatenate(weights), (np.concatenate(rows), np.concatenate(cols))),
+        shape=(len(regions), lat2d.size),
+    )
+
+
+def region_matrix(latitude, longitude, regions):
+    """build_region_matrix, built once per grid and regions by this process"""
+    key = hashlib.sha1()
+    for values in (latitude, longitude):
+        key.update(np.ascontiguousarray(values, dtype=np.float64).tobytes())
+    key.update(repr(sorted(regions.items())).encode())
+    key = key.hexdigest()
+
+    with _MATRICES_LOCK:
+        if key not in _MATRICES:
+            _MATRICES[key] = build_region_matrix(latitude, longitude, regions)
+        return _MATRICES[key]
+
+
+def aggregate(ds, regions):
+    """
+    ds with every latitude x longitude field replaced by its area-weighted
+    mean over the valid points of each region, on a trailing region
+    dimension. Increments already reduced to regions are returned as they are.
+    """
+    if "region" in ds.dims:
+        return ds
+
+    matrix = region_matrix(ds["latitude"].values, ds["longitude"].values, regions)
+    names = list(regions)
+
+    out = {}
+    for name, da in ds.data_vars.items():
+        if "latitude" not in da.dims or "longitude" not in da.dims:
+            out[name] = da
+            continue
+        da = da.transpose(..., "latitude", "longitude")
+        lead_shape = da.shape[:-2]
+        values = np.asarray(da.values).reshape(-1, matrix.shape[1])
+        valid = ~np.isnan(values)
+        reduced = np.asarray(matrix @ np.where(valid, values, 0).T).T
+        if not valid.all():
+            # Share of the weights of each region on valid points
+            weights = np.asarray(matrix @ valid.T.astype(np.float64)).T
+            with np.errstate(divide="ignore", invalid="ignore"):
+                reduced = np.where(weights > 0, reduced / weights, np.nan)
+        reduced = reduced.reshape(lead_shape + (len(names),))
+        template = da.isel(latitude=0, longitude=0, drop=True)
+        out[name] = xr.DataArray(
+            reduced.astype(da.dtype, copy=False),
+            dims=template.dims + ("region",),
+            coords=template.coords,
+            attrs=da.attrs,
+        )
+
+    return xr.Dataset(out, coords={"region": names}, attrs=ds.attrs)
+
+
+def job_increments(ds, aggregation, regions):
+    """Increments written by a metric job: reduced to the regions when no gridded counter needs them"""
+    validate_aggregation(aggregation)
+    return aggregate(ds, regions) if aggregation == "regional" else ds
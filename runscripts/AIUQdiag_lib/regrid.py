@@ -0,0 +1,200 @@
+"""
+Interpolation of the truth on the model grid.
+
+The default path is xarray's linear interp. With a cache directory, the
+horizontal bilinear interpolation is instead expressed as a sparse
+(model points x truth points) weight matrix, built once per pair of grids,
+stored on disk and applied as a sparse matmul to every member, time and
+level. Levels and times are interpolated linearly with precomputed indices.
+Both paths give the same values, including NaN outside the truth domain.
+"""
+
+# Built-in/Generics
+import hashlib
+import os
+import threading
+import uuid
+
+# Third party
+import numpy as np
+import scipy.sparse
+import xarray as xr
+
+
+# Weights already loaded by this process, shared by the variables on the same grids
+_WEIGHTS = {}
+_WEIGHTS_LOCK = threading.Lock()
+
+
+def interp_truth(truth, model, cache_dir=None):
+    """Interpolate the truth on the model grid, levels and times"""
+    if cache_dir:
+        return regrid_truth(truth, model, cache_dir)
+
+    return truth.interp(
+        longitude=model.longitude,
+        latitude=model.latitude,
+        level=model.level,
+        time=model.time,
+        method="linear",
+    ).sortby("level")
+
+
+def linear_weights(source, target):
+    """
+    1-D linear interpolation weights from source to target coordinates.
+
+    Returns (i0, i1, w, valid) such that the interpolated value at target[k]
+    is x[i0[k]] * (1 - w[k]) + x[i1[k]] * w[k], valid being False outside the
+    source range. Neighbours are chosen as scipy's interp1d does, so that NaN
+    propagate the same way.
+    """
+    source = np.asarray(source, dtype=np.float64)
+    target = np.asarray(target, dtype=np.float64)
+
+    order = np.argsort(source, kind="stable")
+    ordered = source[order]
+    valid = (target >= ordered[0]) & (target <= ordered[-1])
+
+    if ordered.size == 1:
+        zeros = np.zeros(target.size, dtype=np.int64)
+        return order[zeros], order[zeros], np.zeros(target.size), valid
+
+    pos = np.clip(np.searchsorted(ordered, target, side="left") - 1, 0, ordered.size - 2)
+    w = (target - ordered[pos]) / (ordered[pos + 1] - ordered[pos])
+    return order[pos], order[pos + 1], np.where(valid, w, 0.0), valid
+
+
+def _as_float(values):
+    values = np.asarray(values)
+    if np.issubdtype(values.dtype, np.datetime64):
+        return values.astype("datetime64[ns]").astype(np.int64).astype(np.float64)
+    return values.astype(np.float64)
+
+
+def build_weights(src_lat, src_lon, dst_lat, dst_lon, src_lev, dst_lev):
+    """Build the sparse horizontal weight matrix and the level interpolation indices"""
+    lat_i0, lat_i1, lat_w, lat_valid = linear_weights(src_lat, dst_lat)
+    lon_i0, lon_i1, lon_w, lon_valid = linear_weights(src_lon, dst_lon)
+    n_src_lon = len(src_lon)
+
+    # Four neighbours per model point. Zero weights are kept so that a NaN
+    # neighbour propagates exactly as in xarray's interp
+    rows, cols, data = [], [], []
+    for lat_idx, lat_wgt in ((lat_i0, 1 - lat_w), (lat_i1, lat_w)):
+        for lon_idx, lon_wgt in ((lon_i0, 1 - lon_w), (lon_i1, lon_w)):
+            rows.append(np.arange(len(dst_lat) * len(dst_lon)))
+            cols.append((lat_idx[:, None] * n_src_lon + lon_idx[None, :]).ravel())
+            data.append((lat_wgt[:, None] * lon_wgt[None, :]).ravel())
+
+    matrix = scipy.sparse.coo_matrix(
+        (np.concatenate(data), (np.concatenate(rows), np.concatenate(cols))),
+        shape=(len(dst_lat) * len(dst_lon), len(src_lat) * n_src_lon),
+    ).tocsr()
+
+    lev_i0, lev_i1, lev_w, lev_valid = linear_weights(src_lev, dst_lev)
+    return {
+        "matrix": matrix,
+        "valid": (lat_valid[:, None] & lon_valid[None, :]).ravel(),
+        "lev_i0": lev_i0,
+        "lev_i1": lev_i1,
+        "lev_w": lev_w,
+        "lev_valid": lev_valid,
+    }
+
+
+def _grid_key(*coords):
+    digest = hashlib.sha1()
+    for values in coords:
+        values = np.ascontiguousarray(_as_float(values))
+        digest.update(str(values.shape).encode())
+        digest.update(values.tobytes())
+    return digest.hexdigest()
+
+
+def load_or_build_weights(cache_dir, truth, model):
+    """Weights for the (truth grid, model grid) pair, read from cache_dir or built and cached"""
+    coords = [truth.latitude, truth.longitude, model.latitude, model.longitude, truth.level, model.level]
+    path = os.path.join(cache_dir, f"weights-{_grid_key(*coords)}.npz")
+
+    with _WEIGHTS_LOCK:
+        if path not in _WEIGHTS:
+            _WEIGHTS[path] = _load_or_build(path, coords)
+        return _WEIGHTS[path]
+
+
+def _load_or_build(path, coords):
+    if os.path.exists(path):
+        with np.load(path) as cached:
+            weights = {key: cached[key] for key in cached.files}
+        weights["matrix"] = scipy.sparse.csr_matrix(
+            (weights.pop("data"), weights.pop("indices"), weights.pop("indptr")),
+            shape=tuple(weights.pop("shape")),
+        )
+        return weights
+
+    weights = build_weights(*(c.values for c in coords))
+    matrix = weights["matrix"]
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp-{uuid.uuid4().hex}.npz"
+    np.savez(
+        tmp,
+        data=matrix.data,
+        indices=matrix.indices,
+        indptr=matrix.indptr,
+        shape=np.array(matrix.shape),
+        **{key: value for key, value in weights.items() if key != "matrix"},
+    )
+    os.replace(tmp, path)
+    return weights
+
+
+def _interp_axis(da, dim, i0, i1, w, valid, target):
+    """Linear interpolation of da along dim from precomputed indices"""
+    lower = da.isel({dim: i0}).drop_vars(dim)
+    upper = da.isel({dim: i1}).drop_vars(dim)
+    w = xr.DataArray(w, dims=dim)
+    out = lower * (1 - w) + upper * w
+    if not valid.all():
+        out = out.where(xr.DataArray(valid, dims=dim))
+    return out.assign_coords({dim: target})
+
+
+def _apply_matrix(data, matrix, valid, shape):
+    """Apply the horizontal weights to the two trailing axes of data"""
+    lead = data.shape[:-2]
+    flat = data.reshape(-1, data.shape[-2] * data.shape[-1])
+    out = (matrix @ flat.T).T
+    out[:, ~valid] = np.nan
+    return out.reshape(lead + shape).astype(data.dtype, copy=False)
+
+
+def regrid_truth(truth, model, cache_dir):
+    """Interpolate the truth on the model grid, levels and times with cached weights"""
+    weights = load_or_build_weights(cache_dir, truth, model)
+
+    # Times change with every start date, their indices are cheap to rebuild
+    out = _interp_axis(truth, "time", *linear_weights(_as_float(truth.time), _as_float(model.time)), model.time.values)
+    out = _interp_axis(
+        out, "level", weights["lev_i0"], weights["lev_i1"], weights["lev_w"], weights["lev_valid"], model.level.values
+    )
+
+    if out.chunks is not None:
+        out = out.chunk({"latitude": -1, "longitude": -1})
+
+    shape = (model.sizes["latitude"], model.sizes["longitude"])
+    out = xr.apply_ufunc(
+        _apply_matrix,
+        out,
+        kwargs={"matrix": weights["matrix"], "valid": weights["valid"], "shape": shape},
+        input_core_dims=[["latitude", "longitude"]],
+        output_core_dims=[["lat_out", "lon_out"]],
+        dask="parallelized",
+        output_dtypes=[out.dtype],
+        dask_gufunc_kwargs={"output_sizes": {"lat_out": shape[0], "lon_out": shape[1]}},
+    )
+    out = out.rename(lat_out="latitude", lon_out="longitude").assign_coords(
+        latitude=model.latitude.values, longitude=model.longitude.values
+    )
+    return out.transpose(*truth.dims).sortby("level")
@@ -0,0 +1,61 @@
+"""
+Streaming daily means of the sub-daily ground truth.
+
+The output store is created with one chunk per day, then every day is read
+as one block of its sub-daily steps, averaged and written into its own
+chunk. Only one day of data is held in memory, and the input is read once.
+"""
+
+# Third party
+import dask.array as dsa
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+
+def day_blocks(times):
+    """
+    Yield (day, start, stop) with times[start:stop] the steps of each day
+    between the first and the last one, empty days included.
+    """
+    times = pd.DatetimeIndex(times)
+    days = pd.date_range(times[0].floor("1D"), times[-1].floor("1D"), freq="1D")
+    bounds = times.searchsorted(days.append(pd.DatetimeIndex([days[-1] + pd.Timedelta("1D")])), side="left")
+    for i, day in enumerate(days):
+        yield day, int(bounds[i]), int(bounds[i + 1])
+
+
+def create_daily_store(ds, path, days):
+    """Create the store of the daily means of ds at path, one chunk per day, no data written"""
+    data_vars = {}
+    for name, da in ds.data_vars.items():
+        shape = tuple(len(days) if dim == "time" else size for dim, size in da.sizes.items())
+        chunks = tuple(1 if dim == "time" else size for dim, size in da.sizes.items())
+        data_vars[name] = (da.dims, dsa.full(shape, np.nan, dtype=da.dtype, chunks=chunks), da.attrs)
+
+    coords = {name: coord.variable for name, coord in ds.coords.items() if "time" not in coord.dims}
+    coords["time"] = days
+    template = xr.Dataset(data_vars, coords=coords, attrs=ds.attrs)
+    template.to_zarr(path, mode="w", compute=False, zarr_format=2)
+
+
+def stream_daily_mean(ds, path):
+    """
+    Write the daily means of ds, a lazily indexed dataset with a sorted time
+    axis, to a new Zarr store at path, one day at a time. Equivalent to
+    ds.resample(time="1D").mean().
+    """
+    blocks = list(day_blocks(ds["time"].values))
+    days = pd.DatetimeIndex([day for day, _, _ in blocks])
+    create_daily_store(ds, path, days)
+
+    for i, (day, start, stop) in enumerate(blocks):
+        if start == stop:
+            continue  # Days without data stay NaN, as with resample
+        daily = ds.isel(time=slice(start, stop)).mean("time", keep_attrs=True).load()
+        daily = daily.expand_dims(time=[day])
+        daily = daily.assign({name: daily[name].transpose(*ds[name].dims) for name in daily.data_vars})
+        daily = daily.drop_vars([name for name in daily.variables if "time" not in daily[name].dims])
+        for variable in daily.variables.values():
+            variable.encoding = {}
+        daily.to_zarr(path, region={"time": slice(i, i + 1)})
@@ -0,0 +1,167 @@
+"""
+Sharded accumulation of the metric counters.
+
+In sharded mode every MERGER job writes the partial sums of its date to its
+own shard, so independent dates can merge concurrently and never touch the
+shared counter. A reduction step then sums the shards pairwise, in parallel,
+and folds the result into the counter.
+
+Every reduced shard records the shards it was built from in its ``sources``
+attribute, and the counter records the last shard folded into it, so that a
+reduction interrupted at any point can be resumed without counting a shard
+twice. Shards and reduced shards also carry the ledger of the dates they
+hold (see AIUQdiag_lib.ledger): shards whose contributions the counter
+already holds, written again by a retried MERGER, are dropped.
+
+Shards are written with the storage policy of the counters and summed with
+their accumulation (plain or compensated).
+"""
+
+# Built-in/Generics
+import glob
+import json
+import os
+import uuid
+from itertools import repeat
+
+# Third party
+import xarray as xr
+
+# Local
+from AIUQdiag_lib.counters import (
+    add_counters, read_counter_attrs, recover_counter, safe_write_netcdf, update_counter, with_compensation,
+)
+from AIUQdiag_lib.execution import process_pool
+from AIUQdiag_lib.ledger import LEDGER_ATTR, contains, decode, ledger_attrs, merge_ledgers, read_ledger
+from AIUQdiag_lib.storage import StoragePolicy
+
+
+def shard_dir(base, kind):
+    """Directory holding the shards of one kind (deterministic/probabilistic) under base"""
+    return f"{base}/shards/{kind}"
+
+
+def shard_path(base, kind, start_time, end_time):
+    """Path of the shard of one date"""
+    return f"{shard_dir(base, kind)}/{start_time}-{end_time}.nc"
+
+
+def pending_ledger(base, kind, exclude=None):
+    """Ledger of the shards of one kind not folded into the counter yet, but exclude"""
+    ledgers = [
+        read_ledger(path) for path in glob.glob(f"{shard_dir(base, kind)}/*.nc")
+        if ".tmp-" not in os.path.basename(path) and path != exclude
+    ]
+    return merge_ledgers(*ledgers)
+
+
+def write_shard(
+    ds: xr.Dataset, base: str, kind: str, start_time: str, end_time: str, policy=None, compensated=False,
+    ledger=None,
+) -> str:
+    """Atomically write the partial sums of one date as a shard, with the ledger of its contributions"""
+    path = shard_path(base, kind, start_time, end_time)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    policy = policy or StoragePolicy()
+    ds = policy.cast(ds)
+    if compensated:
+        ds = with_compensation(ds)
+    if ledger is not None:
+        ds = ds.copy()
+        ds.attrs = {**ds.attrs, **ledger_attrs(ledger)}
+    safe_write_netcdf(ds, path, policy)
+    return path
+
+
+def _sources(path):
+    with xr.open_dataset(path) as ds:
+        return json.loads(ds.attrs.get("sources", "[]"))
+
+
+def _combine_pair(first, second, policy=None, compensated=False):
+    """Sum two shards into a new reduced shard, then remove them"""
+    directory = os.path.dirname(first)
+    path = f"{directory}/reduced-{uuid.uuid4().hex}.nc"
+
+    with xr.open_dataset(first) as ds_first, xr.open_dataset(second) as ds_second:
+        ds_new = add_counters(ds_first, ds_second, compensated)
+        ledger = merge_ledgers(decode(ds_first.attrs.get(LEDGER_ATTR)), decode(ds_second.attrs.get(LEDGER_ATTR)))
+        ds_new.attrs = {"sources": json.dumps([os.path.basename(first), os.path.basename(second)]), **ledger_attrs(ledger)}
+        safe_write_netcdf(ds_new, path, policy)
+
+    os.remove(first)
+    os.remove(second)
+    return path
+
+
+def _drop_consumed(paths, counter_ledger):
+    """
+    Remove the shards already summed into a reduced shard by an interrupted
+    run, and those whose contributions the counter already holds
+    """
+    consumed = set()
+    for path in paths:
+        consumed.update(_sources(path))
+
+    kept = []
+    for path in paths:
+        ledger = read_ledger(path)
+        if os.path.basename(path) in consumed or (ledger and contains(counter_ledger, ledger)):
+            os.remove(path)
+        else:
+            kept.append(path)
+    return kept
+
+
+def _remove_partial(directory):
+    """Remove the reduced shards left half written by a failed or killed reduction"""
+    for path in glob.glob(f"{directory}/reduced-*.tmp-*"):
+        os.remove(path)
+
+
+def tree_reduce(paths, workers=1, policy=None, compensated=False):
+    """Sum the shards pairwise, level by level, and return the path of the total"""
+    paths = list(paths)
+    with process_pool(workers) as pool:
+        while len(paths) > 1:
+            pairs = list(zip(paths[0::2], paths[1::2]))
+            carry = [paths[-1]] if len(paths) % 2 else []
+            firsts, seconds = zip(*pairs)
+            paths = list(pool.map(_combine_pair, firsts, seconds, repeat(policy), repeat(compensated))) + carry
+    return paths[0]
+
+
+def reduce_shards(directory, counter_file, fmt="netcdf", workers=1, policy=None, compensated=False):
+    """Reduce every shard in directory and fold the total into the counter"""
+    paths = sorted(
+        path for path in glob.glob(f"{directory}/*.nc") if ".tmp-" not in os.path.basename(path)
+    )
+    _remove_partial(directory)
+    recover_counter(counter_file, fmt)
+    counter_ledger = read_ledger(counter_file, fmt)
+    paths = _drop_consumed(paths, counter_ledger)
+    if not paths:
+        return
+
+    try:
+        total = tree_reduce(paths, workers, policy, compensated)
+    finally:
+        _remove_partial(directory)
+
+    # A uniquely named total tells whether it was already folded into the counter
+    if not os.path.basename(total).startswith("reduced-"):
+        renamed = f"{directory}/reduced-{uuid.uuid4().hex}.nc"
+        os.replace(total, renamed)
+        total = renamed
+
+    name = os.path.basename(total)
+    if read_counter_attrs(counter_file, fmt).get("last_reduced_shard") != name:
+        with xr.open_dataset(total) as ds_total:
+            ledger = merge_ledgers(counter_ledger, decode(ds_total.attrs.get(LEDGER_ATTR)))
+            ds_total.attrs = {}
+            update_counter(
+                ds_total, counter_file, fmt, attrs={"last_reduced_shard": name, **ledger_attrs(ledger)},
+                policy=policy, compensated=compensated,
+            )
+
+    os.remove(total)
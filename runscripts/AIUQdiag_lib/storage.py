@@ -0,0 +1,168 @@
+"""
+Storage policy of the incremental, shard and counter files.
+
+A policy sets, per variable, the dtype in which a dataset is stored, the
+compression (zlib, zstd or blosc) and the chunking of the spatial
+dimensions, for both netCDF and Zarr. It is read from the environment:
+
+- INCREMENT_DTYPES / COUNTER_DTYPES: space separated PATTERN=DTYPE rules,
+  matched in order against the variable names with fnmatch, e.g.
+  "*_quartic_error=float64 *_cubed_error=float64 *=float32". Variables no
+  rule matches keep their dtype.
+- STORAGE_COMPRESSION: none, zlib, zstd or blosc, and STORAGE_LEVEL. The
+  HDF5 blosc filter fails on chunks it cannot compress, so netCDF files use
+  zstd with byte shuffling for blosc.
+- STORAGE_CHUNKS: space separated DIM=SIZE chunk sizes, e.g.
+  "latitude=181 longitude=360".
+
+The default policy stores everything as computed, uncompressed. The
+increments are computed in the dtype of the model (see as_model_dtype).
+"""
+
+# Built-in/Generics
+import fnmatch
+import os
+import threading
+import uuid
+from dataclasses import dataclass, field
+
+# Third party
+import numpy as np
+
+
+COMPRESSIONS = ("none", "zlib", "zstd", "blosc")
+
+# Serialises the netCDF writes of the threads of a process
+_WRITE_LOCK = threading.Lock()
+
+
+def _reset_write_lock():
+    # A child forked during a write of another thread would find the lock held
+    global _WRITE_LOCK
+    _WRITE_LOCK = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_write_lock)
+
+
+def _parse_pairs(value, convert):
+    pairs = {}
+    for item in value.split():
+        key, sep, target = item.partition("=")
+        if not sep or not key or not target:
+            raise ValueError(f"Expected KEY=VALUE, got {item!r}")
+        pairs[key] = convert(target)
+    return pairs
+
+
+@dataclass
+class StoragePolicy:
+    dtypes: dict = field(default_factory=dict)   # variable pattern -> dtype, first match wins
+    compression: str = "none"
+    level: int = 4
+    chunks: dict = field(default_factory=dict)   # dimension -> chunk size
+
+    def __post_init__(self):
+        if self.compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown STORAGE_COMPRESSION: {self.compression!r}, expected one of {list(COMPRESSIONS)}")
+
+    @classmethod
+    def from_env(cls, dtypes_var):
+        """Policy of the files whose dtypes are set by the dtypes_var environment variable"""
+        return cls(
+            dtypes=_parse_pairs(os.environ.get(dtypes_var, ""), np.dtype),
+            compression=os.environ.get("STORAGE_COMPRESSION", "") or "none",
+            level=int(os.environ.get("STORAGE_LEVEL", "") or 4),
+            chunks=_parse_pairs(os.environ.get("STORAGE_CHUNKS", ""), int),
+        )
+
+    def dtype(self, name, default):
+        for pattern, dtype in self.dtypes.items():
+            if fnmatch.fnmatchcase(name, pattern):
+                return dtype
+        return default
+
+    def cast(self, ds):
+        """ds with its floating point data variables in the policy dtypes"""
+        casts = {}
+        for name, da in ds.data_vars.items():
+            if np.issubdtype(da.dtype, np.floating):
+                dtype = self.dtype(name, da.dtype)
+                if dtype != da.dtype:
+                    casts[name] = da.astype(dtype)
+        return ds.assign(casts) if casts else ds
+
+    def _chunks(self, da):
+        return tuple(min(self.chunks.get(dim, size), size) for dim, size in da.sizes.items())
+
+    def netcdf_encoding(self, ds, chunked=True):
+        """to_netcdf encoding of the data variables of ds (engine netcdf4)"""
+        encoding = {}
+        for name, da in ds.data_vars.items():
+            enc = {}
+            if self.compression != "none":
+                compression = "zstd" if self.compression == "blosc" else self.compression
+                enc.update(compression=compression, complevel=self.level, shuffle=True)
+            if chunked and da.ndim and set(self.chunks) & set(da.dims):
+                enc["chunksizes"] = self._chunks(da)
+            if enc:
+                encoding[name] = enc
+        return encoding
+
+    def zarr_compressor(self):
+        """numcodecs compressor of Zarr v2 arrays, None keeps the Zarr default"""
+        import numcodecs
+
+        if self.compression == "zlib":
+            return numcodecs.Zlib(level=self.level)
+        if self.compression == "zstd":
+            return numcodecs.Zstd(level=self.level)
+        if self.compression == "blosc":
+            return numcodecs.Blosc(cname="zstd", clevel=self.level, shuffle=numcodecs.Blosc.SHUFFLE)
+        return None
+
+    def zarr_encoding(self, ds):
+        """to_zarr encoding of the data variables of a new Zarr v2 store"""
+        compressor = self.zarr_compressor()
+        if compressor is None:
+            return {}
+        return {name: {"compressors": [compressor]} for name in ds.data_vars}
+
+
+def as_model_dtype(ds, model):
+    """
+    ds with its floating point data variables in the dtype of model, at least
+    float32. The interpolated truth is float64, the kernels on it are stored
+    in the precision of the model they score.
+    """
+    dtype = np.result_type(model.dtype, np.float32)
+    casts = {
+        name: da.astype(dtype) for name, da in ds.data_vars.items()
+        if np.issubdtype(da.dtype, np.floating) and da.dtype != dtype
+    }
+    return ds.assign(casts) if casts else ds
+
+
+def write_netcdf(ds, path, policy=None, encoding=None):
+    """
+    Write ds to path with the given storage policy, or an explicit encoding.
+
+    The file is written aside and moved in place, so that a failed write
+    never leaves a partial file at path. HDF5 is not thread safe: the
+    writes of concurrent threads are serialised, and dask arrays are stored
+    chunk by chunk in the calling thread whatever the dask scheduler, so
+    that no thread or process pool is started under the lock.
+    """
+    policy = policy or StoragePolicy()
+    ds = policy.cast(ds)
+    if encoding is None:
+        encoding = policy.netcdf_encoding(ds)
+
+    tmp = f"{path}.tmp-{uuid.uuid4().hex}"
+    try:
+        with _WRITE_LOCK:
+            ds.to_netcdf(tmp, engine="netcdf4", encoding=encoding, compute=False).compute(scheduler="synchronous")
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
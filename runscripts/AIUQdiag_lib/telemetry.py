@@ -0,0 +1,135 @@
+"""
+Per-job performance telemetry.
+
+Every runscript creates a Telemetry for its config file, switches phase as
+it goes (open, preprocess, interp, kernel, write, merge, ...) and records
+the arrays it handles. One JSON record is written per job, next to the job
+config in the LOG_<EXPID> directory, as telemetry_<JOBNAME>.json. The record
+is also written if the job fails, with "completed": false.
+
+Phases time the code that runs while they are active: with lazy arrays the
+work is accounted to the phase that computes them. Bytes read and written
+come from /proc/self/io and cover the job process only, not its pool
+workers; children_peak_rss_mib is the largest of the waited-for workers.
+When variables are processed concurrently every thread has its own current
+phase, and phase times add up over the threads.
+
+telemetry_report.py summarises the records of an experiment.
+"""
+
+# Built-in/Generics
+import atexit
+import json
+import os
+import platform
+import resource
+import threading
+import time
+from datetime import datetime, timezone
+
+
+TELEMETRY_PREFIX = "telemetry_"
+
+
+def _proc_io():
+    """Cumulative I/O counters of the process, empty where /proc is not available"""
+    try:
+        with open("/proc/self/io") as f:
+            return {key: int(value) for key, value in (line.split(":") for line in f)}
+    except OSError:
+        return {}
+
+
+def _peak_rss_mib(who):
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+def telemetry_path(config_path):
+    """Record path of the job of config_path (LOG_<EXPID>/config_<JOBNAME>)"""
+    directory, name = os.path.split(os.path.abspath(config_path))
+    name = os.path.splitext(name)[0]
+    job = name[len("config_"):] if name.startswith("config_") else name
+    return os.path.join(directory, f"{TELEMETRY_PREFIX}{job}.json"), job
+
+
+class Telemetry:
+    """Phase timings, memory, I/O and array sizes of one job"""
+
+    def __init__(self, script, config_path, config=None):
+        self.path, self.job = telemetry_path(config_path)
+        config = config or {}
+        self.record = {
+            "script": script,
+            "job": self.job,
+            "start_date": str(config.get("START_TIME", "")),
+            "member": str(config.get("RNG_KEY", "")),
+            "host": platform.node(),
+            "pid": os.getpid(),
+            "started": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "phases": {},
+            "arrays": {},
+            "completed": False,
+        }
+        self._start = time.perf_counter()
+        self._io_start = _proc_io()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._written = False
+        atexit.register(self.write)
+
+    def phase(self, name):
+        """End the current phase and start name; time spent in a phase accumulates"""
+        now = time.perf_counter()
+        current = getattr(self._local, "phase", None)
+        if current is not None:
+            with self._lock:
+                phases = self.record["phases"]
+                phases[current] = phases.get(current, 0.0) + now - self._local.start
+        self._local.phase = name
+        self._local.start = now
+
+    def array(self, name, obj):
+        """Record the sizes of a DataArray or Dataset (lazy ones are not computed)"""
+        self.add("arrays", name, {
+            "sizes": {str(dim): int(size) for dim, size in obj.sizes.items()},
+            "nbytes": int(obj.nbytes),
+        })
+
+    def add(self, section, name, value):
+        """Record value under name in a section of the record, from any thread"""
+        with self._lock:
+            self.record.setdefault(section, {})[name] = value
+
+    def finish(self):
+        """End the last phase and write the record of a completed job"""
+        self.phase(None)
+        self.record["completed"] = True
+        self.write()
+
+    def write(self):
+        if self._written:
+            return
+        self._written = True
+        self.phase(None)
+
+        io_end = _proc_io()
+        with self._lock:
+            self.record.update(
+                {
+                    "wall_s": time.perf_counter() - self._start,
+                    "peak_rss_mib": _peak_rss_mib(resource.RUSAGE_SELF),
+                    "children_peak_rss_mib": _peak_rss_mib(resource.RUSAGE_CHILDREN),
+                    "io": {key: io_end[key] - self._io_start.get(key, 0) for key in io_end},
+                }
+            )
+            record = json.dumps(self.record, indent=1)
+
+        # Telemetry must never fail the job
+        try:
+            tmp = f"{self.path}.tmp-{os.getpid()}"
+            with open(tmp, "w") as f:
+                f.write(record)
+            os.replace(tmp, self.path)
+        except OSError as err:
+            print(f"[WARNING] Telemetry not written to {self.path}: {err}")
@@ -0,0 +1,46 @@
+"""
+Helpers to split the model grid in tiles processed one at a time.
+"""
+
+# Built-in/Generics
+import itertools
+import re
+
+
+_UNITS = {
+    "": 1,
+    "B": 1,
+    "K": 1000, "KB": 1000, "KIB": 1024,
+    "M": 1000**2, "MB": 1000**2, "MIB": 1024**2,
+    "G": 1000**3, "GB": 1000**3, "GIB": 1024**3,
+    "T": 1000**4, "TB": 1000**4, "TIB": 1024**4,
+}
+
+
+def parse_memory(value):
+    """Parse a memory size such as 16GB, 512MiB or 1000000 into bytes"""
+    if value is None or str(value).strip() == "":
+        return None
+
+    match = re.fullmatch(r"\s*([0-9.]+)\s*([A-Za-z]*)\s*", str(value))
+    if match is None or match.group(2).upper() not in _UNITS:
+        raise ValueError(f"Invalid memory size: {value!r}")
+
+    return int(float(match.group(1)) * _UNITS[match.group(2).upper()])
+
+
+def tile_slices(size, step):
+    """Split range(size) in consecutive slices of at most step elements"""
+    step = max(1, int(step)) if step else size
+    return [slice(start, min(start + step, size)) for start in range(0, size, step)]
+
+
+def iter_tiles(sizes, steps):
+    """
+    Yield dicts {dim: slice} covering the grid described by sizes, using at
+    most steps[dim] elements per tile along each dim (whole dim if missing).
+    """
+    dims = list(sizes)
+    slices = [tile_slices(sizes[dim], steps.get(dim)) for dim in dims]
+    for combo in itertools.product(*slices):
+        yield dict(zip(dims, combo))
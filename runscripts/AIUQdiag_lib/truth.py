@@ -0,0 +1,106 @@
+"""
+Access to the ground truth of one start date.
+
+RESAMPLE_GROUND_TRUTH writes truth/<START_TIME>/truth_store.zarr on the truth
+grid. PREPARE_TRUTH then writes truth/<START_TIME>/truth_regridded.zarr, the
+same truth already interpolated on the model grid, levels and times. The
+metric jobs slice the regridded store when it covers their model grid and
+only fall back to interpolating the truth store otherwise.
+
+Each store is opened once per process, with its coordinates already fixed,
+and shared by all the variables of a job.
+"""
+
+# Built-in/Generics
+import os
+import threading
+
+# Third party
+import numpy as np
+import xarray as xr
+
+# Local
+from AIUQdiag_lib.execution import INPUT_CHUNKS
+from AIUQdiag_lib.grid import canonicalize_longitude, longitude_order
+from AIUQdiag_lib.regrid import interp_truth
+
+
+TRUTH_STORE = "truth_store.zarr"
+REGRIDDED_STORE = "truth_regridded.zarr"
+
+# The chunks of the model and truth inputs (one per time and level) with every
+# truth member, the access pattern of both the per-lead-time deterministic reads
+# and the level-tiled probabilistic reads
+REGRIDDED_CHUNKS = {**INPUT_CHUNKS, "member": -1, "latitude": -1, "longitude": -1}
+
+# Stores opened by this process, by path
+_STORES = {}
+_STORES_LOCK = threading.Lock()
+
+
+def truth_dir(hpcrootdir, start_time):
+    """Directory holding the truth stores of one start date"""
+    return os.path.join(hpcrootdir, "truth", start_time)
+
+
+def _open_store(path, preprocess=None, **kwargs):
+    """Open the Zarr store at path once per process"""
+    with _STORES_LOCK:
+        if path not in _STORES:
+            ds = xr.open_zarr(path, **kwargs)
+            _STORES[path] = preprocess(ds) if preprocess else ds
+        return _STORES[path]
+
+
+def _fix_coordinates(ds):
+    ds = canonicalize_longitude(ds)
+    if "level" in ds.dims:
+        ds = ds.isel(level=~ds["level"].to_index().duplicated())
+    return ds
+
+
+def open_truth(truth_path, var):
+    """Open the truth lazily with longitudes in [-180, 180) and unique levels"""
+    return _open_store(truth_path, _fix_coordinates, chunks={"time": 1})[var]
+
+
+def model_grid(model_file):
+    """
+    Coordinates (time, level, latitude, longitude) of a model output file, with
+    the longitudes in [-180, 180) as used by the metric jobs. No data is read.
+    """
+    with xr.open_dataset(model_file) as ds:
+        ds = ds.rename({name: new for name, new in (("lon", "longitude"), ("lat", "latitude")) if name in ds.coords})
+        _, longitude = longitude_order(ds["longitude"].values)
+        return xr.Dataset(
+            coords={
+                "time": ds["valid_time"].values,
+                "level": ds["level"].values,
+                "latitude": ds["latitude"].values,
+                "longitude": longitude,
+            }
+        )
+
+
+def _covers(truth, model):
+    """Whether the regridded truth holds every point of the model grid"""
+    for dim in ("latitude", "longitude"):
+        if not np.array_equal(truth[dim].values, model[dim].values):
+            return False
+    return all(bool(np.isin(model[dim].values, truth[dim].values).all()) for dim in ("time", "level"))
+
+
+def truth_on_model_grid(directory, var, model, cache_dir=None):
+    """
+    Truth of var on the grid, levels and times of model, sliced lazily from
+    the regridded store when it covers them, interpolated from the truth
+    store otherwise.
+    """
+    regridded_path = os.path.join(directory, REGRIDDED_STORE)
+    if os.path.exists(regridded_path):
+        regridded = _open_store(regridded_path)
+        if var in regridded.data_vars and _covers(regridded[var], model):
+            return regridded[var].sel(time=model["time"].values, level=model["level"].values).sortby("level")
+        print(f"[WARN] {regridded_path} does not cover the model grid of {var}, interpolating the truth")
+
+    return interp_truth(open_truth(os.path.join(directory, TRUTH_STORE), var), model, cache_dir)
@@ -0,0 +1,133 @@
+"""
+Deterministic and probabilistic increments of one start date in one job.
+
+Every member file of a variable is read once. The ensemble is held in memory,
+with the truth on the model grid, while both the probabilistic scores and
+the deterministic power sums of each member (or of the ensemble mean in
+REDUCE mode) are computed. The incremental files are the ones PROBABILISTIC
+and DETERMINISTIC write, so MERGER is unchanged. The model files are only
+removed once every incremental file of the variable is written.
+"""
+
+# Built-in/Generics
+import os
+
+# Third party
+import xarray as xr
+
+# Local
+from AIUQst_lib.functions import parse_arguments, read_config, normalize_out_vars
+from AIUQdiag_lib.ensemble import running_mean
+from AIUQdiag_lib.execution import ExecutionContext, map_variables
+from AIUQdiag_lib.histograms import parse_error_bins
+from AIUQdiag_lib.increments import deterministic_increments, probabilistic_scores
+from AIUQdiag_lib.model import model_file, read_model_var
+from AIUQdiag_lib.planner import input_shapes, plan
+from AIUQdiag_lib.regions import job_increments, parse_regions
+from AIUQdiag_lib.storage import StoragePolicy, as_model_dtype, write_netcdf
+from AIUQdiag_lib.telemetry import Telemetry
+from AIUQdiag_lib.truth import truth_dir, truth_on_model_grid
+
+
+def main() -> None:
+    # Read config
+    args = parse_arguments()
+    config = read_config(args.config)
+    telemetry = Telemetry("diagnostics", args.config, config)
+    context = ExecutionContext.from_env().start(telemetry)
+
+    _START_TIME = config.get("START_TIME", "")
+    _END_TIME = config.get("END_TIME", "")
+    _HPCROOTDIR = config.get("HPCROOTDIR", "")
+    _OUT_VARS = config.get("OUT_VARS", [])
+    _OUTPUT_PATH = config.get("OUTPUT_PATH", "")
+    _MEMBERS = config.get("MEMBERS", "")
+    _REDUCE = os.environ.get("REDUCE", "false").lower() == "true"
+    _REGRID_CACHE = os.path.join(_HPCROOTDIR, "regrid_cache") \
+        if os.environ.get("REGRID_CACHE", "false").lower() == "true" else None
+    _STORAGE = StoragePolicy.from_env("INCREMENT_DTYPES")
+    _VAR_WORKERS = int(os.environ.get("VAR_WORKERS", "") or 1)
+    _ERROR_BINS = parse_error_bins(os.environ.get("ERROR_HISTOGRAM", ""))
+    _RANK_HISTOGRAM = os.environ.get("RANK_HISTOGRAM", "false").lower() == "true"
+    _AGGREGATION = os.environ.get("AGGREGATION", "") or "gridded"
+    _REGIONS = parse_regions(os.environ.get("REGIONS", "") or "global") if _AGGREGATION != "gridded" else {}
+
+    output_vars = normalize_out_vars(_OUT_VARS)
+    members = _MEMBERS.split()
+    if not members:
+        raise ValueError("DIAGNOSTICS requires MEMBERS in config")
+
+    # Truth directory, holding the regridded truth when PREPARE_TRUTH ran
+    _TRUTH_DIR = truth_dir(_HPCROOTDIR, _START_TIME)
+
+    # The memory of the job is shared by the variables processed at once
+    chunk_budget = context.memory // max(1, min(_VAR_WORKERS, len(output_vars))) if context.memory else context.memory
+
+    def process(var):
+        OUTPUT_BASE_PATH = f"{_OUTPUT_PATH}/{var}"
+        model_files = [model_file(_OUTPUT_PATH, var, member, _START_TIME, _END_TIME) for member in members]
+
+        # Chunks sized from the metadata of the inputs, before anything is read: both
+        # kernels run on the same chunks, next to the ensemble and truth held in memory
+        shapes = input_shapes(model_files, _TRUTH_DIR, var)
+        plans = [
+            plan("crps", shapes, chunk_budget, context.workers, resident=shapes.input_bytes(), rank=_RANK_HISTOGRAM),
+            plan(
+                "moments", shapes, chunk_budget, context.workers, resident=shapes.input_bytes(),
+                error_bins=max(len(_ERROR_BINS.get(var, ())) - 1, 0),
+            ),
+        ]
+        chunks = min((p.log(var, telemetry) for p in plans), key=lambda p: p.chunks["latitude"]).chunks
+
+        # Each member file is read once
+        telemetry.phase("open")
+        model = context.chunk(xr.concat(
+            [read_model_var(path, var, member) for path, member in zip(model_files, members)], dim="member"
+        ), chunks)
+        telemetry.array(f"{var}_model", model)
+
+        # The truth is read once too, and kept in memory as the same lazy array
+        # the separate jobs compute from, for every member
+        telemetry.phase("interp")
+        truth = context.chunk(truth_on_model_grid(_TRUTH_DIR, var, model, _REGRID_CACHE), chunks).persist()
+        telemetry.array(f"{var}_truth", truth)
+
+        telemetry.phase("kernel")
+        ds_out = as_model_dtype(probabilistic_scores(model, truth, var, _RANK_HISTOGRAM).compute(), model)
+        telemetry.array(f"{var}_increments", ds_out)
+        telemetry.phase("write")
+        ds_out = job_increments(ds_out, _AGGREGATION, _REGIONS)
+        write_netcdf(ds_out, f"{OUTPUT_BASE_PATH}/out-{_START_TIME}-{_END_TIME}-probabilistic.nc", _STORAGE)
+
+        if _REDUCE:
+            telemetry.phase("kernel")
+            mean = running_mean(model.isel(member=i, drop=True) for i in range(len(members)))
+            ds_out = as_model_dtype(
+                deterministic_increments(mean, truth, var, members[0], True, _ERROR_BINS.get(var)).load(), model
+            )
+            telemetry.phase("write")
+            ds_out = job_increments(ds_out, _AGGREGATION, _REGIONS)
+            write_netcdf(ds_out, f"{OUTPUT_BASE_PATH}/out-{_START_TIME}-{_END_TIME}-deterministic-reduced.nc", _STORAGE)
+        else:
+            for i, member in enumerate(members):
+                telemetry.phase("kernel")
+                ds_out = as_model_dtype(deterministic_increments(
+                    model.isel(member=i, drop=True), truth, var, member, error_edges=_ERROR_BINS.get(var)
+                ).load(), model)
+                telemetry.phase("write")
+                ds_out = job_increments(ds_out, _AGGREGATION, _REGIONS)
+                write_netcdf(
+                    ds_out, f"{OUTPUT_BASE_PATH}/{member}/out-{_START_TIME}-{_END_TIME}-{member}-deterministic.nc", _STORAGE
+                )
+
+        for path in model_files:
+            os.remove(path)
+
+    # Variables share the truth stores opened by the process
+    map_variables(process, output_vars, _VAR_WORKERS)
+
+    telemetry.finish()
+
+
+if __name__ == "__main__":
+    main()
@@ -8,15 +8,15 @@ import shutil
 import yaml
 
 # Third party
-import gcsfs
-import xarray as xr
 import zarr
 
 # Local
 from AIUQst_lib.functions import parse_arguments, read_config, normalize_out_vars
 from AIUQst_lib.pressure_levels import check_pressure_levels
-from AIUQst_lib.cards import read_ic_card, read_std_version
-from AIUQst_lib.variables import reassign_long_names_units, define_ics_mappers
+from AIUQst_lib.variables import reassign_long_names_units
+from AIUQdiag_lib.era5 import ERA5_NAMES, ERA5_SOURCE, fetch_era5
+from AIUQdiag_lib.execution import ExecutionContext
+from AIUQdiag_lib.telemetry import Telemetry
 
 
 def main() -> None:
@@ -24,13 +24,13 @@ def main() -> None:
     # Read config
     args = parse_arguments()
     config = read_config(args.config)
+    telemetry = Telemetry("download_era5_ground", args.config, config)
+    context = ExecutionContext.from_env().start(telemetry)
 
     _START_TIME     = config.get("START_TIME", "")
     _END_TIME       = config.get("END_TIME", "")
     _HPCROOTDIR     = config.get("HPCROOTDIR", "")
     _OUT_VARS       = config.get("OUT_VARS", [])
-    _IC             = config.get("IC_NAME", "")
-    _STD_VERSION    = config.get("STD_VERSION", "")
     _OUT_LEVS       = config.get("OUT_LEVS", "")
 
     if _OUT_LEVS != 'original':
@@ -41,30 +41,27 @@ def main() -> None:
 
     # To add in config
     _TRUTH_PATH_TEMP    = os.path.join(_HPCROOTDIR, 'truth', _START_TIME, 'truth_store_temp.zarr')
+    _ERA5_SOURCE        = os.environ.get("ERA5_SOURCE", "") or ERA5_SOURCE
+    _ERA5_CACHE         = os.environ.get("ERA5_CACHE", "") or os.path.join(_HPCROOTDIR, 'era5_cache')
+    _ERA5_WORKERS       = int(os.environ.get("ERA5_WORKERS", "") or 0) or context.workers
 
-    # IC settings
-    ic_card = read_ic_card(_HPCROOTDIR, _IC)
-    standard_dict = read_std_version(_HPCROOTDIR, _STD_VERSION)
+    # Only the requested variables and levels are read from the source
+    output_vars = [ERA5_NAMES.get(var, var) for var in normalize_out_vars(_OUT_VARS)]
 
-    # Here the specific code to retrieve ERA5 from GCS
-    gcs = gcsfs.GCSFileSystem(token="anon")
-    ini_data_path_remote = "gs://gcp-public-data-arco-era5/ar/1959-2022-full_37-6h-0p25deg_derived.zarr"
-    full_era5 = xr.open_zarr(gcs.get_mapper(ini_data_path_remote), chunks={"time":48})
-    
-    # Create the mappers between model requirement and IC variables
-    ic_names, rename_dict, long_names_dict, units_dict, missing_vars = define_ics_mappers(
-        ic_card['variables'], 
-        standard_dict['variables']['data']
-        )
-    
-    # Temporary fix for naming inconsistencies
-    #output_vars = normalize_out_vars(_OUT_VARS)
-    output_vars = ['temperature', 'u_component_of_wind', 'v_component_of_wind', 'geopotential']
+    # Days missing from the cache are downloaded here
+    telemetry.phase("open")
+    final = fetch_era5(
+        output_vars,
+        desired_levels if _OUT_LEVS != 'original' else None,
+        _START_TIME,
+        _END_TIME,
+        _ERA5_CACHE,
+        source=_ERA5_SOURCE,
+        workers=_ERA5_WORKERS,
+        ).chunk({"time": 48})
+    telemetry.array("truth_6h", final)
 
-    final = (
-        full_era5[output_vars]
-        .sel(time=slice(_START_TIME, _END_TIME))
-        )
+    telemetry.phase("write")
 
     shutil.rmtree(                          # Remove existing data if any - avoid conflicts
         _TRUTH_PATH_TEMP,
@@ -76,6 +73,8 @@ def main() -> None:
         f"{_TRUTH_PATH_TEMP}",              # Zarr version 3 has some issues with BytesBytesCodec
         mode="w",                           # See https://github.com/pydata/xarray/issues/10032 as reference    
         zarr_format=2)
+
+    telemetry.finish()
     
 if __name__ == "__main__":
     main()
\ No newline at end of file
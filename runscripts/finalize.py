@@ -0,0 +1,77 @@
+"""
+Write the final metrics of an experiment from its accumulated counters.
+
+For every variable of the outputs directory (or the ones given) and every
+counter kind, the metrics of AIUQdiag_lib.finalize are computed on the
+selection and written to <var>/metrics-final-<kind>.nc, or to
+<var>-metrics-final-<kind>.nc under --output-dir. Only the chunks of the
+selection are read. --regional finalizes the regional counters instead:
+
+    python3 runscripts/finalize.py $HPCROOTDIR/outputs --vars t z --levels 500 850 \\
+        --lead-times 0 1 --region 35 70 -10 40
+"""
+
+# Built-in/Generics
+import argparse
+import os
+
+# Local
+from AIUQdiag_lib.execution import ExecutionContext
+from AIUQdiag_lib.finalize import KINDS, finalize
+from AIUQdiag_lib.regions import REGIONAL_SUFFIX
+
+
+def _variables(output_path):
+    """Variables with at least one counter under output_path"""
+    return sorted(
+        name for name in os.listdir(output_path)
+        if os.path.isdir(os.path.join(output_path, name))
+        and any(entry.startswith("metrics-counter-") for entry in os.listdir(os.path.join(output_path, name)))
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("output_path", help="outputs directory of the experiment, holding one directory per variable")
+    parser.add_argument("--vars", nargs="+", help="variables to finalize, all by default")
+    parser.add_argument("--kinds", nargs="+", choices=KINDS, default=list(KINDS), help="counters to finalize")
+    parser.add_argument("--levels", nargs="+", type=int, help="pressure levels to keep")
+    parser.add_argument("--lead-times", nargs="+", type=int, help="lead time indices to keep")
+    parser.add_argument("--members", nargs="+", help="counter members to keep")
+    parser.add_argument(
+        "--region", nargs=4, type=float, metavar=("LAT_MIN", "LAT_MAX", "LON_MIN", "LON_MAX"),
+        help="latitude-longitude box to keep, LON_MIN > LON_MAX crossing the antimeridian",
+    )
+    parser.add_argument("--regional", action="store_true", help="finalize the regional counters")
+    parser.add_argument("--regions", nargs="+", help="regions of the regional counters to keep")
+    parser.add_argument("--quantiles", nargs="+", type=float, default=[0.5], help="error quantiles from the histograms")
+    parser.add_argument("--output-dir", help="directory of the final files, the variable directory by default")
+    args = parser.parse_args()
+    ExecutionContext.from_env().start()
+
+    for var in args.vars or _variables(args.output_path):
+        base = os.path.join(args.output_path, var)
+        for kind in args.kinds:
+            try:
+                ds = finalize(
+                    base, var, kind, args.levels, args.lead_times, args.members, args.region, args.quantiles,
+                    args.regional, args.regions,
+                )
+            except FileNotFoundError as err:
+                print(f"[WARN] {err}, skipping")
+                continue
+
+            name = f"metrics-final-{kind}{REGIONAL_SUFFIX if args.regional else ''}.nc"
+            if args.output_dir:
+                os.makedirs(args.output_dir, exist_ok=True)
+                path = os.path.join(args.output_dir, f"{var}-{name}")
+            else:
+                path = os.path.join(base, name)
+            # Computed chunk by chunk while writing; write_netcdf would hold the
+            # HDF5 lock that the lazy reads of a netCDF counter need
+            ds.to_netcdf(path)
+            print(f"[INFO] {var} {kind}: {', '.join(ds.data_vars)} -> {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,7 +4,6 @@
 
 # Built-in/Generics
 import os
-import uuid
 import shutil
 
 # Third party
@@ -13,15 +12,16 @@ import xarray as xr
 
 # Local
 from AIUQst_lib.functions import parse_arguments, read_config, normalize_out_vars
+from AIUQdiag_lib.counters import ACCUMULATIONS, counter_path, recover_counter, update_counter
+from AIUQdiag_lib.execution import ExecutionContext
+from AIUQdiag_lib.ledger import labels, ledger_attrs, merge_ledgers, read_ledger, unmerged
+from AIUQdiag_lib.regions import REGIONAL_SUFFIX, aggregate, counter_kinds, parse_regions
+from AIUQdiag_lib.shards import pending_ledger, shard_path, write_shard
+from AIUQdiag_lib.storage import StoragePolicy
+from AIUQdiag_lib.telemetry import Telemetry
+from AIUQdiag_lib.truth import truth_dir
 
 
-def safe_write_netcdf(ds: xr.Dataset, path: str) -> None:
-    tmp = f"{path}.tmp-{uuid.uuid4().hex}"
-    # scrivi su tmp
-    ds.to_netcdf(tmp, mode="w")
-    # rimpiazza atomico
-    os.replace(tmp, path)
-
 def _to_lead_time(ds: xr.Dataset) -> xr.Dataset:
     """
     Se vuoi trasformare time in lead_time (0..T-1) in modo consistente.
@@ -33,9 +33,64 @@ def _to_lead_time(ds: xr.Dataset) -> xr.Dataset:
     return ds
 
 
+def _targets(ds, kind, aggregation, regions):
+    """(counter kind, increment) pairs ds is accumulated into, gridded and/or regional"""
+    for target in counter_kinds(kind, aggregation):
+        if target.endswith(REGIONAL_SUFFIX):
+            yield target, aggregate(ds, regions)
+        elif "region" in ds.dims:
+            raise ValueError(f"The {kind} increments were reduced to regions, set the same AGGREGATION in every job")
+        else:
+            yield target, ds
+
+
+def _merged_ledger(base, kind, fmt, mode, exclude=None):
+    """
+    Contributions already accumulated for the counter kind under base: those
+    of the counter and, in sharded mode, of its shards but exclude
+    """
+    counter_file = counter_path(base, kind, fmt)
+    recover_counter(counter_file, fmt)
+    ledger = read_ledger(counter_file, fmt)
+    if mode == "sharded":
+        ledger = merge_ledgers(ledger, pending_ledger(base, kind, exclude))
+    return ledger
+
+
+def _is_merged(base, kind, start_time, fmt, mode, aggregation):
+    """Whether the date was merged into every counter of kind under base"""
+    return all(start_time in _merged_ledger(base, target, fmt, mode) for target in counter_kinds(kind, aggregation))
+
+
+def _merge(ds, base, kind, start_time, end_time, fmt, mode, policy, compensated, aggregation, regions):
+    """
+    Accumulate the part of the increment ds of a date that is not in the
+    counters (or shards) of kind under base yet, with its ledger
+    """
+    for target, ds_target in _targets(ds, kind, aggregation, regions):
+        # The shard of the date, if any, is written again whole
+        ledger = _merged_ledger(base, target, fmt, mode, exclude=shard_path(base, target, start_time, end_time))
+        ds_todo = unmerged(ds_target, ledger, start_time)
+        if ds_todo is None:
+            print(f"[INFO] {start_time} already merged into {base} {target}, skipping")
+            continue
+
+        contribution = {start_time: labels(ds_todo)}
+        if mode == "sharded":
+            write_shard(ds_todo, base, target, start_time, end_time, policy, compensated, ledger=contribution)
+        else:
+            counter_file = counter_path(base, target, fmt)
+            update_counter(
+                ds_todo, counter_file, fmt, attrs=ledger_attrs(merge_ledgers(ledger, contribution)),
+                policy=policy, compensated=compensated,
+            )
+
+
 def main() -> None:
     args = parse_arguments()
     config = read_config(args.config)
+    telemetry = Telemetry("merger", args.config, config)
+    ExecutionContext.from_env().start(telemetry)
 
     _START_TIME   = config.get("START_TIME", "")
     _END_TIME     = config.get("END_TIME", "")
@@ -44,78 +99,93 @@ def main() -> None:
     _MEMBERS      = config.get("MEMBERS", "")
     _HPCROOTDIR     = config.get("HPCROOTDIR", "")
     _REDUCE      = os.environ.get("REDUCE", "false").lower() == "true"
+    _COUNTER_FORMAT = os.environ.get("COUNTER_FORMAT", "") or "netcdf"
+    _MERGE_MODE  = os.environ.get("MERGE_MODE", "") or "counter"
+    _STORAGE     = StoragePolicy.from_env("COUNTER_DTYPES")
+    _ACCUMULATION = os.environ.get("ACCUMULATION", "") or "plain"
+    _AGGREGATION = os.environ.get("AGGREGATION", "") or "gridded"
+    _REGIONS     = parse_regions(os.environ.get("REGIONS", "") or "global") if _AGGREGATION != "gridded" else {}
+
+    if _ACCUMULATION not in ACCUMULATIONS:
+        raise ValueError(f"Unknown ACCUMULATION: {_ACCUMULATION!r}, expected one of {list(ACCUMULATIONS)}")
+    compensated = _ACCUMULATION == "kahan"
 
     output_vars = normalize_out_vars(_OUT_VARS)
 
-    _TRUTH_PATH    = os.path.join(_HPCROOTDIR, 'truth', _START_TIME, 'truth_store.zarr')
+    _TRUTH_DIR     = truth_dir(_HPCROOTDIR, _START_TIME)
 
     # Un counter per var (molto più semplice e meno rischi di collisioni tra var)
     # Se vuoi un unico file per tutte le var, si può fare, ma serve nomi univoci.
     for var in output_vars:
 
-        counter_file = f"{_OUTPUT_PATH}/{var}/metrics-counter-probabilistic.nc"
         base = f"{_OUTPUT_PATH}/{var}"
+        merge_args = (_START_TIME, _END_TIME, _COUNTER_FORMAT, _MERGE_MODE, _STORAGE, compensated, _AGGREGATION, _REGIONS)
         incre_file_prob = f"{base}/out-{_START_TIME}-{_END_TIME}-probabilistic.nc"  # (nome tuo)
-        ds_prob = xr.open_dataset(incre_file_prob)
+        telemetry.phase("open")
+        if os.path.exists(incre_file_prob):
+            ds_prob = xr.open_dataset(incre_file_prob)
 
-        ds_prob = _to_lead_time(ds_prob)
+            ds_prob = _to_lead_time(ds_prob)
+            telemetry.array(f"{var}_probabilistic", ds_prob)
 
-        # aggiorna counter su disco
-        if not os.path.exists(counter_file):
-            safe_write_netcdf(ds_prob, counter_file)
-        else:
-            ds_counter = xr.open_dataset(counter_file)
-            ds_counter, ds_prob = xr.align(ds_counter, ds_prob, join="outer")
-            ds_new = ds_counter.fillna(0) + ds_prob.fillna(0)
-            ds_counter.close()
-
-            safe_write_netcdf(ds_new, counter_file)
-        
-        ds_prob.close()
-        os.remove(incre_file_prob)
-        
+            telemetry.phase("merge")
 
+            # aggiorna counter su disco, o scrivi lo shard della data
+            _merge(ds_prob, base, "probabilistic", *merge_args)
 
+            ds_prob.close()
+            os.remove(incre_file_prob)
+        elif _is_merged(base, "probabilistic", _START_TIME, _COUNTER_FORMAT, _MERGE_MODE, _AGGREGATION):
+            # Merged and removed by a previous attempt of this job
+            print(f"[INFO] {_START_TIME} already merged into {base} probabilistic, skipping")
+        else:
+            raise FileNotFoundError(incre_file_prob)
 
-        counter_file = f"{_OUTPUT_PATH}/{var}/metrics-counter-deterministic.nc"
+        telemetry.phase("open")
         if _REDUCE:
-            incre_file_det = f"{_OUTPUT_PATH}/{var}/out-{_START_TIME}-{_END_TIME}-deterministic-reduced.nc"
-            ds_det = xr.open_dataset(incre_file_det)
-            ds_all = _to_lead_time(ds_det).load()
-            ds_det.close()
-            os.remove(incre_file_det)
+            incre_files_det = [f"{base}/out-{_START_TIME}-{_END_TIME}-deterministic-reduced.nc"]
         else:
-            ds_dete_members = []
-            for key in _MEMBERS.split():
-                base = f"{_OUTPUT_PATH}/{var}/{str(key)}"
-                incre_file_det = f"{base}/out-{_START_TIME}-{_END_TIME}-{key}-deterministic.nc"  # (nome tuo)
-
-                ds_dete = xr.open_dataset(incre_file_det)
-                
-                # se vuoi lead_time al posto di time (opzionale)
-                ds_dete = _to_lead_time(ds_dete).load()
-                ds_dete_members.append(ds_dete)
-
-                
-                ds_dete.close()
-                os.remove(incre_file_det)
-
-            # concat su member: dataset shape (member, lead_time/time, level, lat, lon, ...)
-            ds_all = xr.concat(ds_dete_members, dim="member")
-
-        # aggiorna counter su disco
-        if not os.path.exists(counter_file):
-            safe_write_netcdf(ds_all, counter_file)
-        else:
-            ds_counter = xr.open_dataset(counter_file)
-            ds_counter, ds_all = xr.align(ds_counter, ds_all, join="outer")
-            ds_new = ds_counter.fillna(0) + ds_all.fillna(0)
-            ds_counter.close()
+            incre_files_det = [
+                f"{base}/{key}/out-{_START_TIME}-{_END_TIME}-{key}-deterministic.nc"  # (nome tuo)
+                for key in _MEMBERS.split()
+            ]
+
+        # Files of a previous attempt are removed once the date is merged, the others must all be there
+        present = [path for path in incre_files_det if os.path.exists(path)]
+        if len(present) < len(incre_files_det):
+            if not _is_merged(base, "deterministic", _START_TIME, _COUNTER_FORMAT, _MERGE_MODE, _AGGREGATION):
+                raise FileNotFoundError(next(path for path in incre_files_det if path not in present))
+            print(f"[INFO] {_START_TIME} already merged into {base} deterministic, skipping")
+            for path in present:
+                os.remove(path)
+            continue
+
+        ds_dete_members = []
+        for incre_file_det in incre_files_det:
+            ds_dete = xr.open_dataset(incre_file_det)
+
+            # se vuoi lead_time al posto di time (opzionale)
+            ds_dete = _to_lead_time(ds_dete).load()
+            ds_dete_members.append(ds_dete)
+
+            ds_dete.close()
+
+        # concat su member: dataset shape (member, lead_time/time, level, lat, lon, ...)
+        ds_all = ds_dete_members[0] if _REDUCE else xr.concat(ds_dete_members, dim="member")
+        telemetry.array(f"{var}_deterministic", ds_all)
+
+        telemetry.phase("merge")
+        # aggiorna counter su disco, o scrivi lo shard della data
+        _merge(ds_all, base, "deterministic", *merge_args)
+
+        # Only once the date is merged, a failure above leaves them for the retry
+        for incre_file_det in incre_files_det:
+            os.remove(incre_file_det)
 
-            safe_write_netcdf(ds_new, counter_file)
+    # Remove the truth of the date: its store, the regridded store and any store left aside
+    shutil.rmtree(_TRUTH_DIR, ignore_errors=True)
 
-    # Remove truth
-    shutil.rmtree(_TRUTH_PATH, ignore_errors=True)
+    telemetry.finish()
 
 
     
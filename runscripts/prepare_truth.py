@@ -0,0 +1,88 @@
+"""
+Interpolate the truth of one start date on the model grid, levels and times
+once, for all the DETERMINISTIC and PROBABILISTIC jobs of that date.
+"""
+
+# Built-in/Generics
+import os
+import shutil
+import uuid
+from dataclasses import replace
+
+# Third party
+import xarray as xr
+
+# Local
+from AIUQst_lib.functions import parse_arguments, read_config, normalize_out_vars
+from AIUQdiag_lib.execution import ExecutionContext
+from AIUQdiag_lib.planner import input_shapes, plan
+from AIUQdiag_lib.regrid import interp_truth
+from AIUQdiag_lib.telemetry import Telemetry
+from AIUQdiag_lib.truth import REGRIDDED_CHUNKS, REGRIDDED_STORE, TRUTH_STORE, model_grid, open_truth, truth_dir
+
+
+def main() -> None:
+    # Read config
+    args = parse_arguments()
+    config = read_config(args.config)
+    telemetry = Telemetry("prepare_truth", args.config, config)
+    context = ExecutionContext.from_env()
+
+    _START_TIME = config.get("START_TIME", "")
+    _END_TIME = config.get("END_TIME", "")
+    _HPCROOTDIR = config.get("HPCROOTDIR", "")
+    _OUT_VARS = config.get("OUT_VARS", [])
+    _OUTPUT_PATH = config.get("OUTPUT_PATH", "")
+    _MEMBERS = config.get("MEMBERS", "")
+    _REGRID_CACHE = os.path.join(_HPCROOTDIR, "regrid_cache") \
+        if os.environ.get("REGRID_CACHE", "false").lower() == "true" else None
+
+    output_vars = normalize_out_vars(_OUT_VARS)
+    members = _MEMBERS.split()
+    if not members:
+        raise ValueError("PREPARE_TRUTH requires MEMBERS in config")
+
+    _TRUTH_DIR = truth_dir(_HPCROOTDIR, _START_TIME)
+    _REGRIDDED_PATH = os.path.join(_TRUTH_DIR, REGRIDDED_STORE)
+
+    # All members share the grid, levels and times of the first one
+    model_files = {
+        var: f"{_OUTPUT_PATH}/{var}/{members[0]}/out-{_START_TIME}-{_END_TIME}-{members[0]}-{var}.nc"
+        for var in output_vars
+    }
+
+    # Planned from the metadata of the inputs, before anything is read: every chunk
+    # needs the whole grid, so fewer of them are interpolated at once when they do not fit
+    workers = min(
+        plan("interp", input_shapes([model_files[var]], _TRUTH_DIR, var), context.memory, context.workers)
+        .log(var, telemetry).workers
+        for var in output_vars
+    ) if output_vars else context.workers
+    context = replace(context, workers=workers).start(telemetry)
+
+    telemetry.phase("interp")
+    regridded = {}
+    for var in output_vars:
+        truth = open_truth(os.path.join(_TRUTH_DIR, TRUTH_STORE), var)
+        telemetry.array(f"{var}_truth", truth)
+        regridded[var] = interp_truth(truth, model_grid(model_files[var]), _REGRID_CACHE)
+
+    final = xr.Dataset(regridded)
+    final = final.chunk({dim: size for dim, size in REGRIDDED_CHUNKS.items() if dim in final.dims})
+    for variable in final.variables.values():
+        variable.encoding = {}
+    telemetry.array("regridded", final)
+
+    # Interpolation is computed while writing
+    telemetry.phase("write")
+    # Written aside and moved in place, readers never see a partial store
+    tmp = f"{_REGRIDDED_PATH}.tmp-{uuid.uuid4().hex}"
+    final.to_zarr(tmp, mode="w", zarr_format=2)
+    shutil.rmtree(_REGRIDDED_PATH, ignore_errors=True)
+    os.replace(tmp, _REGRIDDED_PATH)
+
+    telemetry.finish()
+
+
+if __name__ == "__main__":
+    main()
@@ -5,54 +5,136 @@
 # Built-in/Generics
 import os
 import shutil
+import uuid
 import yaml
 
 # Third party
+import dask.array as dsa
 import numpy as np
 import xarray as xr
 import zarr
+from xarray.backends.locks import HDF5_LOCK
 
 # Local
 from AIUQst_lib.functions import parse_arguments, read_config, normalize_out_vars
 from AIUQst_lib.pressure_levels import check_pressure_levels
 from AIUQst_lib.cards import read_ic_card, read_std_version
 from AIUQst_lib.variables import reassign_long_names_units, define_ics_mappers
-
-
-def _preprocess_one_file(ds):
-    """Helper function to correctly set time dimension when ingesting"""
-    vt0 = ds["valid_time"].isel(valid_time=0)
-    ds = ds.expand_dims(time=[vt0.values])
-    return ds
-
-
-def _preprocess_longitude(ds):
-    """Helper function to preprocess longitude and set it in [-180, 180)"""
-    ds["longitude"] = (ds["longitude"] + 180) % 360 - 180
-    ds = ds.sortby(ds.longitude)
-    ds = ds.interpolate_na("longitude", method="nearest", fill_value="extrapolate")
-    return ds
-
-
-def crps_ensemble_xarray(da, truth):
+from AIUQdiag_lib.execution import ExecutionContext, map_variables
+from AIUQdiag_lib.grid import fill_missing_longitude
+from AIUQdiag_lib.increments import probabilistic_scores
+from AIUQdiag_lib.model import model_file, open_model_var
+from AIUQdiag_lib.planner import input_shapes, plan
+from AIUQdiag_lib.regions import job_increments, parse_regions
+from AIUQdiag_lib.storage import StoragePolicy, as_model_dtype, write_netcdf
+from AIUQdiag_lib.telemetry import Telemetry
+from AIUQdiag_lib.tiling import parse_memory, tile_slices
+from AIUQdiag_lib.truth import truth_dir, truth_on_model_grid
+
+
+def _create_tiled_output(path, tile_out, grid, tile_steps, storage):
     """
-    Compute the CRPS for an ensemble forecast in xarray using:
-    CRPS = E|X - y| - 0.5 E|X - X'|
+    Pre-create the incremental file with the full-grid schema of tile_out,
+    filled with NaN, so that tiles can then be written in place. Compressed
+    files are chunked by tile.
     """
-    # term1 = E|X - y|
-    term1 = np.abs(truth - da).mean(dim="member")
-
-    # term2 = 0.5 * E|X - X'|
-    diffs = np.abs(da - da.rename(member="member2"))
-    term2 = 0.5 * diffs.mean(dim=("member", "member2"))
-
-    return term1 - term2
+    coords = {dim: grid[dim] if dim in grid else tile_out[dim].values for dim in tile_out.dims}
+
+    data_vars = {}
+    for name, da in tile_out.data_vars.items():
+        shape = tuple(len(coords[dim]) for dim in da.dims)
+        chunks = tuple(tile_steps.get(dim) or len(coords[dim]) for dim in da.dims)
+        data_vars[name] = (da.dims, dsa.full(shape, np.nan, dtype=da.dtype, chunks=chunks), da.attrs)
+
+    template = storage.cast(xr.Dataset(data_vars, coords=coords))
+    encoding = storage.netcdf_encoding(template, chunked=False)
+    for name, enc in encoding.items():
+        enc["chunksizes"] = tuple(chunks[0] for chunks in template[name].chunks)
+    write_netcdf(template, path, encoding=encoding)
+    return {dim: template.indexes[dim] for dim in template.dims}
+
+
+def _write_tile(path, tile_out, indexes):
+    """Write every variable of tile_out in its region of the incremental file"""
+    import netCDF4
+
+    with HDF5_LOCK, netCDF4.Dataset(path, "r+") as nc:
+        for name, da in tile_out.data_vars.items():
+            region = []
+            for dim in da.dims:
+                pos = indexes[dim].get_indexer(da[dim].values)
+                order = np.argsort(pos)
+                da = da.isel({dim: order})
+                pos = pos[order]
+                if pos[0] < 0 or pos[-1] - pos[0] + 1 != len(pos):
+                    raise ValueError(f"Tile of {name} does not map to a contiguous region along {dim}")
+                region.append(slice(int(pos[0]), int(pos[-1]) + 1))
+            nc.variables[name][tuple(region)] = da.values
+
+
+def _run_tiled(model_files, members, truth_directory, var, incre_file, tile_levels, tile_latitudes, memory_budget, regrid_cache, telemetry, storage, context, rank=False):
+    """
+    Compute the probabilistic scores tile by tile (level blocks x latitude
+    bands), streaming each tile from the member files and writing it into the
+    incremental file before reading the next one. The file is filled aside
+    and moved in place once every tile is written.
+    """
+    # Tiles sized from the metadata of the inputs, before anything is read
+    tile_plan = plan(
+        "crps", input_shapes(model_files, truth_directory, var), memory_budget,
+        levels=tile_levels, time=None, latitudes=tile_latitudes, tiled=True, rank=rank,
+    ).log(f"{var} tiles", telemetry)
+    tile_levels, tile_latitudes = tile_plan.chunks["level"], tile_plan.chunks["latitude"]
+    tile_steps = {"level": tile_levels, "latitude": tile_latitudes}
+
+    telemetry.phase("open")
+    handles = [open_model_var(f, var, member, fill_missing=False) for f, member in zip(model_files, members)]
+    member_das = [da for _, da in handles]
+    grid = {dim: member_das[0].indexes[dim] for dim in ("level", "latitude")}
+    n_lat = member_das[0].sizes["latitude"]
+
+    tmp = f"{incre_file}.tmp-{uuid.uuid4().hex}"
+    indexes = None
+    for level_slice in tile_slices(len(grid["level"]), tile_levels):
+        # Truth is interpolated once per level block and sliced per latitude band
+        telemetry.phase("interp")
+        level_block = member_das[0].isel(level=level_slice)
+        truth_block = truth_on_model_grid(truth_directory, var, level_block, regrid_cache).load()
+
+        for lat_slice in tile_slices(n_lat, tile_latitudes):
+            telemetry.phase("open")
+            tile = {"level": level_slice, "latitude": lat_slice}
+            model = xr.concat([da.isel(tile).load() for da in member_das], dim="member")
+            telemetry.phase("preprocess")
+            model = fill_missing_longitude(model)
+            truth_tile = truth_block.sel(latitude=model.latitude)
+
+            telemetry.phase("kernel")
+            tile_out = as_model_dtype(
+                probabilistic_scores(context.chunk(model), context.chunk(truth_tile), var, rank).compute(), model
+            )
+            telemetry.phase("write")
+            if indexes is None:
+                indexes = _create_tiled_output(tmp, tile_out, grid, tile_steps, storage)
+            _write_tile(tmp, tile_out, indexes)
+    os.replace(tmp, incre_file)
+
+    # Sizes of the ensemble from the metadata, concatenating the members would read them all
+    sample = member_das[0]
+    telemetry.add("arrays", f"{var}_model", {
+        "sizes": {**{str(dim): int(size) for dim, size in sample.sizes.items()}, "member": len(member_das)},
+        "nbytes": len(member_das) * sample.size * sample.dtype.itemsize,
+    })
+    for ds, _ in handles:
+        ds.close()
 
 
 def main() -> None:
     # Read config
     args = parse_arguments()
     config = read_config(args.config)
+    telemetry = Telemetry("probabilistic", args.config, config)
+    context = ExecutionContext.from_env().start(telemetry)
 
     _START_TIME = config.get("START_TIME", "")
     _END_TIME = config.get("END_TIME", "")
@@ -60,150 +142,79 @@ def main() -> None:
     _OUT_VARS = config.get("OUT_VARS", [])
     _OUTPUT_PATH = config.get("OUTPUT_PATH", "")
     _MEMBERS = config.get("MEMBERS", "")
+    _TILED = os.environ.get("TILED", "false").lower() == "true"
+    _TILE_LEVELS = int(os.environ.get("TILE_LEVELS", "") or 1)
+    _TILE_LATITUDES = int(os.environ.get("TILE_LATITUDES", "") or 0)
+    _MEMORY_BUDGET = parse_memory(os.environ.get("MEMORY_BUDGET", ""))
+    _REGRID_CACHE = os.path.join(_HPCROOTDIR, "regrid_cache") \
+        if os.environ.get("REGRID_CACHE", "false").lower() == "true" else None
+    _STORAGE = StoragePolicy.from_env("INCREMENT_DTYPES")
+    _VAR_WORKERS = int(os.environ.get("VAR_WORKERS", "") or 1)
+    _RANK_HISTOGRAM = os.environ.get("RANK_HISTOGRAM", "false").lower() == "true"
+    _AGGREGATION = os.environ.get("AGGREGATION", "") or "gridded"
+    _REGIONS = parse_regions(os.environ.get("REGIONS", "") or "global") if _AGGREGATION != "gridded" else {}
 
     output_vars = normalize_out_vars(_OUT_VARS)
 
-    # Truth path
-    _TRUTH_PATH = os.path.join(_HPCROOTDIR, "truth", _START_TIME, "truth_store.zarr")
+    # Truth directory, holding the regridded truth when PREPARE_TRUTH ran
+    _TRUTH_DIR = truth_dir(_HPCROOTDIR, _START_TIME)
+
+    # The memory budget of the job is shared by the variables processed at once
+    var_share = max(1, min(_VAR_WORKERS, len(output_vars)))
+    tile_budget = _MEMORY_BUDGET // var_share if _MEMORY_BUDGET else _MEMORY_BUDGET
+    chunk_budget = context.memory // var_share if context.memory else context.memory
 
-    for var in output_vars:
+    def process(var):
         OUTPUT_BASE_PATH = f"{_OUTPUT_PATH}/{var}"
         _INCRE_FILE = f"{OUTPUT_BASE_PATH}/out-{_START_TIME}-{_END_TIME}-probabilistic.nc"
 
         # Load all generated members
         members = _MEMBERS.split()
+        model_files = [model_file(_OUTPUT_PATH, var, member, _START_TIME, _END_TIME) for member in members]
 
-        models = []
-        for member in members:
-            _MODEL_FILE = f"{OUTPUT_BASE_PATH}/{str(member)}/out-{_START_TIME}-{_END_TIME}-{member}-{var}.nc"
-            ds = xr.open_dataset(_MODEL_FILE)
-
-            if "lon" in ds.coords:
-                ds = ds.rename({"lon": "longitude"})
-            if "lat" in ds.coords:
-                ds = ds.rename({"lat": "latitude"})
-
-            ds = _preprocess_one_file(ds)
-            ds = _preprocess_longitude(ds)
-
-            target = {}
-            if "temperature" in ds.data_vars:
-                target["temperature"] = "t"
-            if "u_component_of_wind" in ds.data_vars:
-                target["u_component_of_wind"] = "u"
-            if "v_component_of_wind" in ds.data_vars:
-                target["v_component_of_wind"] = "v"
-            if "geopotential" in ds.data_vars:
-                target["geopotential"] = "z"
-            ds = ds.rename(target)
-
-            # Keep valid_time as the forecast time axis, and drop init-time (length=1) to avoid "dummy"
-            da = ds[var]
-            if "time" in da.dims and da.sizes["time"] == 1:
-                da = da.isel(time=0, drop=True)
-            da = da.rename({"valid_time": "time"}).expand_dims(member=[member])
+        if _TILED:
+            _run_tiled(
+                model_files, members, _TRUTH_DIR, var, _INCRE_FILE,
+                _TILE_LEVELS, _TILE_LATITUDES, tile_budget, _REGRID_CACHE, telemetry, _STORAGE, context, _RANK_HISTOGRAM,
+            )
+            return
+
+        # Chunks sized from the metadata of the inputs, before anything is read
+        chunks = plan(
+            "crps", input_shapes(model_files, _TRUTH_DIR, var), chunk_budget, context.workers, rank=_RANK_HISTOGRAM
+        ).log(var, telemetry).chunks
 
+        telemetry.phase("open")
+        models = []
+        for member, path in zip(members, model_files):
+            ds, da = open_model_var(path, var, member)
             models.append(da)
             ds.close()
 
-        model = xr.concat(models, dim="member")
-
-        # Open truth and interpolate on model grid
-        truth = xr.open_zarr(_TRUTH_PATH, chunks={"time": 1})[var]
-        truth["longitude"] = (truth["longitude"] + 180) % 360 - 180
-        truth = truth.sortby(truth.longitude)
-        truth = truth.isel(level=~truth["level"].to_index().duplicated())
-        truth = truth.interp(
-            longitude=model.longitude,
-            latitude=model.latitude,
-            level=model.level,
-            time=model.time,
-            method="linear",
-        ).sortby("level")
-
-        # Ensemble spread statistics (independent of truth members)
-        ens_std = model.std(dim="member", ddof=0).rename(f"{var}_std")
-        ens_std_real = truth.std(dim="member", ddof=0).rename(f"{var}_std_truth") if "member" in truth.dims else None
-
-        model_mean = model.mean(dim="member")
-        model_std = model.std(dim="member", ddof=0)
-
-        truth_mean = truth.mean(dim="member")
-        truth_std = truth.std(dim="member", ddof=0)
-
-        eps = 1e-6
-        model_std = xr.where(model_std < eps, eps, model_std)
-        truth_std = xr.where(truth_std < eps, eps, truth_std)
-
-        # 1. Forecast centered on truth mean
-        model_centred = (model - model_mean) + truth_mean
-
-        # 2. Forecast with truth std but model mean
-        model_rescaled = ((model - model_mean) / model_std) * truth_std + model_mean
-
-        # 3. Forecast with truth std and truth mean
-        model_normalized = ((model - model_mean) / model_std) * truth_std + truth_mean
-
-        n = xr.ones_like(ens_std).rename(f"{var}_n")
-
-        crps_results = []
-
-        # If truth has members, compute CRPS against each truth member
-        if "member" in truth.dims:
-            truth_members_iter = truth["member"].values
-        else:
-            truth_members_iter = [None]
-
-        for m in truth_members_iter:
-            if m is None:
-                truth_sel = truth
-                truth_member_name = "truth"
-            else:
-                truth_sel = truth.sel(member=m)
-                truth_member_name = str(m)
-                if "member" in truth_sel.dims:
-                    truth_sel = truth_sel.squeeze("member", drop=True)
-            
-
-            crps_truth = crps_ensemble_xarray(truth, truth_sel).rename(f"{var}_crps_truth").expand_dims(
-                member=[truth_member_name]
-            )
-            crps = crps_ensemble_xarray(model, truth_sel).rename(f"{var}_crps").expand_dims(
-                member=[truth_member_name]
-            )
-            crps_centered = crps_ensemble_xarray(model_centred, truth_sel).rename(f"{var}_crps_centered").expand_dims(
-                member=[truth_member_name]
-            )
-            crps_rescaled = crps_ensemble_xarray(model_rescaled, truth_sel).rename(f"{var}_crps_rescaled").expand_dims(
-                member=[truth_member_name]
-            )
-            crps_normalized = crps_ensemble_xarray(model_normalized, truth_sel).rename(f"{var}_crps_normalized").expand_dims(
-                member=[truth_member_name]
-            )
-
+        model = context.chunk(xr.concat(models, dim="member"), chunks)
+        telemetry.array(f"{var}_model", model)
 
-            crps_results.append(crps_truth)
-            crps_results.append(crps)
-            crps_results.append(crps_centered)
-            crps_results.append(crps_rescaled)
-            crps_results.append(crps_normalized)
+        # Truth on the model grid
+        telemetry.phase("interp")
+        truth = context.chunk(truth_on_model_grid(_TRUTH_DIR, var, model, _REGRID_CACHE), chunks)
+        telemetry.array(f"{var}_truth", truth)
 
-        crps_all = xr.merge(crps_results, join="outer")
+        telemetry.phase("kernel")
+        ds_out = as_model_dtype(probabilistic_scores(model, truth, var, _RANK_HISTOGRAM).compute(), model)
+        telemetry.array(f"{var}_increments", ds_out)
 
-        ds_out = xr.merge(
-            [
-                ens_std,
-                ens_std_real,
-                #ens_var,
-                n,
-                crps_all,
-            ]
-        )
-        ds_out.to_netcdf(_INCRE_FILE)
+        telemetry.phase("write")
+        ds_out = job_increments(ds_out, _AGGREGATION, _REGIONS)
+        write_netcdf(ds_out, _INCRE_FILE, _STORAGE)
 
         model.close()
         truth.close()
 
+    # Variables share the truth stores opened by the process
+    map_variables(process, output_vars, _VAR_WORKERS)
+
+    telemetry.finish()
+
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,55 @@
+"""
+Reduce the per-date shards written by MERGER in sharded mode into the
+metrics counters.
+"""
+
+# Built-in/Generics
+import os
+
+# Local
+from AIUQst_lib.functions import parse_arguments, read_config, normalize_out_vars
+from AIUQdiag_lib.counters import ACCUMULATIONS, counter_path
+from AIUQdiag_lib.execution import ExecutionContext
+from AIUQdiag_lib.regions import counter_kinds
+from AIUQdiag_lib.shards import reduce_shards, shard_dir
+from AIUQdiag_lib.storage import StoragePolicy
+from AIUQdiag_lib.telemetry import Telemetry
+
+
+def main() -> None:
+    args = parse_arguments()
+    config = read_config(args.config)
+    telemetry = Telemetry("reduce_counters", args.config, config)
+    context = ExecutionContext.from_env().start(telemetry)
+
+    _OUT_VARS       = config.get("OUT_VARS", [])
+    _OUTPUT_PATH    = config.get("OUTPUT_PATH", "")
+    _COUNTER_FORMAT = os.environ.get("COUNTER_FORMAT", "") or "netcdf"
+    _WORKERS        = context.workers
+    _STORAGE        = StoragePolicy.from_env("COUNTER_DTYPES")
+    _ACCUMULATION   = os.environ.get("ACCUMULATION", "") or "plain"
+    _AGGREGATION    = os.environ.get("AGGREGATION", "") or "gridded"
+
+    if _ACCUMULATION not in ACCUMULATIONS:
+        raise ValueError(f"Unknown ACCUMULATION: {_ACCUMULATION!r}, expected one of {list(ACCUMULATIONS)}")
+
+    output_vars = normalize_out_vars(_OUT_VARS)
+
+    telemetry.phase("merge")
+    for var in output_vars:
+        base = f"{_OUTPUT_PATH}/{var}"
+        for kind in counter_kinds("probabilistic", _AGGREGATION) + counter_kinds("deterministic", _AGGREGATION):
+            reduce_shards(
+                shard_dir(base, kind),
+                counter_path(base, kind, _COUNTER_FORMAT),
+                _COUNTER_FORMAT,
+                _WORKERS,
+                policy=_STORAGE,
+                compensated=_ACCUMULATION == "kahan",
+            )
+
+    telemetry.finish()
+
+
+if __name__ == "__main__":
+    main()
@@ -17,6 +17,10 @@ from AIUQst_lib.functions import parse_arguments, read_config, normalize_out_var
 from AIUQst_lib.pressure_levels import check_pressure_levels
 from AIUQst_lib.cards import read_ic_card, read_std_version
 from AIUQst_lib.variables import reassign_long_names_units, define_ics_mappers
+from AIUQdiag_lib.execution import ExecutionContext
+from AIUQdiag_lib.grid import canonicalize_longitude
+from AIUQdiag_lib.resample import stream_daily_mean
+from AIUQdiag_lib.telemetry import Telemetry
 
 
 def main() -> None:
@@ -24,6 +28,8 @@ def main() -> None:
     # Read config
     args = parse_arguments()
     config = read_config(args.config)
+    telemetry = Telemetry("resample_ground", args.config, config)
+    ExecutionContext.from_env().start(telemetry)
 
     _START_TIME     = config.get("START_TIME", "")
     _END_TIME       = config.get("END_TIME", "")
@@ -32,6 +38,7 @@ def main() -> None:
     _IC             = config.get("IC_NAME", "")
     _STD_VERSION    = config.get("STD_VERSION", "")
     _OUT_LEVS       = config.get("OUT_LEVS", "")
+    _RESAMPLE_STREAMING = os.environ.get("RESAMPLE_STREAMING", "false").lower() == "true"
 
     if _OUT_LEVS != 'original':
         desired_levels = [
@@ -60,38 +67,69 @@ def main() -> None:
     _TRUTH_PATH_TEMP    = os.path.join(_HPCROOTDIR, 'truth', _START_TIME, 'truth_store_temp.zarr')
     _TRUTH_PATH    = os.path.join(_HPCROOTDIR, 'truth', _START_TIME, 'truth_store.zarr')
 
-    truth_temp = xr.open_zarr(_TRUTH_PATH_TEMP, chunks={"time":48})
-
-    truth_temp = (
-        truth_temp
-        .rename(rename_dict)
-        .resample(time="1D").mean()
-        .pipe(reassign_long_names_units, long_names_dict, units_dict)
-    )
-
-    # # Adjust longitudes to -0 - 360
-    truth_temp['longitude'] = truth_temp['longitude'] % 360
-    truth_temp = truth_temp.sortby('longitude')
-    
-    # Final part - Saving in zarr
-    final = truth_temp.chunk({"time": 1})        # Chunking by time for efficient access
-
     shutil.rmtree(                          # Remove existing data if any - avoid conflicts
         _TRUTH_PATH,
         ignore_errors=True)
-    
-    os.makedirs(_TRUTH_PATH, exist_ok=True)  # Ensure the directory existss
-    
-    final.to_zarr(                          # Save to zarr format - using version 2
-        f"{_TRUTH_PATH}",                   # Zarr version 3 has some issues with BytesBytesCodec
-        mode="w",                           # See https://github.com/pydata/xarray/issues/10032 as reference    
-        zarr_format=2)
-    
+
+    if _RESAMPLE_STREAMING:
+        # Lazily indexed, without dask: each day is read once, as one block
+        telemetry.phase("open")
+        truth_temp = xr.open_zarr(_TRUTH_PATH_TEMP, chunks=None)
+
+        # Only the variables retrieved for OUT_VARS are present
+        rename_dict = {k : v for k, v in rename_dict.items() if k in truth_temp.data_vars}
+
+        truth_temp = (
+            truth_temp
+            .rename(rename_dict)
+            .pipe(reassign_long_names_units, long_names_dict, units_dict)
+        )
+
+        # Longitudes in [-180, 180), the convention of the metric jobs, as a lazy index
+        truth_temp = canonicalize_longitude(truth_temp)
+        telemetry.array("truth_6h", truth_temp)
+
+        # Days are read, averaged and written in turn
+        telemetry.phase("write")
+        stream_daily_mean(truth_temp, _TRUTH_PATH)
+
+    else:
+        telemetry.phase("open")
+        truth_temp = xr.open_zarr(_TRUTH_PATH_TEMP, chunks={"time":48})
+        telemetry.array("truth_6h", truth_temp)
+
+        # Only the variables retrieved for OUT_VARS are present
+        rename_dict = {k : v for k, v in rename_dict.items() if k in truth_temp.data_vars}
+
+        truth_temp = (
+            truth_temp
+            .rename(rename_dict)
+            .resample(time="1D").mean()
+            .pipe(reassign_long_names_units, long_names_dict, units_dict)
+        )
+
+        # Longitudes in [-180, 180), the convention of the metric jobs
+        truth_temp = canonicalize_longitude(truth_temp)
+
+        # Final part - Saving in zarr
+        final = truth_temp.chunk({"time": 1})        # Chunking by time for efficient access
+
+        # The lazy resampling is computed while writing
+        telemetry.phase("write")
+        os.makedirs(_TRUTH_PATH, exist_ok=True)  # Ensure the directory existss
+
+        final.to_zarr(                          # Save to zarr format - using version 2
+            f"{_TRUTH_PATH}",                   # Zarr version 3 has some issues with BytesBytesCodec
+            mode="w",                           # See https://github.com/pydata/xarray/issues/10032 as reference
+            zarr_format=2)
+
     truth_temp.close()  # Close the temporary zarr store to free up resources
 
     shutil.rmtree(                          # Remove existing data if any - avoid conflicts
         _TRUTH_PATH_TEMP,
         ignore_errors=True)
+
+    telemetry.finish()
     
 if __name__ == "__main__":
     main()
\ No newline at end of file
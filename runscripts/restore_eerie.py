@@ -17,6 +17,10 @@ from AIUQst_lib.functions import parse_arguments, read_config, normalize_out_var
 from AIUQst_lib.pressure_levels import check_pressure_levels
 from AIUQst_lib.cards import read_ic_card, read_std_version
 from AIUQst_lib.variables import reassign_long_names_units, define_ics_mappers
+from AIUQdiag_lib.eerie import INGESTION_MODES, ingest_region, validate_files
+from AIUQdiag_lib.execution import ExecutionContext
+from AIUQdiag_lib.grid import canonicalize_longitude
+from AIUQdiag_lib.telemetry import Telemetry
 
 
 def main() -> None:
@@ -24,6 +28,8 @@ def main() -> None:
     # Read config
     args = parse_arguments()
     config = read_config(args.config)
+    telemetry = Telemetry("restore_eerie", args.config, config)
+    context = ExecutionContext.from_env().start(telemetry)
 
     _START_TIME     = config.get("START_TIME", "")
     _END_TIME       = config.get("END_TIME", "")
@@ -33,6 +39,9 @@ def main() -> None:
     _STD_VERSION    = config.get("STD_VERSION", "")
     _OUT_LEVS       = config.get("OUT_LEVS", "")
     _EERIE_MEMBERS  = os.environ.get("EERIE_MEMBERS", "1 2 3")
+    _EERIE_VALIDATION = os.environ.get("EERIE_VALIDATION", "") or "header"
+    _EERIE_INGESTION = os.environ.get("EERIE_INGESTION", "") or "merge"
+    _WORKERS        = context.workers
 
     if _OUT_LEVS != 'original':
         desired_levels = [
@@ -52,30 +61,48 @@ def main() -> None:
     _TRUTH_PATH    = os.path.join(_HPCROOTDIR, 'truth', _START_TIME, 'truth_store.zarr')
     eerie_members = _EERIE_MEMBERS.split()
 
-    data = []
+    if _EERIE_INGESTION not in INGESTION_MODES:
+        raise ValueError(f"Unknown EERIE_INGESTION: {_EERIE_INGESTION!r}, expected one of {list(INGESTION_MODES)}")
+
+    # All the files are validated at once, in parallel
+    telemetry.phase("validate")
+    files = {}
     for var in output_vars:
         for member in eerie_members:
             path = f'{_TRUTH_PATH_TEMP}/{var}/{member}'
+            files[var, member] = sorted(
+                os.path.join(path, f) for f in os.listdir(path) if f.endswith('.nc')
+            )
+
+    valid = set(validate_files(
+        [f for member_files in files.values() for f in member_files],
+        mode=_EERIE_VALIDATION,
+        workers=_WORKERS,
+    ))
+
+    valid_files = {}
+    for var in output_vars:
+        for member in eerie_members:
+            member_files = [f for f in files[var, member] if f in valid]
 
-            files = os.listdir(path)
-            files = [f for f in files if f.endswith('.nc')]
-            files = [os.path.join(path, f) for f in files]
-
-            valid_files = []
-            for f in files:
-                try:
-                    # Force a full read to catch corrupted files early.
-                    with xr.open_dataset(f) as ds:
-                        ds.load()
-                    valid_files.append(f)
-                except Exception as e:
-                    print(f"[WARNING] File corrotto saltato: {f} ({e})")
-
-            if not valid_files:
+            if not member_files:
                 print(f"[WARNING] Nessun file valido per {var} membro {member}")
                 continue
+            valid_files[var, member] = member_files
 
-            dat = xr.open_mfdataset(valid_files)
+    shutil.rmtree(                          # Remove existing data if any - avoid conflicts
+        _TRUTH_PATH,
+        ignore_errors=True)
+
+    if _EERIE_INGESTION == 'region':
+        # Every file is written by a worker straight into its region of the store
+        telemetry.phase("write")
+        ingest_region(_TRUTH_PATH, valid_files, desired_levels, workers=_WORKERS)
+    else:
+        telemetry.phase("open")
+        data = []
+        for (var, member), member_files in valid_files.items():
+            dat = xr.open_mfdataset(member_files)
             dat = dat.sel(isobaricInhPa=desired_levels)
             dat = dat.rename({'isobaricInhPa': 'level'})
             dat = dat.drop_vars('time_bnds')
@@ -84,31 +111,31 @@ def main() -> None:
             dat = dat.expand_dims('member').assign_coords(member=[member])
             data.append(dat)
 
-    data = xr.merge(data)
+        data = xr.merge(data)
 
-    # # Adjust longitudes to -0 - 360
-    data['longitude'] = data['longitude'] % 360
-    data = data.sortby('longitude')
-    
-    # Final part - Saving in zarr
-    final = data.chunk({"time": 1})        # Chunking by time for efficient access
+        # Longitudes in [-180, 180), the convention of the metric jobs
+        data = canonicalize_longitude(data)
+        telemetry.array("truth", data)
 
-    shutil.rmtree(                          # Remove existing data if any - avoid conflicts
-        _TRUTH_PATH,
-        ignore_errors=True)
-    
-    os.makedirs(_TRUTH_PATH, exist_ok=True)  # Ensure the directory existss
-    
-    final.to_zarr(                          # Save to zarr format - using version 2
-        f"{_TRUTH_PATH}",                   # Zarr version 3 has some issues with BytesBytesCodec
-        mode="w",                           # See https://github.com/pydata/xarray/issues/10032 as reference    
-        zarr_format=2)
-    
-    data.close()  # Close the temporary zarr store to free up resources
+        # Final part - Saving in zarr
+        final = data.chunk({"time": 1})        # Chunking by time for efficient access
+
+        telemetry.phase("write")
+
+        os.makedirs(_TRUTH_PATH, exist_ok=True)  # Ensure the directory existss
+
+        final.to_zarr(                          # Save to zarr format - using version 2
+            f"{_TRUTH_PATH}",                   # Zarr version 3 has some issues with BytesBytesCodec
+            mode="w",                           # See https://github.com/pydata/xarray/issues/10032 as reference
+            zarr_format=2)
+
+        data.close()  # Close the temporary zarr store to free up resources
 
     shutil.rmtree(                          # Remove existing data if any - avoid conflicts
         _TRUTH_PATH_TEMP,
         ignore_errors=True)
+
+    telemetry.finish()
     
 if __name__ == "__main__":
     main()
\ No newline at end of file
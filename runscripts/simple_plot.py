@@ -5,6 +5,9 @@ import numpy as np
 import sys
 
 from AIUQst_lib.functions import parse_arguments, read_config, normalize_out_vars
+from AIUQdiag_lib.execution import ExecutionContext
+from AIUQdiag_lib.grid import canonicalize_longitude, fill_missing_longitude
+from AIUQdiag_lib.telemetry import Telemetry
 
 
 def _preprocess_one_file(ds):
@@ -14,17 +17,13 @@ def _preprocess_one_file(ds):
         ds = ds.expand_dims(time=[vt0.values])
         return ds
 
-def _preprocess_longitude(ds):
-        ds['longitude'] = (ds['longitude'] + 180) % 360 - 180
-        ds = ds.sortby(ds.longitude)
-        ds = ds.interpolate_na('longitude', method='nearest', fill_value='extrapolate')
-        return ds
-
 if __name__ == "__main__":
 
         # Read config
         args = parse_arguments()
         config = read_config(args.config)
+        telemetry = Telemetry("simple_plot", args.config, config)
+        ExecutionContext.from_env().start(telemetry)
 
         _OUTPUT_PATH        = config.get("OUTPUT_PATH", "")
         _OUT_VARS           = config.get("OUT_VARS", [])
@@ -45,11 +44,15 @@ if __name__ == "__main__":
                 OUTPUT_FILE = f"{OUTPUT_BASE_PATH}/ngcm-{_START_TIME}-{_END_TIME}-{_RNG_KEY}-{var}.nc"
 
                 
+                telemetry.phase("open")
                 with xr.open_dataset(OUTPUT_FILE) as dataset:
+                        telemetry.phase("preprocess")
                         dataset = _preprocess_one_file(dataset)
-                        dataset = _preprocess_longitude(dataset)
+                        dataset = fill_missing_longitude(canonicalize_longitude(dataset))
+                        telemetry.array(var, dataset)
                         image_path = f"{OUTPUT_BASE_PATH}/ngcm-{_START_TIME}-{_END_TIME}-{_RNG_KEY}-{var}.png"
                         
+                        telemetry.phase("kernel")
                         weights = np.cos(np.deg2rad(dataset.latitude))
                         ds_avg = dataset.weighted(weights).mean(dim=['latitude', 'longitude'])
 
@@ -58,5 +61,8 @@ if __name__ == "__main__":
                 
                 os.remove(OUTPUT_FILE)
 
+        telemetry.phase("write")
         all_datasets = xr.merge(all_datasets)
-        all_datasets.to_netcdf(f"{_OUTPUT_PATH}/ngcm-{_START_TIME}-{_END_TIME}-{_RNG_KEY}_postproc.nc")
\ No newline at end of file
+        all_datasets.to_netcdf(f"{_OUTPUT_PATH}/ngcm-{_START_TIME}-{_END_TIME}-{_RNG_KEY}_postproc.nc")
+
+        telemetry.finish()
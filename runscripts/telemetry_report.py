@@ -0,0 +1,132 @@
+"""
+Summarise the telemetry records of an experiment.
+
+Reads every telemetry_<JOBNAME>.json of a LOG_<EXPID> directory and prints,
+per runscript, the wall time and peak memory of its jobs, where the time
+goes by phase, and the slowest jobs across all dates and members:
+
+    python3 runscripts/telemetry_report.py $HPCROOTDIR/LOG_$EXPID --top 10
+
+With --json the summary is printed as JSON instead.
+"""
+
+# Built-in/Generics
+import argparse
+import glob
+import json
+import os
+import statistics
+from collections import defaultdict
+
+# Local
+from AIUQdiag_lib.telemetry import TELEMETRY_PREFIX
+
+
+def load_records(log_dir):
+    records = []
+    for path in sorted(glob.glob(os.path.join(log_dir, f"{TELEMETRY_PREFIX}*.json"))):
+        try:
+            with open(path) as f:
+                records.append(json.load(f))
+        except (OSError, ValueError) as err:
+            print(f"[WARNING] Skipping {path}: {err}")
+    return records
+
+
+def summarise(records, top=10):
+    by_script = defaultdict(list)
+    for record in records:
+        by_script[record["script"]].append(record)
+
+    scripts = {}
+    for script, jobs in sorted(by_script.items()):
+        walls = [job["wall_s"] for job in jobs]
+        phases = defaultdict(list)
+        for job in jobs:
+            for phase, seconds in job["phases"].items():
+                phases[phase].append(seconds)
+        total = sum(walls)
+
+        scripts[script] = {
+            "jobs": len(jobs),
+            "failed": sum(not job["completed"] for job in jobs),
+            "wall_s": {"total": total, "mean": statistics.mean(walls), "max": max(walls)},
+            "peak_rss_mib": max(max(job["peak_rss_mib"], job["children_peak_rss_mib"]) for job in jobs),
+            "read_bytes": sum(job["io"].get("read_bytes", 0) for job in jobs),
+            "write_bytes": sum(job["io"].get("write_bytes", 0) for job in jobs),
+            "phases": {
+                phase: {
+                    "total": sum(seconds),
+                    "mean": statistics.mean(seconds),
+                    "max": max(seconds),
+                    "share": sum(seconds) / total if total else 0.0,
+                }
+                for phase, seconds in sorted(phases.items(), key=lambda item: -sum(item[1]))
+            },
+        }
+
+    slowest = sorted(records, key=lambda job: -job["wall_s"])[:top]
+    return {
+        "scripts": scripts,
+        "slowest": [
+            {
+                "job": job["job"],
+                "script": job["script"],
+                "wall_s": job["wall_s"],
+                "peak_rss_mib": max(job["peak_rss_mib"], job["children_peak_rss_mib"]),
+                "phase": max(job["phases"], key=job["phases"].get) if job["phases"] else None,
+                "completed": job["completed"],
+            }
+            for job in slowest
+        ],
+    }
+
+
+def _mib(nbytes):
+    return nbytes / 2**20
+
+
+def print_summary(summary):
+    for script, stats in summary["scripts"].items():
+        failed = f", {stats['failed']} failed" if stats["failed"] else ""
+        print(
+            f"{script}: {stats['jobs']} job(s){failed}, "
+            f"wall {stats['wall_s']['total']:.1f} s total / {stats['wall_s']['mean']:.1f} s mean / "
+            f"{stats['wall_s']['max']:.1f} s max, peak RSS {stats['peak_rss_mib']:.0f} MiB, "
+            f"read {_mib(stats['read_bytes']):.0f} MiB, written {_mib(stats['write_bytes']):.0f} MiB"
+        )
+        for phase, seconds in stats["phases"].items():
+            print(
+                f"    {phase:>12}: {seconds['total']:9.1f} s  {seconds['share']:6.1%}  "
+                f"mean {seconds['mean']:.2f} s  max {seconds['max']:.2f} s"
+            )
+
+    print("\nSlowest jobs:")
+    for job in summary["slowest"]:
+        status = "" if job["completed"] else "  (did not complete)"
+        print(
+            f"    {job['job']:<40} {job['wall_s']:9.1f} s  {job['peak_rss_mib']:8.0f} MiB  "
+            f"mostly {job['phase']}{status}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("log_dir", help="LOG_<EXPID> directory of the experiment")
+    parser.add_argument("--top", type=int, default=10, help="number of slowest jobs listed")
+    parser.add_argument("--json", action="store_true", help="print the summary as JSON")
+    args = parser.parse_args()
+
+    records = load_records(args.log_dir)
+    if not records:
+        raise SystemExit(f"No telemetry records in {args.log_dir}")
+
+    summary = summarise(records, args.top)
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print_summary(summary)
+
+
+if __name__ == "__main__":
+    main()
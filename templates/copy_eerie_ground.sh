@@ -18,6 +18,7 @@ HPCHOST=%HPCHOST%
 SRC_HOST=%EERIE.HOST%
 SRC_BASE=%EERIE.PATH%
 EERIE_MEMBERS="%EERIE.MEMBERS%"
+EERIE_CHECKSUM="%DIAGNOSTIC.EERIE_CHECKSUM%"
 DST_HOST="${HPCUSER}@${HPCHOST}"
 
 SRC_BASE="${SRC_BASE%/}"
@@ -49,7 +50,7 @@ if [ "$SRC_HOST" = "$DST_HOST" ]; then
 fi
 
 copy_file() {
-  local src="$1" dst="$2"
+  local src="$1" dst="$2" manifest="$3"
 
   # Skip missing source files instead of failing the whole job.
   if [ "$SAME_HOST" -eq 1 ]; then
@@ -80,6 +81,29 @@ copy_file() {
     # the input stream used by the outer while-read loop.
     run "scp $SSHOPTS -p \"$SRC_HOST\":\"$src\" \"$DST_HOST\":\"$dst\" < /dev/null"
   fi
+
+  # Checksum of the source, checked by RESAMPLE_GROUND_TRUTH with EERIE_VALIDATION=checksum
+  if [ "$EERIE_CHECKSUM" = "true" ] && [ "${DRY_RUN}" != "1" ]; then
+    local digest
+    if [ "$SAME_HOST" -eq 1 ]; then
+      digest="$(sha256sum "$src" | cut -d' ' -f1)"
+    else
+      digest="$(ssh $SSHOPTS "$SRC_HOST" "sha256sum '$src'" < /dev/null | cut -d' ' -f1)"
+    fi
+    echo "${digest}  $(basename "$dst")" >> "$manifest"
+  fi
+}
+
+# Move a manifest built locally next to the files it describes
+push_manifest() {
+  local manifest="$1" dst_dir="$2"
+  [ -f "$manifest" ] || return 0
+  if [ "$SAME_HOST" -eq 1 ]; then
+    run "cp \"$manifest\" \"$dst_dir/MANIFEST.sha256\""
+  else
+    run "scp $SSHOPTS \"$manifest\" \"$DST_HOST\":\"$dst_dir/MANIFEST.sha256\" < /dev/null"
+  fi
+  rm -f "$manifest"
 }
 
 mk_dst_dir() {
@@ -159,6 +183,7 @@ for var in "${VARS[@]}"; do
   for mem in "${MEMBERS[@]}"; do
     dst_dir="${DEST_BASE}/${START_TIME}/${var}/${mem}"
     mk_dst_dir "$dst_dir"
+    rm -f "${CTL_DIR}/manifest_${START_TIME}_${var}_${mem}"
   done
 done
 
@@ -169,7 +194,7 @@ while IFS= read -r ymd; do
       src_file="${SRC_BASE}/${var}/${mem}/${var}_${ymd}.nc"
       dst_dir="${DEST_BASE}/${START_TIME}/${var}/${mem}"
       dst_file="${dst_dir}/${var}_${ymd}.nc"
-      copy_file "$src_file" "$dst_file"
+      copy_file "$src_file" "$dst_file" "${CTL_DIR}/manifest_${START_TIME}_${var}_${mem}"
     done
   done
 done < <(python3 - "$START_TIME" "$END_TIME" <<'PY'
@@ -191,4 +216,10 @@ while cur <= end:
     print(cur.strftime("%Y%m%d"))
     cur += one
 PY
-)
\ No newline at end of file
+)
+
+for var in "${VARS[@]}"; do
+  for mem in "${MEMBERS[@]}"; do
+    push_manifest "${CTL_DIR}/manifest_${START_TIME}_${var}_${mem}" "${DEST_BASE}/${START_TIME}/${var}/${mem}"
+  done
+done
@@ -0,0 +1,56 @@
+#!/bin/bash
+
+HPCROOTDIR=%HPCROOTDIR%
+EXPID=%DEFAULT.EXPID%
+JOBNAME=%JOBNAME%
+
+SIF_PATH=%PATHS.SIF_FOLDER%/image_era.sif
+
+JOBNAME_WITHOUT_EXPID=$(echo ${JOBNAME} | sed 's/^[^_]*_//')
+
+logs_dir=${HPCROOTDIR}/LOG_${EXPID}
+configfile=$logs_dir/config_${JOBNAME_WITHOUT_EXPID}
+PLATFORM_NAME=%PLATFORM.NAME%
+REGRID_CACHE=%DIAGNOSTIC.REGRID_CACHE%
+REDUCE=%EXPERIMENT.REDUCE%
+INCREMENT_DTYPES="%DIAGNOSTIC.INCREMENT_DTYPES%"
+STORAGE_COMPRESSION=%DIAGNOSTIC.STORAGE_COMPRESSION%
+STORAGE_LEVEL=%DIAGNOSTIC.STORAGE_LEVEL%
+STORAGE_CHUNKS="%DIAGNOSTIC.STORAGE_CHUNKS%"
+VAR_WORKERS=%DIAGNOSTIC.VAR_WORKERS%
+ERROR_HISTOGRAM="%DIAGNOSTIC.ERROR_HISTOGRAM%"
+RANK_HISTOGRAM=%DIAGNOSTIC.RANK_HISTOGRAM%
+SCHEDULER=%DIAGNOSTIC.SCHEDULER%
+WORKERS=%DIAGNOSTIC.WORKERS%
+MEMORY_BUDGET=%DIAGNOSTIC.MEMORY_BUDGET%
+AGGREGATION=%DIAGNOSTIC.AGGREGATION%
+REGIONS="%DIAGNOSTIC.REGIONS%"
+
+OUTPUT_PATH=%HPCROOTDIR%/outputs
+
+# Load Singularity module only on MareNostrum5
+if [ "$PLATFORM_NAME" = "MARENOSTRUM5" ]; then
+    ml singularity
+fi
+
+singularity exec --nv \
+    --bind $HPCROOTDIR \
+    --bind $OUTPUT_PATH \
+    --env HPCROOTDIR=$HPCROOTDIR \
+    --env configfile=$configfile \
+    --env REGRID_CACHE=$REGRID_CACHE \
+    --env REDUCE=$REDUCE \
+    --env INCREMENT_DTYPES="$INCREMENT_DTYPES" \
+    --env STORAGE_COMPRESSION=$STORAGE_COMPRESSION \
+    --env STORAGE_LEVEL=$STORAGE_LEVEL \
+    --env STORAGE_CHUNKS="$STORAGE_CHUNKS" \
+    --env VAR_WORKERS=$VAR_WORKERS \
+    --env ERROR_HISTOGRAM="$ERROR_HISTOGRAM" \
+    --env RANK_HISTOGRAM=$RANK_HISTOGRAM \
+    --env SCHEDULER=$SCHEDULER \
+    --env WORKERS=$WORKERS \
+    --env MEMORY_BUDGET=$MEMORY_BUDGET \
+    --env AGGREGATION=$AGGREGATION \
+    --env REGIONS="$REGIONS" \
+    ${SIF_PATH} \
+    python3 $HPCROOTDIR/runscripts/diagnostics.py -c $configfile
\ No newline at end of file
@@ -11,6 +11,12 @@ JOBNAME_WITHOUT_EXPID=$(echo ${JOBNAME} | sed 's/^[^_]*_//')
 logs_dir=${HPCROOTDIR}/LOG_${EXPID}
 configfile=$logs_dir/config_${JOBNAME_WITHOUT_EXPID}
 PLATFORM_NAME=%PLATFORM.NAME%
+ERA5_SOURCE=%DIAGNOSTIC.ERA5_SOURCE%
+ERA5_CACHE=%DIAGNOSTIC.ERA5_CACHE%
+ERA5_WORKERS=%DIAGNOSTIC.ERA5_WORKERS%
+SCHEDULER=%DIAGNOSTIC.SCHEDULER%
+WORKERS=%DIAGNOSTIC.WORKERS%
+MEMORY_BUDGET=%DIAGNOSTIC.MEMORY_BUDGET%
 
 OUTPUT_PATH=%HPCROOTDIR%/outputs
 
@@ -23,5 +29,11 @@ singularity exec --nv \
     --bind $HPCROOTDIR \
     --env HPCROOTDIR=$HPCROOTDIR \
     --env configfile=$configfile \
+    --env ERA5_SOURCE=$ERA5_SOURCE \
+    --env ERA5_CACHE=$ERA5_CACHE \
+    --env ERA5_WORKERS=$ERA5_WORKERS \
+    --env SCHEDULER=$SCHEDULER \
+    --env WORKERS=$WORKERS \
+    --env MEMORY_BUDGET=$MEMORY_BUDGET \
     ${SIF_PATH} \
     python3 $HPCROOTDIR/runscripts/download_era5_ground.py -c $configfile
\ No newline at end of file
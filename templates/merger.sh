@@ -12,6 +12,18 @@ logs_dir=${HPCROOTDIR}/LOG_${EXPID}
 configfile=$logs_dir/config_${JOBNAME_WITHOUT_EXPID}
 PLATFORM_NAME=%PLATFORM.NAME%
 REDUCE=%EXPERIMENT.REDUCE%
+COUNTER_FORMAT=%DIAGNOSTIC.COUNTER_FORMAT%
+MERGE_MODE=%DIAGNOSTIC.MERGE_MODE%
+COUNTER_DTYPES="%DIAGNOSTIC.COUNTER_DTYPES%"
+STORAGE_COMPRESSION=%DIAGNOSTIC.STORAGE_COMPRESSION%
+STORAGE_LEVEL=%DIAGNOSTIC.STORAGE_LEVEL%
+STORAGE_CHUNKS="%DIAGNOSTIC.STORAGE_CHUNKS%"
+ACCUMULATION=%DIAGNOSTIC.ACCUMULATION%
+AGGREGATION=%DIAGNOSTIC.AGGREGATION%
+REGIONS="%DIAGNOSTIC.REGIONS%"
+SCHEDULER=%DIAGNOSTIC.SCHEDULER%
+WORKERS=%DIAGNOSTIC.WORKERS%
+MEMORY_BUDGET=%DIAGNOSTIC.MEMORY_BUDGET%
 
 OUTPUT_PATH=%HPCROOTDIR%/outputs
 GRID_FILE=%PATHS.SUPPORT_FOLDER%/aifs_grid.txt
@@ -27,5 +39,17 @@ singularity exec --nv \
     --env HPCROOTDIR=$HPCROOTDIR \
     --env configfile=$configfile \
     --env REDUCE=$REDUCE \
+    --env COUNTER_FORMAT=$COUNTER_FORMAT \
+    --env MERGE_MODE=$MERGE_MODE \
+    --env COUNTER_DTYPES="$COUNTER_DTYPES" \
+    --env STORAGE_COMPRESSION=$STORAGE_COMPRESSION \
+    --env STORAGE_LEVEL=$STORAGE_LEVEL \
+    --env STORAGE_CHUNKS="$STORAGE_CHUNKS" \
+    --env ACCUMULATION=$ACCUMULATION \
+    --env AGGREGATION=$AGGREGATION \
+    --env REGIONS="$REGIONS" \
+    --env SCHEDULER=$SCHEDULER \
+    --env WORKERS=$WORKERS \
+    --env MEMORY_BUDGET=$MEMORY_BUDGET \
     ${SIF_PATH} \
     python3 $HPCROOTDIR/runscripts/merger.py -c $configfile
\ No newline at end of file
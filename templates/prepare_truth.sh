@@ -0,0 +1,36 @@
+#!/bin/bash
+
+HPCROOTDIR=%HPCROOTDIR%
+EXPID=%DEFAULT.EXPID%
+JOBNAME=%JOBNAME%
+
+SIF_PATH=%PATHS.SIF_FOLDER%/image_era.sif
+
+JOBNAME_WITHOUT_EXPID=$(echo ${JOBNAME} | sed 's/^[^_]*_//')
+
+logs_dir=${HPCROOTDIR}/LOG_${EXPID}
+configfile=$logs_dir/config_${JOBNAME_WITHOUT_EXPID}
+PLATFORM_NAME=%PLATFORM.NAME%
+REGRID_CACHE=%DIAGNOSTIC.REGRID_CACHE%
+SCHEDULER=%DIAGNOSTIC.SCHEDULER%
+WORKERS=%DIAGNOSTIC.WORKERS%
+MEMORY_BUDGET=%DIAGNOSTIC.MEMORY_BUDGET%
+
+OUTPUT_PATH=%HPCROOTDIR%/outputs
+
+# Load Singularity module only on MareNostrum5
+if [ "$PLATFORM_NAME" = "MARENOSTRUM5" ]; then
+    ml singularity
+fi
+
+singularity exec --nv \
+    --bind $HPCROOTDIR \
+    --bind $OUTPUT_PATH \
+    --env HPCROOTDIR=$HPCROOTDIR \
+    --env configfile=$configfile \
+    --env REGRID_CACHE=$REGRID_CACHE \
+    --env SCHEDULER=$SCHEDULER \
+    --env WORKERS=$WORKERS \
+    --env MEMORY_BUDGET=$MEMORY_BUDGET \
+    ${SIF_PATH} \
+    python3 $HPCROOTDIR/runscripts/prepare_truth.py -c $configfile
\ No newline at end of file
@@ -11,6 +11,21 @@ JOBNAME_WITHOUT_EXPID=$(echo ${JOBNAME} | sed 's/^[^_]*_//')
 logs_dir=${HPCROOTDIR}/LOG_${EXPID}
 configfile=$logs_dir/config_${JOBNAME_WITHOUT_EXPID}
 PLATFORM_NAME=%PLATFORM.NAME%
+REGRID_CACHE=%DIAGNOSTIC.REGRID_CACHE%
+TILED=%DIAGNOSTIC.TILED%
+TILE_LEVELS=%DIAGNOSTIC.TILE_LEVELS%
+TILE_LATITUDES=%DIAGNOSTIC.TILE_LATITUDES%
+MEMORY_BUDGET=%DIAGNOSTIC.MEMORY_BUDGET%
+INCREMENT_DTYPES="%DIAGNOSTIC.INCREMENT_DTYPES%"
+STORAGE_COMPRESSION=%DIAGNOSTIC.STORAGE_COMPRESSION%
+STORAGE_LEVEL=%DIAGNOSTIC.STORAGE_LEVEL%
+STORAGE_CHUNKS="%DIAGNOSTIC.STORAGE_CHUNKS%"
+VAR_WORKERS=%DIAGNOSTIC.VAR_WORKERS%
+RANK_HISTOGRAM=%DIAGNOSTIC.RANK_HISTOGRAM%
+SCHEDULER=%DIAGNOSTIC.SCHEDULER%
+WORKERS=%DIAGNOSTIC.WORKERS%
+AGGREGATION=%DIAGNOSTIC.AGGREGATION%
+REGIONS="%DIAGNOSTIC.REGIONS%"
 
 OUTPUT_PATH=%HPCROOTDIR%/outputs
 
@@ -24,5 +39,20 @@ singularity exec --nv \
     --bind $OUTPUT_PATH \
     --env HPCROOTDIR=$HPCROOTDIR \
     --env configfile=$configfile \
+    --env REGRID_CACHE=$REGRID_CACHE \
+    --env TILED=$TILED \
+    --env TILE_LEVELS=$TILE_LEVELS \
+    --env TILE_LATITUDES=$TILE_LATITUDES \
+    --env MEMORY_BUDGET=$MEMORY_BUDGET \
+    --env INCREMENT_DTYPES="$INCREMENT_DTYPES" \
+    --env STORAGE_COMPRESSION=$STORAGE_COMPRESSION \
+    --env STORAGE_LEVEL=$STORAGE_LEVEL \
+    --env STORAGE_CHUNKS="$STORAGE_CHUNKS" \
+    --env VAR_WORKERS=$VAR_WORKERS \
+    --env RANK_HISTOGRAM=$RANK_HISTOGRAM \
+    --env SCHEDULER=$SCHEDULER \
+    --env WORKERS=$WORKERS \
+    --env AGGREGATION=$AGGREGATION \
+    --env REGIONS="$REGIONS" \
     ${SIF_PATH} \
     python3 $HPCROOTDIR/runscripts/probabilistic.py -c $configfile
\ No newline at end of file
@@ -0,0 +1,48 @@
+#!/bin/bash
+
+HPCROOTDIR=%HPCROOTDIR%
+EXPID=%DEFAULT.EXPID%
+JOBNAME=%JOBNAME%
+
+SIF_PATH=%PATHS.SIF_FOLDER%/image_eerie.sif
+
+JOBNAME_WITHOUT_EXPID=$(echo ${JOBNAME} | sed 's/^[^_]*_//')
+
+logs_dir=${HPCROOTDIR}/LOG_${EXPID}
+configfile=$logs_dir/config_${JOBNAME_WITHOUT_EXPID}
+PLATFORM_NAME=%PLATFORM.NAME%
+COUNTER_FORMAT=%DIAGNOSTIC.COUNTER_FORMAT%
+COUNTER_DTYPES="%DIAGNOSTIC.COUNTER_DTYPES%"
+STORAGE_COMPRESSION=%DIAGNOSTIC.STORAGE_COMPRESSION%
+STORAGE_LEVEL=%DIAGNOSTIC.STORAGE_LEVEL%
+STORAGE_CHUNKS="%DIAGNOSTIC.STORAGE_CHUNKS%"
+ACCUMULATION=%DIAGNOSTIC.ACCUMULATION%
+AGGREGATION=%DIAGNOSTIC.AGGREGATION%
+SCHEDULER=%DIAGNOSTIC.SCHEDULER%
+WORKERS=%DIAGNOSTIC.WORKERS%
+MEMORY_BUDGET=%DIAGNOSTIC.MEMORY_BUDGET%
+
+OUTPUT_PATH=%HPCROOTDIR%/outputs
+
+# Load Singularity module only on MareNostrum5
+if [ "$PLATFORM_NAME" = "MARENOSTRUM5" ]; then
+    ml singularity
+fi
+
+singularity exec --nv \
+    --bind $HPCROOTDIR \
+    --bind $OUTPUT_PATH \
+    --env HPCROOTDIR=$HPCROOTDIR \
+    --env configfile=$configfile \
+    --env COUNTER_FORMAT=$COUNTER_FORMAT \
+    --env COUNTER_DTYPES="$COUNTER_DTYPES" \
+    --env STORAGE_COMPRESSION=$STORAGE_COMPRESSION \
+    --env STORAGE_LEVEL=$STORAGE_LEVEL \
+    --env STORAGE_CHUNKS="$STORAGE_CHUNKS" \
+    --env ACCUMULATION=$ACCUMULATION \
+    --env AGGREGATION=$AGGREGATION \
+    --env SCHEDULER=$SCHEDULER \
+    --env WORKERS=$WORKERS \
+    --env MEMORY_BUDGET=$MEMORY_BUDGET \
+    ${SIF_PATH} \
+    python3 $HPCROOTDIR/runscripts/reduce_counters.py -c $configfile
\ No newline at end of file
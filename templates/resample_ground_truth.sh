@@ -11,6 +11,10 @@ JOBNAME_WITHOUT_EXPID=$(echo ${JOBNAME} | sed 's/^[^_]*_//')
 logs_dir=${HPCROOTDIR}/LOG_${EXPID}
 configfile=$logs_dir/config_${JOBNAME_WITHOUT_EXPID}
 PLATFORM_NAME=%PLATFORM.NAME%
+RESAMPLE_STREAMING=%DIAGNOSTIC.RESAMPLE_STREAMING%
+SCHEDULER=%DIAGNOSTIC.SCHEDULER%
+WORKERS=%DIAGNOSTIC.WORKERS%
+MEMORY_BUDGET=%DIAGNOSTIC.MEMORY_BUDGET%
 
 OUTPUT_PATH=%HPCROOTDIR%/outputs
 
@@ -23,5 +27,9 @@ singularity exec --nv \
     --bind $HPCROOTDIR \
     --env HPCROOTDIR=$HPCROOTDIR \
     --env configfile=$configfile \
+    --env RESAMPLE_STREAMING=$RESAMPLE_STREAMING \
+    --env SCHEDULER=$SCHEDULER \
+    --env WORKERS=$WORKERS \
+    --env MEMORY_BUDGET=$MEMORY_BUDGET \
     ${SIF_PATH} \
     python3 $HPCROOTDIR/runscripts/resample_ground.py -c $configfile
\ No newline at end of file
@@ -12,6 +12,11 @@ logs_dir=${HPCROOTDIR}/LOG_${EXPID}
 configfile=$logs_dir/config_${JOBNAME_WITHOUT_EXPID}
 PLATFORM_NAME=%PLATFORM.NAME%
 EERIE_MEMBERS="%EERIE.MEMBERS%"
+EERIE_VALIDATION=%DIAGNOSTIC.EERIE_VALIDATION%
+EERIE_INGESTION=%DIAGNOSTIC.EERIE_INGESTION%
+SCHEDULER=%DIAGNOSTIC.SCHEDULER%
+WORKERS=%DIAGNOSTIC.WORKERS%
+MEMORY_BUDGET=%DIAGNOSTIC.MEMORY_BUDGET%
 
 OUTPUT_PATH=%HPCROOTDIR%/outputs
 
@@ -25,5 +30,10 @@ singularity exec --nv \
     --env HPCROOTDIR=$HPCROOTDIR \
     --env configfile=$configfile \
     --env EERIE_MEMBERS="$EERIE_MEMBERS" \
+    --env EERIE_VALIDATION=$EERIE_VALIDATION \
+    --env EERIE_INGESTION=$EERIE_INGESTION \
+    --env SCHEDULER=$SCHEDULER \
+    --env WORKERS=$WORKERS \
+    --env MEMORY_BUDGET=$MEMORY_BUDGET \
     ${SIF_PATH} \
     python3 $HPCROOTDIR/runscripts/restore_eerie.py -c $configfile
\ No newline at end of file